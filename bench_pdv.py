@@ -0,0 +1,617 @@
+"""
+Benchmarks do PDV.
+
+Uso:
+    python bench_pdv.py scan [--products N] [--scans N]
+    python bench_pdv.py search [--products N] [--queries N]
+    python bench_pdv.py checkout [--products N] [--sales N]
+    python bench_pdv.py customers [--customers N] [--queries N]
+    python bench_pdv.py importtime [--runs N] [--budget-ms MS]
+    python bench_pdv.py startup [--sizes N,N,...] [--runs N] [--output JSON] [--compare JSON]
+
+Cada subcomando cria um banco de dados temporário, executa o cenário medido
+e imprime as latências (mediana, p95 e máximo) em milissegundos. O importtime
+mede a importação de pdv com `python -X importtime` e termina com código 1 se
+ela regredir (ver bench_importtime). O startup precisa do Xvfb (ou de um DISPLAY)
+e grava os resultados em JSON (ver bench_startup).
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pdv
+
+
+PRODUCT_WORDS = (
+    ("Arroz", "Feijão", "Café", "Açúcar", "Leite", "Biscoito", "Sabão", "Detergente", "Refrigerante", "Suco"),
+    ("Integral", "Tradicional", "Extra", "Light", "Premium", "Orgânico", "Zero", "Original"),
+    ("Tio João", "Camil", "Pilão", "União", "Nestlé", "Ypê", "Omo", "Coca-Cola", "Del Valle", "Marilan"),
+    ("1kg", "500g", "2L", "350ml", "200g", "5kg", "1L", "Pacote", "Caixa", "Unidade"),
+)
+
+
+def product_name(rng, index):
+    words = [rng.choice(group) for group in PRODUCT_WORDS]
+    return f"{' '.join(words)} {index:06d}"
+
+
+def product_barcode(product_id):
+    """
+    Código EAN-13 fictício (prefixo 789, Brasil) e determinístico para o produto.
+    """
+    return f"789{product_id:09d}0"
+
+
+def create_database(path, product_count):
+    """
+    Cria um banco de dados com o esquema do PDV e `product_count` produtos.
+    """
+    db = pdv.Database(path)
+    db.migrate()
+    rng = random.Random(42)
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO products (name, price_cents, stock) VALUES (?, ?, ?)",
+            ((product_name(rng, i), rng.randint(100, 50000), rng.randint(0, 1000)) for i in range(product_count))
+        )
+        cursor.executemany(
+            "INSERT INTO product_barcodes (code, product_id) VALUES (?, ?)",
+            ((product_barcode(product_id), product_id) for product_id in range(1, product_count + 1))
+        )
+    return db
+
+
+CUSTOMER_FIRST_NAMES = ("Ana", "Bruno", "Carla", "Daniel", "Eduarda", "Felipe", "Gabriela", "Henrique", "Maria", "João")
+CUSTOMER_LAST_NAMES = ("Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Costa", "Almeida")
+
+
+def insert_customers(db, count, rng):
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO customers (name, phone, email) VALUES (?, ?, ?)",
+            ((f"{rng.choice(CUSTOMER_FIRST_NAMES)} {rng.choice(CUSTOMER_LAST_NAMES)} {i}", f"(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+              f"cliente{i}@exemplo.com.br")
+             for i in range(count))
+        )
+
+
+def summarize(label, samples):
+    samples_ms = sorted(s * 1000 for s in samples)
+    p95 = samples_ms[max(0, int(len(samples_ms) * 0.95) - 1)]
+    print(f"{label:<40} mediana={statistics.median(samples_ms):8.3f} ms  p95={p95:8.3f} ms  max={samples_ms[-1]:8.3f} ms")
+
+
+def bench_scan(args):
+    """
+    Latência por leitura de código de barras: busca do produto + recarga da lista de
+    produtos da tela de vendas (como fazia a leitura por ID), contra a busca única
+    em product_barcodes usada por handle_sales_scan.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = create_database(path, args.products)
+        rng = random.Random(7)
+        product_ids = [rng.randint(1, args.products) for _ in range(args.scans)]
+
+        def scan_per_call_connect(product_id):
+            conn = sqlite3.connect(path)
+            conn.execute("SELECT name, price_cents, stock FROM products WHERE id=?", (product_id,)).fetchone()
+            conn.close()
+            conn = sqlite3.connect(path)
+            conn.execute("SELECT id, name, price_cents, stock FROM products ORDER BY name").fetchall()
+            conn.close()
+
+        def scan_shared_connection(product_id):
+            db.fetchone("SELECT name, price_cents, stock FROM products WHERE id=?", (product_id,))
+            db.fetchall("SELECT id, name, price_cents, stock FROM products ORDER BY name")
+
+        def lookup_per_call_connect(product_id):
+            conn = sqlite3.connect(path)
+            conn.execute("SELECT name, price_cents, stock FROM products WHERE id=?", (product_id,)).fetchone()
+            conn.close()
+
+        def lookup_shared_connection(product_id):
+            db.fetchone("SELECT name, price_cents, stock FROM products WHERE id=?", (product_id,))
+
+        def scan_barcode(product_id):
+            pdv.find_product_by_code(db, product_barcode(product_id))
+
+        print(f"Banco com {args.products} produtos, {args.scans} leituras por cenário")
+        for label, scenario in (
+            ("busca (conexão por chamada)", lookup_per_call_connect),
+            ("busca (conexão compartilhada)", lookup_shared_connection),
+            ("busca + recarga (conexão por chamada)", scan_per_call_connect),
+            ("busca + recarga (conexão compartilhada)", scan_shared_connection),
+            ("código de barras (find_product_by_code)", scan_barcode),
+        ):
+            samples = []
+            for product_id in product_ids:
+                start = time.perf_counter()
+                scenario(product_id)
+                samples.append(time.perf_counter() - start)
+            summarize(label, samples)
+        db.close()
+
+
+def bench_search(args):
+    """
+    Latência da busca de produtos digitada nas telas de vendas e gestão: o antigo
+    LIKE '%termo%' (varredura completa) contra search_products (FTS5 trigram).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = create_database(path, args.products)
+        rng = random.Random(11)
+        # Termos como digitados no caixa: prefixos curtos, trechos do meio do nome e IDs
+        terms = []
+        for _ in range(args.queries):
+            word = rng.choice(rng.choice(PRODUCT_WORDS))
+            kind = rng.random()
+            if kind < 0.2:
+                terms.append(word[:2].lower())
+            elif kind < 0.8:
+                start = rng.randint(0, max(0, len(word) - 3))
+                terms.append(word[start:start + rng.randint(3, 6)].lower())
+            else:
+                terms.append(str(rng.randint(1, args.products)))
+
+        def search_like(term):
+            db.fetchall("SELECT id, name, price_cents, stock FROM products WHERE LOWER(name) LIKE ? OR CAST(id AS TEXT) LIKE ? ORDER BY name",
+                        (f"%{term}%", f"%{term}%"))
+
+        def search_fts(term):
+            pdv.search_products(db, term)
+
+        print(f"Banco com {args.products} produtos, {args.queries} buscas por cenário")
+        for label, scenario in (
+            ("busca LIKE '%termo%'", search_like),
+            ("busca FTS5 (search_products)", search_fts),
+        ):
+            samples = []
+            for term in terms:
+                start = time.perf_counter()
+                scenario(term)
+                samples.append(time.perf_counter() - start)
+            summarize(label, samples)
+        db.close()
+
+
+def bench_checkout(args):
+    """
+    Latência de registro de uma venda por tamanho da cesta (1 a 200 linhas): a
+    gravação antiga (leitura do estoque linha a linha, depois INSERT e UPDATE por
+    linha numa transação BEGIN comum) contra pdv.checkout (BEGIN IMMEDIATE, UPDATE
+    condicional por linha e executemany nas linhas da venda).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = create_database(path, args.products)
+        db.execute("UPDATE products SET stock = 1000000000") # Nenhuma venda falha por estoque
+        rng = random.Random(3)
+        products = {row[0]: row[1:] for row in db.fetchall("SELECT id, name, price_cents FROM products")}
+
+        def basket(size):
+            return [(product_id, products[product_id][0], rng.randint(1, 5), products[product_id][1])
+                    for product_id in rng.sample(range(1, args.products + 1), size)]
+
+        def sale_row():
+            return {
+                'sold_at': int(time.time()),
+                'total_cents': 0,
+                'customer_name': "",
+                'payment_method': "Dinheiro",
+                'discount_value': 0.0,
+                'discount_type': "Porcentagem",
+                'received_cents': 0,
+                'change_cents': 0,
+            }
+
+        def checkout_per_line(items):
+            for product_id, _, quantity, _ in items:
+                stock = db.fetchvalue("SELECT stock FROM products WHERE id=?", (product_id,))
+                if quantity > stock:
+                    raise RuntimeError("estoque insuficiente")
+            with db.transaction() as cursor:
+                sale = sale_row()
+                cursor.execute(f"INSERT INTO sales ({', '.join(sale)}) VALUES ({', '.join('?' * len(sale))})", tuple(sale.values()))
+                sale_id = cursor.lastrowid
+                for product_id, product_name, quantity, price_cents in items:
+                    cursor.execute("INSERT INTO sale_items (sale_id, product_id, product_name, quantity, price_cents) VALUES (?, ?, ?, ?, ?)",
+                                   (sale_id, product_id, product_name, quantity, price_cents))
+                    cursor.execute("UPDATE products SET stock = stock - ? WHERE id=?", (quantity, product_id))
+
+        def checkout_atomic(items):
+            pdv.checkout(db, sale_row(), items)
+
+        print(f"Banco com {args.products} produtos, {args.sales} vendas por cenário")
+        for size in (1, 5, 20, 50, 100, 200):
+            baskets = [basket(size) for _ in range(args.sales)]
+            for label, scenario in (
+                (f"{size:>3} linhas (leitura + UPDATE por linha)", checkout_per_line),
+                (f"{size:>3} linhas (pdv.checkout)", checkout_atomic),
+            ):
+                samples = []
+                for items in baskets:
+                    start = time.perf_counter()
+                    scenario(items)
+                    samples.append(time.perf_counter() - start)
+                summarize(label, samples)
+        db.close()
+
+
+def bench_customers(args):
+    """
+    Latência da busca de clientes. Seletor da tela de vendas: a carga de todos os
+    nomes no combobox seguida da busca do ID pelo nome escolhido, contra
+    search_customers a cada busca digitada. Tela de clientes: os quatro
+    LIKE '%termo%' (nome, telefone, e-mail e ID) contra search_customers com o
+    limite da tela (colunas normalizadas e customers_fts).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = pdv.Database(path)
+        db.migrate()
+        rng = random.Random(5)
+        insert_customers(db, args.customers, rng)
+        names = [row[0] for row in db.fetchall("SELECT name FROM customers")]
+        terms = []
+        for _ in range(args.queries):
+            kind = rng.random()
+            if kind < 0.5:
+                terms.append(rng.choice(names)[:rng.randint(2, 8)].lower())
+            elif kind < 0.6:
+                terms.append(rng.choice(CUSTOMER_LAST_NAMES).lower())
+            elif kind < 0.7:
+                terms.append(f"(11) 9{rng.randint(10, 99)}")
+            elif kind < 0.8:
+                terms.append(f"cliente{rng.randint(0, args.customers - 1)}@exemplo.com.br")
+            else:
+                terms.append(str(rng.randint(1, args.customers)))
+
+        def load_all_names(term):
+            db.fetchall("SELECT name FROM customers ORDER BY name")
+            db.fetchone("SELECT id FROM customers WHERE name=?", (rng.choice(names),))
+
+        def search_prefix(term):
+            pdv.search_customers(db, term)
+
+        def management_like(term):
+            db.fetchall("SELECT id, name, phone, email FROM customers WHERE LOWER(name) LIKE ? OR LOWER(phone) LIKE ? OR LOWER(email) LIKE ? OR CAST(id AS TEXT) LIKE ? ORDER BY name",
+                        (f"%{term}%", f"%{term}%", f"%{term}%", f"%{term}%"))
+
+        def management_search(term):
+            pdv.search_customers(db, term, columns=("id", "name", "phone", "email"), limit=pdv.CUSTOMER_MANAGEMENT_SEARCH_LIMIT)
+
+        print(f"Banco com {args.customers} clientes, {args.queries} buscas por cenário")
+        for label, scenario in (
+            ("seletor: carga de todos os nomes", load_all_names),
+            ("seletor: search_customers", search_prefix),
+            ("gestão: 4x LIKE '%termo%'", management_like),
+            ("gestão: search_customers", management_search),
+        ):
+            samples = []
+            for term in terms:
+                start = time.perf_counter()
+                scenario(term)
+                samples.append(time.perf_counter() - start)
+            summarize(label, samples)
+        db.close()
+
+
+DEFERRED_MODULES = ("PIL", "reportlab") # Carregados no primeiro uso (pdv.LazyImport)
+
+
+def parse_importtime(stderr):
+    """
+    Lê a saída de `-X importtime` e retorna [(módulo, profundidade, próprio_us, acumulado_us)].
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def bench_importtime(args):
+    """
+    Tempo de importação de pdv em um interpretador novo (o custo pago antes da
+    janela de login aparecer). Falha se algum módulo de DEFERRED_MODULES for
+    importado na abertura ou se a mediana passar de --budget-ms.
+    """
+    command = [sys.executable, "-X", "importtime", "-c", "import pdv"]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run(command, cwd=cwd, capture_output=True, check=True) # Compila os .pyc antes de medir
+    totals = []
+    for _ in range(args.runs):
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True, check=True)
+        entries = parse_importtime(result.stderr)
+        totals.append(next(cumulative for name, depth, _, cumulative in entries if name == "pdv" and depth == 0))
+
+    print(f"Importação de pdv ({args.runs} execuções)")
+    print(f"{'total':<40} mediana={statistics.median(totals) / 1000:8.3f} ms  max={max(totals) / 1000:8.3f} ms")
+    heaviest = sorted((entry for entry in entries if entry[1] == 1), key=lambda entry: entry[3], reverse=True)
+    for name, _, _, cumulative in heaviest[:args.top]:
+        print(f"  {name:<38} {cumulative / 1000:8.3f} ms")
+
+    failures = []
+    deferred = sorted({name.split(".")[0] for name, _, _, _ in entries} & set(DEFERRED_MODULES))
+    if deferred:
+        failures.append(f"módulos que deveriam ser carregados sob demanda: {', '.join(deferred)}")
+    if statistics.median(totals) / 1000 > args.budget_ms:
+        failures.append(f"mediana acima do limite de {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"FALHA: {failure}")
+    return 1 if failures else 0
+
+
+STARTUP_SCREENS = ("sales", "history", "returns", "reports", "customers", "user_management", "products")
+BACKGROUND_QUERIES = ("image_gc", "history", "reports") # Chaves do DbWorker aguardadas após cada tela
+BENCH_USERNAME = "admin"
+
+
+def create_startup_database(path, size):
+    """
+    Banco para os cenários de abertura: `size` produtos e vendas (1 a 5 itens,
+    distribuídas no último ano), size // 10 clientes, um administrador e os
+    resumos diários dos relatórios.
+    """
+    db = create_database(path, size)
+    rng = random.Random(13)
+    insert_customers(db, max(1, size // 10), rng)
+    now = int(time.time())
+    sales, items = [], []
+    for sale_id in range(1, size + 1):
+        lines = [(rng.randint(1, size), rng.randint(1, 3), rng.randint(100, 50000)) for _ in range(rng.randint(1, 5))]
+        total_cents = sum(quantity * price_cents for _, quantity, price_cents in lines)
+        customer_id = rng.randint(1, max(1, size // 10)) if rng.random() < 0.3 else None
+        sales.append((now - rng.randint(0, 365 * 86400), total_cents, customer_id, rng.choice(("Dinheiro", "Pix", "Cartão de Débito")),
+                      total_cents, 0))
+        items.extend((sale_id, product_id, f"Produto {product_id}", quantity, price_cents) for product_id, quantity, price_cents in lines)
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO users (establishment_name, username, password_hash, role) VALUES (?, ?, ?, 'admin')",
+                       ("Mercado Benchmark", BENCH_USERNAME, hashlib.sha256(b"admin").hexdigest()))
+        cursor.executemany(
+            "INSERT INTO sales (sold_at, total_cents, customer_id, payment_method, received_cents, change_cents) VALUES (?, ?, ?, ?, ?, ?)",
+            sales
+        )
+        cursor.executemany("INSERT INTO sale_items (sale_id, product_id, product_name, quantity, price_cents) VALUES (?, ?, ?, ?, ?)", items)
+    pdv.rebuild_daily_aggregates(db)
+    db.close()
+
+
+def measure_startup(db_path):
+    """
+    Executa, neste processo, a abertura do PDV contra `db_path` e retorna
+    {fase: {"wall_ms", "peak_rss_kib"}}. O pico de memória é o ru_maxrss do
+    processo ao fim da fase (cumulativo, por isso cada execução é um processo novo).
+
+    A construção ociosa das telas é cancelada, então a primeira exibição de cada
+    tela inclui sua construção (o pior caso: o clique antes da tela estar pronta);
+    a segunda mede apenas a troca de tela e a recarga dos dados.
+    """
+    import resource
+    import customtkinter as ctk
+
+    results = {}
+
+    def phase(name, func):
+        start = time.perf_counter()
+        value = func()
+        results[name] = {
+            "wall_ms": (time.perf_counter() - start) * 1000,
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        return value
+
+    def settle(app, timeout=60.0):
+        # Processa os eventos até as consultas em segundo plano da tela serem entregues
+        deadline = time.perf_counter() + timeout
+        app.master.update()
+        while any(app.db_worker.is_pending(key) for key in BACKGROUND_QUERIES):
+            if time.perf_counter() > deadline:
+                raise TimeoutError("consultas em segundo plano não terminaram")
+            time.sleep(0.001)
+            app.master.update()
+
+    pdv.DB_NAME = db_path
+    auth_root = phase("ctk.CTk (login)", ctk.CTk)
+    phase("AuthApp.__init__", lambda: pdv.AuthApp(auth_root))
+    phase("AuthApp primeiro desenho", auth_root.update)
+    auth_root.destroy()
+
+    user_id = pdv.Database.shared(db_path).fetchvalue("SELECT id FROM users WHERE username=?", (BENCH_USERNAME,))
+    create_widgets = pdv.PdvApp.create_widgets
+    pdv.PdvApp.create_widgets = lambda app: phase("create_widgets", lambda: create_widgets(app))
+    root = phase("ctk.CTk (PDV)", ctk.CTk)
+    app = phase("PdvApp.__init__", lambda: pdv.PdvApp(root, user_id, BENCH_USERNAME, "Mercado Benchmark", "admin"))
+    pdv.PdvApp.create_widgets = create_widgets
+    if app.idle_build_job is not None:
+        root.after_cancel(app.idle_build_job)
+    phase("PdvApp primeiro desenho", lambda: settle(app))
+
+    for visit in ("primeira", "segunda"):
+        for screen in STARTUP_SCREENS:
+            phase(f"show_frame({screen}) {visit}", lambda: (app.show_frame(screen), settle(app)))
+
+    root.after_cancel(app.wal_checkpoint_job)
+    root.after_cancel(app.image_gc_job)
+    app.db_worker.shutdown()
+    root.destroy()
+    return results
+
+
+def start_virtual_display(display):
+    """
+    Inicia o Xvfb em `display` e retorna o processo, ou None se o executável não existir.
+    """
+    executable = shutil.which("Xvfb")
+    if executable is None:
+        return None
+    server = subprocess.Popen([executable, display, "-screen", "0", "1366x768x24", "-nolisten", "tcp"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = f"/tmp/.X11-unix/X{display.lstrip(':')}"
+    deadline = time.perf_counter() + 10
+    while not os.path.exists(socket_path):
+        if server.poll() is not None or time.perf_counter() > deadline:
+            server.terminate()
+            raise RuntimeError(f"Xvfb não iniciou no display {display}")
+        time.sleep(0.05)
+    return server
+
+
+def git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def bench_startup(args):
+    """
+    Abertura e troca de telas sob display virtual: AuthApp.__init__, PdvApp.__init__,
+    create_widgets e cada ramo de show_frame (ver measure_startup), contra bancos
+    de vários tamanhos. Cada execução roda em um processo novo; os resultados
+    (mediana e máximo de tempo e de pico de memória, além das amostras) são
+    gravados em JSON para comparação entre versões com --compare.
+    """
+    if args.measure:
+        with open(args.measure[1], "w", encoding="utf-8") as result_file:
+            json.dump(measure_startup(args.measure[0]), result_file)
+        return 0
+
+    env = dict(os.environ)
+    server = None
+    if args.display or not env.get("DISPLAY"):
+        server = start_virtual_display(args.display or ":99")
+        if server is None:
+            print("Xvfb não encontrado: instale-o (ex.: apt install xvfb) ou defina DISPLAY.")
+            return 2
+        env["DISPLAY"] = args.display or ":99"
+
+    report = {
+        "benchmark": "startup",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "results": [],
+    }
+    try:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                create_startup_database(path, size)
+                samples = {}
+                for run in range(args.runs):
+                    result_path = os.path.join(tmp, f"run{run}.json")
+                    # Diretório de trabalho próprio: o PDV cria product_images no diretório atual
+                    subprocess.run([sys.executable, os.path.abspath(__file__), "startup", "--measure", path, result_path],
+                                   cwd=tmp, env=env, check=True, stdout=subprocess.DEVNULL)
+                    with open(result_path, encoding="utf-8") as result_file:
+                        for name, values in json.load(result_file).items():
+                            samples.setdefault(name, []).append(values)
+            print(f"Banco com {size} produtos e vendas, {args.runs} execuções")
+            for name, values in samples.items():
+                wall = [value["wall_ms"] for value in values]
+                rss = [value["peak_rss_kib"] for value in values]
+                report["results"].append({
+                    "size": size,
+                    "phase": name,
+                    "wall_ms": {"median": statistics.median(wall), "max": max(wall), "samples": wall},
+                    "peak_rss_kib": {"median": statistics.median(rss), "max": max(rss), "samples": rss},
+                })
+                print(f"{name:<40} mediana={statistics.median(wall):9.3f} ms  max={max(wall):9.3f} ms  pico={max(rss) / 1024:7.1f} MiB")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2, ensure_ascii=False)
+    print(f"Resultados gravados em {args.output}")
+    if args.compare:
+        compare_startup(args.compare, report)
+    return 0
+
+
+def compare_startup(baseline_path, report):
+    """
+    Imprime a variação das medianas de tempo e de pico de memória de `report`
+    em relação a um JSON gravado anteriormente por bench_startup.
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {(entry["size"], entry["phase"]): entry for entry in baseline["results"]}
+    print(f"Comparação com {baseline_path} (revisão {baseline.get('revision')})")
+    for entry in report["results"]:
+        before = previous.get((entry["size"], entry["phase"]))
+        if before is None:
+            continue
+        changes = []
+        for metric in ("wall_ms", "peak_rss_kib"):
+            old, new = before[metric]["median"], entry[metric]["median"]
+            changes.append(f"{metric}={(new - old) / old * 100 if old else 0.0:+7.1f}%")
+        print(f"{entry['size']:>8} {entry['phase']:<40} {'  '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do PDV")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="Latência por leitura de código de barras")
+    scan_parser.add_argument("--products", type=int, default=5000)
+    scan_parser.add_argument("--scans", type=int, default=500)
+    scan_parser.set_defaults(func=bench_scan)
+
+    search_parser = subparsers.add_parser("search", help="Latência da busca de produtos por nome")
+    search_parser.add_argument("--products", type=int, default=50000)
+    search_parser.add_argument("--queries", type=int, default=300)
+    search_parser.set_defaults(func=bench_search)
+
+    checkout_parser = subparsers.add_parser("checkout", help="Latência de registro de vendas por tamanho da cesta")
+    checkout_parser.add_argument("--products", type=int, default=5000)
+    checkout_parser.add_argument("--sales", type=int, default=100)
+    checkout_parser.set_defaults(func=bench_checkout)
+
+    customers_parser = subparsers.add_parser("customers", help="Latência do seletor de clientes da tela de vendas")
+    customers_parser.add_argument("--customers", type=int, default=100000)
+    customers_parser.add_argument("--queries", type=int, default=300)
+    customers_parser.set_defaults(func=bench_customers)
+
+    importtime_parser = subparsers.add_parser("importtime", help="Tempo de importação de pdv (abertura a frio)")
+    importtime_parser.add_argument("--runs", type=int, default=5)
+    importtime_parser.add_argument("--budget-ms", type=float, default=500.0)
+    importtime_parser.add_argument("--top", type=int, default=10, help="Quantos imports diretos mais pesados exibir")
+    importtime_parser.set_defaults(func=bench_importtime)
+
+    startup_parser = subparsers.add_parser("startup", help="Abertura (login e PDV) e troca de telas sob Xvfb, com saída em JSON")
+    startup_parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[1000, 10000, 100000],
+                                help="Tamanhos dos bancos gerados, separados por vírgula (produtos e vendas)")
+    startup_parser.add_argument("--runs", type=int, default=3)
+    startup_parser.add_argument("--display", help="Display do Xvfb (padrão :99 quando DISPLAY não está definido)")
+    startup_parser.add_argument("--output", default="bench_startup.json")
+    startup_parser.add_argument("--compare", metavar="JSON", help="Resultados anteriores para comparar")
+    startup_parser.add_argument("--measure", nargs=2, metavar=("DB", "RESULT"), help=argparse.SUPPRESS) # Execução filha
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,2170 @@
 import customtkinter as ctk
-from tkinter import ttk, messagebox, Toplevel, scrolledtext, filedialog
+from tkinter import ttk, messagebox, Toplevel, scrolledtext, filedialog, Listbox
 import sqlite3
 from datetime import datetime, timedelta
 import hashlib # Para hash de senhas (melhor segurança)
 import os # Para lidar com caminhos de arquivo
 import shutil # Para operações de arquivo como cópia
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from PIL import Image, ImageTk # Importar para manipulação de imagens
+import threading # Conexões SQLite por thread
+import queue # Fila de consultas/resultados da thread de banco de dados
+import itertools
+import time # Carência do coletor de imagens órfãs
+from collections import OrderedDict # Cache LRU das miniaturas de produtos
+import re # Normalização dos termos de busca de clientes
+import string # Letras A-Z da comparação sem maiúsculas do SQLite (ver ascii_lower)
+import argparse # Opções de linha de comando (ex.: --rebuild-aggregates)
+import importlib # Dependências pesadas carregadas no primeiro uso (ver LazyImport)
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP # Valores monetários exatos (centavos)
+
+
+class LazyImport:
+    """
+    Módulo importado apenas no primeiro acesso a um de seus atributos.
+
+    O reportlab (recibos em PDF) e o Pillow (prévias de imagens) pesam na
+    abertura do programa, mas só são usados nessas duas funções; a janela de
+    login não deve pagar por eles. Uma dependência ausente só gera ImportError
+    quando a função que a usa é chamada.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name) # O import lock torna a carga segura entre threads
+        return getattr(self._module, attribute)
+
+
+pagesizes = LazyImport("reportlab.lib.pagesizes")
+canvas = LazyImport("reportlab.pdfgen.canvas")
+units = LazyImport("reportlab.lib.units")
+Image = LazyImport("PIL.Image") # Manipulação de imagens
+ImageTk = LazyImport("PIL.ImageTk")
 
 # Configuração inicial do tema CustomTkinter
 ctk.set_appearance_mode("Light")  # Tema inicial: Claro
 ctk.set_default_color_theme("blue") # Base do tema de cores para usar CustomTkinter
 
+DB_NAME = "pdv.db" # Usaremos o mesmo DB para usuários e PDV
+PRODUCT_SEARCH_LIMIT = 200 # Máximo de produtos exibidos por busca (os mais relevantes primeiro)
+CUSTOMER_SEARCH_LIMIT = 30 # Máximo de clientes sugeridos pela busca da tela de vendas
+CUSTOMER_MANAGEMENT_SEARCH_LIMIT = 200 # Máximo de clientes exibidos por busca na tela de clientes
+RETURN_SALES_SEARCH_LIMIT = 200 # Máximo de vendas exibidas por busca na tela de devoluções (as mais recentes primeiro)
+NO_CUSTOMER_OPTION = "-- Selecione um Cliente (Opcional) --"
+NO_CUSTOMER_MATCHES = "Nenhum cliente encontrado (será registrado como nome avulso)"
+CUSTOMER_SUGGESTION_ROWS = 8 # Linhas visíveis na lista de clientes sugeridos da tela de vendas
+PRODUCT_IMAGES_DIR = "product_images" # Armazenamento das imagens de produtos (ver import_product_image)
+
+# Perfil de armazenamento aplicado (via PRAGMA) a cada conexão aberta.
+# Pode ser sobrescrito parcialmente com Database(path, profile={...}).
+STORAGE_PROFILE = {
+    "journal_mode": "WAL", # Leitores (relatórios) não bloqueiam o caixa que grava a venda
+    "synchronous": "NORMAL", # Em WAL, fsync apenas nos checkpoints e não a cada commit
+    "cache_size": -32768, # Valor negativo = KiB (32 MiB de cache de páginas por conexão)
+    "mmap_size": 268435456, # 256 MiB de leitura via memória mapeada
+    "temp_store": "MEMORY", # Tabelas temporárias e ordenações em memória
+    "wal_autocheckpoint": 1000, # Checkpoint automático (PASSIVE) a cada ~1000 páginas no -wal
+    "journal_size_limit": 67108864, # Após o checkpoint, o -wal é truncado para no máximo 64 MiB
+}
+
+
+class Database:
+    """
+    Camada de acesso ao banco de dados compartilhada por todas as telas.
+
+    Mantém uma única conexão de longa duração por thread (em vez de abrir e fechar
+    uma conexão a cada consulta). As instruções preparadas ficam no cache de
+    instruções do próprio módulo sqlite3, que reaproveita o SQL compilado sempre
+    que o mesmo texto de consulta é executado novamente na mesma conexão.
+
+    As conexões operam em modo autocommit; escritas que precisam ser atômicas
+    devem usar o gerenciador de contexto `transaction()`.
+    """
+
+    STATEMENT_CACHE_SIZE = 256 # Consultas distintas mantidas compiladas por conexão
+    CHECKPOINT_INTERVAL_MS = 5 * 60 * 1000 # Intervalo do checkpoint periódico do WAL
+    CHECKPOINT_TRUNCATE_BYTES = 32 * 1024 * 1024 # Acima deste tamanho o -wal é zerado (TRUNCATE)
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, profile=None):
+        self.path = path
+        self.profile = dict(STORAGE_PROFILE, **(profile or {}))
+        self._schema_ready = False
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path=DB_NAME):
+        """
+        Retorna a instância compartilhada para o arquivo de banco de dados informado,
+        para que AuthApp e PdvApp usem as mesmas conexões.
+        """
+        with cls._instances_lock:
+            instance = cls._instances.get(path)
+            if instance is None:
+                instance = cls(path)
+                cls._instances[path] = instance
+            return instance
+
+    @property
+    def connection(self):
+        """
+        Conexão da thread atual, aberta na primeira utilização.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def _open(self):
+        # check_same_thread=False apenas para permitir que close() feche conexões de
+        # outras threads; cada conexão continua sendo usada somente pela sua thread.
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=self.STATEMENT_CACHE_SIZE)
+        for pragma, value in self.profile.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        conn.execute("PRAGMA foreign_keys = ON") # Sempre ativo, independentemente do perfil
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def close_thread_connection(self):
+        """
+        Fecha a conexão da thread atual, se houver (chamado por threads auxiliares,
+        como a do DbWorker, ao terminar, para não deixar a conexão aberta).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._connections_lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Aviso: erro ao fechar conexão com o banco de dados: {e}")
+
+    def execute(self, sql, params=()):
+        return self.connection.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.connection.executemany(sql, seq_of_params)
+
+    def fetchone(self, sql, params=()):
+        return self.connection.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        return self.connection.execute(sql, params).fetchall()
+
+    def fetchvalue(self, sql, params=(), default=None):
+        """
+        Retorna a primeira coluna da primeira linha do resultado, ou `default`.
+        """
+        row = self.connection.execute(sql, params).fetchone()
+        if row is None or row[0] is None:
+            return default
+        return row[0]
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Escopo transacional explícito. Faz COMMIT ao sair normalmente e ROLLBACK em caso
+        de exceção. Transações aninhadas viram SAVEPOINTs da transação externa.
+
+        Args:
+            immediate: Usa BEGIN IMMEDIATE, reservando a escrita logo no início.
+        """
+        conn = self.connection
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            savepoint = f"sp_{depth}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+        else:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        self._local.depth = depth + 1
+        try:
+            yield conn.cursor()
+        except BaseException:
+            if depth:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            else:
+                conn.execute("ROLLBACK")
+            raise
+        else:
+            if depth:
+                conn.execute(f"RELEASE {savepoint}")
+            else:
+                conn.execute("COMMIT")
+        finally:
+            self._local.depth = depth
+
+    def migrate(self):
+        """
+        Leva o esquema do banco até a versão mais recente de MIGRATIONS.
+
+        A versão aplicada fica em PRAGMA user_version; cada passo pendente roda uma
+        única vez, dentro da sua própria transação, e um banco já atualizado custa
+        apenas a leitura de user_version (uma vez por processo).
+        """
+        if self._schema_ready:
+            return
+        conn = self.connection
+        current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        pending = [migration for migration in MIGRATIONS if migration[0] > current_version]
+        if pending:
+            # Reconstruções de tabela exigem as FKs desligadas, o que só pode ser
+            # alterado fora de uma transação.
+            conn.execute("PRAGMA foreign_keys = OFF")
+            try:
+                for version, description, step in pending:
+                    with self.transaction(immediate=True) as cursor:
+                        # Outro processo pode ter aplicado o passo enquanto aguardávamos o lock
+                        if cursor.execute("PRAGMA user_version").fetchone()[0] >= version:
+                            continue
+                        print(f"Aplicando migração {version}: {description}")
+                        step(cursor)
+                        cursor.execute(f"PRAGMA user_version = {version}")
+                violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if violations:
+                    print(f"Aviso: {len(violations)} registro(s) com chave estrangeira inválida encontrados após a migração.")
+            finally:
+                conn.execute("PRAGMA foreign_keys = ON")
+        self._schema_ready = True
+
+    @property
+    def wal_path(self):
+        return self.path + "-wal"
+
+    def checkpoint(self, mode="PASSIVE"):
+        """
+        Executa um checkpoint do WAL, transferindo as páginas para o arquivo principal.
+
+        Args:
+            mode: PASSIVE (não espera leitores/escritores), FULL, RESTART ou TRUNCATE
+                  (zera o arquivo -wal ao final).
+
+        Returns:
+            Tupla (busy, páginas no log, páginas transferidas).
+        """
+        return self.connection.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def run_checkpoint_policy(self):
+        """
+        Política de checkpoint periódico: um checkpoint PASSIVE a cada execução e, se o
+        arquivo -wal tiver crescido além de CHECKPOINT_TRUNCATE_BYTES (por exemplo, por
+        leitores longos que impediram os checkpoints automáticos), um TRUNCATE para
+        devolver o espaço em disco.
+        """
+        try:
+            wal_size = os.path.getsize(self.wal_path)
+        except OSError:
+            return None
+        mode = "TRUNCATE" if wal_size > self.CHECKPOINT_TRUNCATE_BYTES else "PASSIVE"
+        return self.checkpoint(mode)
+
+    def backup_to(self, destination_path):
+        """
+        Copia o banco de dados para `destination_path` usando a API de backup do SQLite,
+        que inclui as transações ainda presentes apenas no arquivo -wal.
+        """
+        destination = sqlite3.connect(destination_path)
+        try:
+            self.connection.backup(destination)
+        finally:
+            destination.close()
+
+    def replace_with(self, source_path):
+        """
+        Substitui o arquivo do banco de dados por `source_path` (restauração de backup).
+        Fecha as conexões e remove os arquivos -wal/-shm antigos, que de outra forma
+        seriam aplicados sobre o banco restaurado.
+        """
+        self.close()
+        self._schema_ready = False # O backup pode ter sido feito com um esquema mais antigo
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        shutil.copyfile(source_path, self.path)
+
+    def close(self):
+        """
+        Fecha todas as conexões abertas (de todas as threads). Usado antes de substituir
+        o arquivo do banco de dados; a próxima consulta reabre a conexão automaticamente.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Aviso: erro ao fechar conexão com o banco de dados: {e}")
+        self._local = threading.local()
+
+
+def _table_sql(cursor, table):
+    """
+    Retorna o CREATE TABLE armazenado em sqlite_master, ou None se a tabela não existir.
+    """
+    row = cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+def _table_columns(cursor, table):
+    return [col[1] for col in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _rebuild_table(cursor, table, create_sql, columns, select_exprs=None, post_statements=()):
+    """
+    Recria `table` com uma nova definição, preservando os dados (procedimento
+    recomendado pelo SQLite: criar nova tabela, copiar, excluir a antiga, renomear).
+    Renomear a tabela antiga em vez da nova faria o SQLite reescrever as chaves
+    estrangeiras das outras tabelas para o nome temporário.
+
+    Args:
+        create_sql: CREATE TABLE com o marcador {name} no lugar do nome da tabela.
+        columns: Colunas de destino copiadas da tabela antiga.
+        select_exprs: Expressões SELECT correspondentes (padrão: as próprias colunas).
+        post_statements: Índices/gatilhos a recriar após a troca.
+    """
+    new_table = f"new_{table}"
+    cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+    cursor.execute(create_sql.format(name=new_table))
+    cursor.execute(f"INSERT INTO {new_table} ({', '.join(columns)}) SELECT {', '.join(select_exprs or columns)} FROM {table}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    for statement in post_statements:
+        cursor.execute(statement)
+
+
+def _migration_001_base_schema(cursor):
+    """
+    Esquema base. Em bancos novos cria todas as tabelas; em bancos criados por versões
+    anteriores (que não registravam user_version) adiciona as colunas que faltarem e
+    remove a restrição UNIQUE antiga de users.establishment_name.
+    """
+    users_table_sql = """
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            establishment_name TEXT NOT NULL,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'caixa' NOT NULL
+        )
+    """
+    existing_users_sql = _table_sql(cursor, "users")
+    if existing_users_sql is None:
+        cursor.execute(users_table_sql.format(name="users"))
+    else:
+        # Garante que a coluna 'role' exista, para compatibilidade com DBs muito antigos
+        if 'role' not in _table_columns(cursor, "users"):
+            cursor.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'caixa' NOT NULL")
+        if "establishment_name TEXT NOT NULL UNIQUE" in existing_users_sql:
+            _rebuild_table(cursor, "users", users_table_sql,
+                           ["id", "establishment_name", "username", "password_hash", "role"])
+
+    # Tabela de produtos
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            price REAL NOT NULL,
+            stock INTEGER NOT NULL,
+            image_path TEXT DEFAULT NULL
+        )
+    """)
+    if 'image_path' not in _table_columns(cursor, "products"):
+        cursor.execute("ALTER TABLE products ADD COLUMN image_path TEXT DEFAULT NULL")
+
+    # Tabela de clientes
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT,
+            email TEXT
+        )
+    """)
+
+    # Tabela de vendas
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            total REAL NOT NULL,
+            customer_id INTEGER,
+            customer_name TEXT,
+            payment_method TEXT,
+            discount_value REAL DEFAULT 0.0,
+            discount_type TEXT DEFAULT 'Nenhum',
+            received_amount REAL DEFAULT 0.0,
+            change_amount REAL DEFAULT 0.0,
+            FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL
+        )
+    """)
+    sales_columns = _table_columns(cursor, "sales")
+    for column, definition in (("customer_id", "INTEGER"),
+                               ("customer_name", "TEXT"),
+                               ("payment_method", "TEXT"),
+                               ("discount_value", "REAL DEFAULT 0.0"),
+                               ("discount_type", "TEXT DEFAULT 'Nenhum'"),
+                               ("received_amount", "REAL DEFAULT 0.0"),
+                               ("change_amount", "REAL DEFAULT 0.0")):
+        if column not in sales_columns:
+            cursor.execute(f"ALTER TABLE sales ADD COLUMN {column} {definition}")
+
+    # Tabela de itens de venda
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sale_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    """)
+
+    # Tabela para registrar devoluções
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS returns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            return_timestamp TEXT NOT NULL,
+            reason TEXT,
+            processed_by_user_id INTEGER NOT NULL,
+            FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id),
+            FOREIGN KEY (processed_by_user_id) REFERENCES users (id)
+        )
+    """)
+
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_name_phone_email ON customers (name, phone, email)",
+        "CREATE INDEX IF NOT EXISTS idx_customers_name ON customers (name)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_timestamp ON sales (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_customer_name ON sales (customer_name)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_customer_id ON sales (customer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items (sale_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_product_id ON sale_items (product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_product_name ON sale_items (product_name)",
+        "CREATE INDEX IF NOT EXISTS idx_returns_sale_id ON returns (sale_id)",
+        "CREATE INDEX IF NOT EXISTS idx_returns_timestamp ON returns (return_timestamp)",
+    ):
+        cursor.execute(statement)
+
+
+def _migration_002_sales_customer_fk(cursor):
+    """
+    Bancos antigos receberam sales.customer_id via ALTER TABLE ADD COLUMN, que não cria
+    a chave estrangeira. Reconstrói 'sales' com a FK (ON DELETE SET NULL), desvinculando
+    vendas de clientes que já foram excluídos.
+
+    Também corrige 'returns' em bancos cuja FK de processed_by_user_id foi reescrita
+    para 'old_users' pela antiga migração de 'users' (que renomeava a tabela original).
+    """
+    if not any(fk[2] == "customers" for fk in cursor.execute("PRAGMA foreign_key_list(sales)").fetchall()):
+        sales_columns = ["id", "timestamp", "total", "customer_id", "customer_name", "payment_method",
+                         "discount_value", "discount_type", "received_amount", "change_amount"]
+        select_exprs = [col if col != "customer_id"
+                        else "CASE WHEN customer_id IN (SELECT id FROM customers) THEN customer_id END"
+                        for col in sales_columns]
+        _rebuild_table(cursor, "sales", """
+            CREATE TABLE {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                total REAL NOT NULL,
+                customer_id INTEGER,
+                customer_name TEXT,
+                payment_method TEXT,
+                discount_value REAL DEFAULT 0.0,
+                discount_type TEXT DEFAULT 'Nenhum',
+                received_amount REAL DEFAULT 0.0,
+                change_amount REAL DEFAULT 0.0,
+                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL
+            )
+        """, sales_columns, select_exprs, post_statements=(
+            "CREATE INDEX idx_sales_timestamp ON sales (timestamp)",
+            "CREATE INDEX idx_sales_customer_name ON sales (customer_name)",
+            "CREATE INDEX idx_sales_customer_id ON sales (customer_id)",
+        ))
+
+    if "old_users" in (_table_sql(cursor, "returns") or ""):
+        _rebuild_table(cursor, "returns", """
+            CREATE TABLE {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sale_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                product_name TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                return_timestamp TEXT NOT NULL,
+                reason TEXT,
+                processed_by_user_id INTEGER NOT NULL,
+                FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+                FOREIGN KEY (product_id) REFERENCES products (id),
+                FOREIGN KEY (processed_by_user_id) REFERENCES users (id)
+            )
+        """, ["id", "sale_id", "product_id", "product_name", "quantity", "return_timestamp", "reason", "processed_by_user_id"],
+            post_statements=(
+                "CREATE INDEX idx_returns_sale_id ON returns (sale_id)",
+                "CREATE INDEX idx_returns_timestamp ON returns (return_timestamp)",
+            ))
+
+
+def _migration_003_products_fts(cursor):
+    """
+    Índice de texto completo (FTS5, tokenizador trigram) sobre o nome dos produtos,
+    mantido em sincronia com 'products' por gatilhos. O trigram permite buscar
+    qualquer trecho do nome com 3 ou mais caracteres, sem diferenciar maiúsculas.
+    Para termos mais curtos, a busca por prefixo usa o índice NOCASE.
+    """
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name,
+            content='products',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    """)
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    for statement in PRODUCTS_FTS_TRIGGERS:
+        cursor.execute(statement)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name_nocase ON products (name COLLATE NOCASE)")
+
+
+# Gatilhos que mantêm products_fts atualizado. Precisam ser recriados sempre que
+# 'products' for reconstruída, pois DROP TABLE remove os gatilhos da tabela.
+PRODUCTS_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+)
+
+
+def _migration_004_product_barcodes(cursor):
+    """
+    Códigos de barras (EAN-13/GTIN, ou qualquer código interno) dos produtos.
+    Um produto pode ter vários códigos; cada código pertence a um único produto.
+    A chave primária sem rowid faz da leitura no caixa uma única busca na árvore.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_barcodes (
+            code TEXT PRIMARY KEY,
+            product_id INTEGER NOT NULL,
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_barcodes_product_id ON product_barcodes (product_id)")
+
+
+def _migration_005_integer_cents(cursor):
+    """
+    Valores monetários passam a ser gravados como INTEGER em centavos (price_cents,
+    total_cents, received_cents, change_cents), de modo que somas (relatórios) e
+    descontos sejam exatos e calculados com aritmética inteira. discount_value
+    continua REAL: guarda o desconto como digitado (porcentagem ou reais).
+    """
+    def cents(column):
+        return f"CAST(ROUND({column} * 100) AS INTEGER)"
+
+    _rebuild_table(cursor, "products", """
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            price_cents INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            image_path TEXT DEFAULT NULL
+        )
+    """, ["id", "name", "price_cents", "stock", "image_path"],
+        ["id", "name", cents("price"), "stock", "image_path"],
+        post_statements=(
+            "CREATE INDEX idx_products_name ON products (name)",
+            "CREATE INDEX idx_products_name_nocase ON products (name COLLATE NOCASE)",
+        ) + PRODUCTS_FTS_TRIGGERS)
+
+    _rebuild_table(cursor, "sales", """
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            customer_id INTEGER,
+            customer_name TEXT,
+            payment_method TEXT,
+            discount_value REAL DEFAULT 0.0,
+            discount_type TEXT DEFAULT 'Nenhum',
+            received_cents INTEGER DEFAULT 0,
+            change_cents INTEGER DEFAULT 0,
+            FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL
+        )
+    """, ["id", "timestamp", "total_cents", "customer_id", "customer_name", "payment_method",
+          "discount_value", "discount_type", "received_cents", "change_cents"],
+        ["id", "timestamp", cents("total"), "customer_id", "customer_name", "payment_method",
+         "discount_value", "discount_type", cents("received_amount"), cents("change_amount")],
+        post_statements=(
+            "CREATE INDEX idx_sales_timestamp ON sales (timestamp)",
+            "CREATE INDEX idx_sales_customer_name ON sales (customer_name)",
+            "CREATE INDEX idx_sales_customer_id ON sales (customer_id)",
+        ))
+
+    _rebuild_table(cursor, "sale_items", """
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price_cents INTEGER NOT NULL,
+            FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    """, ["id", "sale_id", "product_id", "product_name", "quantity", "price_cents"],
+        ["id", "sale_id", "product_id", "product_name", "quantity", cents("price")],
+        post_statements=(
+            "CREATE INDEX idx_sale_items_sale_id ON sale_items (sale_id)",
+            "CREATE INDEX idx_sale_items_product_id ON sale_items (product_id)",
+            "CREATE INDEX idx_sale_items_product_name ON sale_items (product_name)",
+        ))
+
+
+def _migration_006_epoch_timestamps(cursor):
+    """
+    Datas de vendas e devoluções passam de TEXT ('%Y-%m-%d %H:%M:%S', hora local) para
+    INTEGER em segundos desde a época Unix (sold_at, returned_at), e os filtros de
+    período viram buscas por faixa de inteiros no índice.
+
+    sales.utc_offset guarda o fuso local no momento da venda, e as colunas geradas
+    sale_day (dias desde 1970-01-01, no horário local) e sale_hour (0-23) permitem
+    agrupar por dia e por hora sem funções de data. Elas não podem usar o modificador
+    'localtime' do SQLite, que não é determinístico, por isso o deslocamento é gravado.
+    """
+    # strftime('%s', t, 'utc') interpreta `t` como hora local (aplicando o horário de
+    # verão da própria data) e devolve a época; sem 'utc', trata `t` como UTC.
+    sold_at = "COALESCE(CAST(strftime('%s', timestamp, 'utc') AS INTEGER), 0)"
+    utc_offset = "COALESCE(CAST(strftime('%s', timestamp) AS INTEGER) - CAST(strftime('%s', timestamp, 'utc') AS INTEGER), 0)"
+    _rebuild_table(cursor, "sales", """
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sold_at INTEGER NOT NULL,
+            utc_offset INTEGER NOT NULL DEFAULT 0,
+            total_cents INTEGER NOT NULL,
+            customer_id INTEGER,
+            customer_name TEXT,
+            payment_method TEXT,
+            discount_value REAL DEFAULT 0.0,
+            discount_type TEXT DEFAULT 'Nenhum',
+            received_cents INTEGER DEFAULT 0,
+            change_cents INTEGER DEFAULT 0,
+            sale_day INTEGER GENERATED ALWAYS AS ((sold_at + utc_offset) / 86400) VIRTUAL,
+            sale_hour INTEGER GENERATED ALWAYS AS (((sold_at + utc_offset) % 86400) / 3600) VIRTUAL,
+            FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL
+        )
+    """, ["id", "sold_at", "utc_offset", "total_cents", "customer_id", "customer_name", "payment_method",
+          "discount_value", "discount_type", "received_cents", "change_cents"],
+        ["id", sold_at, utc_offset, "total_cents", "customer_id", "customer_name", "payment_method",
+         "discount_value", "discount_type", "received_cents", "change_cents"],
+        post_statements=(
+            "CREATE INDEX idx_sales_sold_at ON sales (sold_at)",
+            "CREATE INDEX idx_sales_day_hour ON sales (sale_day, sale_hour)",
+            "CREATE INDEX idx_sales_customer_name ON sales (customer_name)",
+            "CREATE INDEX idx_sales_customer_id ON sales (customer_id)",
+        ))
+
+    _rebuild_table(cursor, "returns", """
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            returned_at INTEGER NOT NULL,
+            reason TEXT,
+            processed_by_user_id INTEGER NOT NULL,
+            FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id),
+            FOREIGN KEY (processed_by_user_id) REFERENCES users (id)
+        )
+    """, ["id", "sale_id", "product_id", "product_name", "quantity", "returned_at", "reason", "processed_by_user_id"],
+        ["id", "sale_id", "product_id", "product_name", "quantity",
+         "COALESCE(CAST(strftime('%s', return_timestamp, 'utc') AS INTEGER), 0)", "reason", "processed_by_user_id"],
+        post_statements=(
+            "CREATE INDEX idx_returns_sale_id ON returns (sale_id)",
+            "CREATE INDEX idx_returns_returned_at ON returns (returned_at)",
+        ))
+
+
+def _migration_007_daily_aggregates(cursor):
+    """
+    Resumos diários de vendas lidos pela tela de Relatórios, em vez de agregar
+    sales/sale_items inteiras a cada abertura: por dia × produto (quantidade e
+    receita) e por dia × forma de pagamento (número de vendas e total), ambos
+    brutos, sem descontar devoluções, para que os números da tela fechem entre si.
+    São mantidos por checkout() na mesma transação da venda e podem ser recalculados com rebuild_daily_aggregates().
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_product_sales (
+            sale_day INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sale_day, product_name)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_payment_sales (
+            sale_day INTEGER NOT NULL,
+            payment_method TEXT NOT NULL,
+            sales_count INTEGER NOT NULL DEFAULT 0,
+            revenue_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sale_day, payment_method)
+        ) WITHOUT ROWID
+    """)
+    _rebuild_daily_aggregates(cursor)
+
+
+def _migration_008_customer_search_indexes(cursor):
+    """
+    Índices sem distinção de maiúsculas em customers.name e customers.phone, usados
+    pela busca por prefixo do seletor de clientes da tela de vendas (search_customers).
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_name_nocase ON customers (name COLLATE NOCASE)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_phone_nocase ON customers (phone COLLATE NOCASE)")
+
+
+def _migration_009_customer_search(cursor):
+    """
+    Colunas normalizadas para a busca de clientes: telefone só com dígitos e e-mail
+    em minúsculas (colunas geradas e indexadas, para buscas exatas ou por prefixo)
+    e o índice FTS5 customers_fts sobre nome e e-mail, sem diferenciar acentos nem
+    maiúsculas, mantido em sincronia por gatilhos.
+    """
+    cursor.execute("""
+        ALTER TABLE customers ADD COLUMN phone_digits TEXT GENERATED ALWAYS AS (
+            replace(replace(replace(replace(replace(replace(replace(
+                phone, ' ', ''), '(', ''), ')', ''), '-', ''), '.', ''), '+', ''), '/', '')
+        ) VIRTUAL
+    """)
+    cursor.execute("ALTER TABLE customers ADD COLUMN email_lower TEXT GENERATED ALWAYS AS (lower(trim(email))) VIRTUAL")
+    cursor.execute("DROP INDEX IF EXISTS idx_customers_phone_nocase") # Substituído por idx_customers_phone_digits
+    cursor.execute("CREATE INDEX idx_customers_phone_digits ON customers (phone_digits)")
+    cursor.execute("CREATE INDEX idx_customers_email_lower ON customers (email_lower)")
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+            name,
+            email,
+            content='customers',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    cursor.execute("INSERT INTO customers_fts (customers_fts) VALUES ('rebuild')")
+    for statement in CUSTOMERS_FTS_TRIGGERS:
+        cursor.execute(statement)
+
+
+# Gatilhos que mantêm customers_fts atualizado (mesmo esquema de PRODUCTS_FTS_TRIGGERS).
+CUSTOMERS_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS customers_fts_ai AFTER INSERT ON customers BEGIN
+        INSERT INTO customers_fts (rowid, name, email) VALUES (new.id, new.name, new.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS customers_fts_ad AFTER DELETE ON customers BEGIN
+        INSERT INTO customers_fts (customers_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS customers_fts_au AFTER UPDATE OF name, email ON customers BEGIN
+        INSERT INTO customers_fts (customers_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+        INSERT INTO customers_fts (rowid, name, email) VALUES (new.id, new.name, new.email);
+    END
+    """,
+)
+
+
+def _migration_010_product_image_index(cursor):
+    """
+    Índice em products.image_path: a contagem de referências de uma imagem do
+    armazenamento (image_reference_count) e a lista de imagens em uso lida pelo
+    coletor de órfãs (collect_orphan_images) não varrem a tabela.
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_image_path ON products (image_path)")
+
+
+def _migration_011_gross_daily_aggregates(cursor):
+    """
+    Recalcula os resumos diários sem descontar as devoluções, que antes eram
+    subtraídas apenas de daily_product_sales (a receita por produto deixava de
+    bater com o total por forma de pagamento e o total do período).
+    """
+    _rebuild_daily_aggregates(cursor)
+
+
+def _migration_012_sales_customer_name_index(cursor):
+    """
+    Índice sem distinção de maiúsculas em sales.customer_name, usado pela busca por
+    prefixo do nome do cliente avulso na tela de devoluções (search_sales_for_returns).
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_name_nocase ON sales (customer_name COLLATE NOCASE)")
+
+
+# Migrações do esquema, em ordem: (versão, descrição, função que recebe o cursor).
+# Nunca altere um passo já publicado; adicione um novo com a próxima versão.
+MIGRATIONS = [
+    (1, "Esquema base", _migration_001_base_schema),
+    (2, "Chave estrangeira sales.customer_id", _migration_002_sales_customer_fk),
+    (3, "Busca de produtos com FTS5", _migration_003_products_fts),
+    (4, "Códigos de barras dos produtos", _migration_004_product_barcodes),
+    (5, "Valores monetários em centavos", _migration_005_integer_cents),
+    (6, "Datas como segundos desde a época Unix", _migration_006_epoch_timestamps),
+    (7, "Resumos diários de vendas", _migration_007_daily_aggregates),
+    (8, "Índices da busca de clientes", _migration_008_customer_search_indexes),
+    (9, "Busca de clientes normalizada (dígitos do telefone, e-mail, FTS5)", _migration_009_customer_search),
+    (10, "Índice das imagens de produtos", _migration_010_product_image_index),
+    (11, "Resumos diários brutos (sem descontar devoluções)", _migration_011_gross_daily_aggregates),
+    (12, "Índice do nome do cliente avulso nas vendas", _migration_012_sales_customer_name_index),
+]
+
+
+def local_epoch(moment=None):
+    """
+    Retorna (segundos desde a época Unix, deslocamento do fuso local em segundos)
+    do instante `moment` (datetime sem fuso, em hora local; padrão: agora).
+    """
+    moment = (moment or datetime.now()).astimezone()
+    return int(moment.timestamp()), int(moment.utcoffset().total_seconds())
+
+
+def format_timestamp(epoch):
+    """
+    Formata segundos desde a época Unix como data/hora local para exibição.
+    """
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def day_number(moment):
+    """
+    Dia local de `moment` (date ou datetime) contado a partir de 1970-01-01, na
+    mesma escala da coluna gerada sales.sale_day.
+    """
+    return moment.toordinal() - datetime(1970, 1, 1).toordinal()
+
+
+# Soma uma linha ao resumo diário (criando-a se ainda não existir)
+DAILY_PRODUCT_UPSERT = """
+    INSERT INTO daily_product_sales (sale_day, product_name, quantity, revenue_cents) VALUES (?, ?, ?, ?)
+    ON CONFLICT (sale_day, product_name) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue_cents = revenue_cents + excluded.revenue_cents
+"""
+DAILY_PAYMENT_UPSERT = """
+    INSERT INTO daily_payment_sales (sale_day, payment_method, sales_count, revenue_cents) VALUES (?, ?, ?, ?)
+    ON CONFLICT (sale_day, payment_method) DO UPDATE SET
+        sales_count = sales_count + excluded.sales_count,
+        revenue_cents = revenue_cents + excluded.revenue_cents
+"""
+
+
+def record_sale_aggregates(cursor, sale_id):
+    """
+    Soma a venda `sale_id` (já gravada) aos resumos diários, na transação do chamador.
+    """
+    sale_day, payment_method, total_cents = cursor.execute(
+        "SELECT sale_day, COALESCE(payment_method, 'N/A'), total_cents FROM sales WHERE id = ?", (sale_id,)).fetchone()
+    cursor.executemany(DAILY_PRODUCT_UPSERT, [
+        (sale_day, product_name, quantity, quantity * price_cents)
+        for product_name, quantity, price_cents in cursor.execute(
+            "SELECT product_name, quantity, price_cents FROM sale_items WHERE sale_id = ?", (sale_id,)).fetchall()
+    ])
+    cursor.execute(DAILY_PAYMENT_UPSERT, (sale_day, payment_method, 1, total_cents))
+
+
+def sale_return_status(db, sale_id, product_id=None):
+    """
+    Situação de devolução das linhas de uma venda, numa única consulta agrupada.
+
+    Args:
+        db: Database ou cursor (dentro de uma transação).
+        product_id: Restringe o resultado à linha desse produto.
+
+    Returns:
+        list: Tuplas (product_id, product_name, vendido, devolvido, disponível para
+            devolver, price_cents), na ordem dos itens da venda.
+    """
+    query = """
+        SELECT si.product_id, si.product_name, si.quantity,
+               COALESCE(r.returned, 0), si.quantity - COALESCE(r.returned, 0), si.price_cents
+        FROM sale_items si
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS returned FROM returns
+            WHERE sale_id = ? GROUP BY product_id
+        ) r ON r.product_id = si.product_id
+        WHERE si.sale_id = ?
+    """
+    params = [sale_id, sale_id]
+    if product_id is not None:
+        query += " AND si.product_id = ?"
+        params.append(product_id)
+    return db.execute(query + " ORDER BY si.id", params).fetchall()
+
+
+def _rebuild_daily_aggregates(cursor):
+    cursor.execute("DELETE FROM daily_product_sales")
+    cursor.execute("DELETE FROM daily_payment_sales")
+    cursor.execute("""
+        INSERT INTO daily_product_sales (sale_day, product_name, quantity, revenue_cents)
+        SELECT s.sale_day, si.product_name, SUM(si.quantity), SUM(si.quantity * si.price_cents)
+        FROM sale_items si
+        JOIN sales s ON s.id = si.sale_id
+        GROUP BY s.sale_day, si.product_name
+    """)
+    cursor.execute("""
+        INSERT INTO daily_payment_sales (sale_day, payment_method, sales_count, revenue_cents)
+        SELECT sale_day, COALESCE(payment_method, 'N/A'), COUNT(*), SUM(total_cents)
+        FROM sales
+        GROUP BY sale_day, COALESCE(payment_method, 'N/A')
+    """)
+
+
+def rebuild_daily_aggregates(db):
+    """
+    Recalcula os resumos diários a partir das vendas gravadas (ex.:
+    após corrigir dados manualmente). Executado por `python pdv.py --rebuild-aggregates`.
+    """
+    with db.transaction(immediate=True) as cursor:
+        _rebuild_daily_aggregates(cursor)
+
+
+def to_decimal(value):
+    """
+    Converte um número (str, int, float ou Decimal) para um Decimal finito.
+
+    Raises:
+        ValueError: Se o valor não for numérico, ou for "nan"/"inf".
+    """
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"Valor numérico inválido: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Valor numérico inválido: {value!r}")
+    return amount
+
+
+def to_cents(value):
+    """
+    Converte um valor em reais (str, int, float ou Decimal) para centavos (int),
+    arredondando meio centavo para cima.
+
+    Raises:
+        ValueError: Se o valor não for numérico.
+    """
+    try:
+        amount = to_decimal(value)
+    except ValueError:
+        raise ValueError(f"Valor monetário inválido: {value!r}")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def parse_money(text):
+    """
+    Converte o valor digitado pelo usuário ("12,50", "12.5", "R$ 3") em centavos.
+
+    Raises:
+        ValueError: Se o texto não for um valor numérico.
+    """
+    return to_cents(text.replace("R$", "").strip().replace(",", "."))
+
+
+def format_money(cents, prefix="R$ "):
+    """
+    Formata centavos para exibição (1250 -> "R$ 12.50"), sem passar por float.
+    """
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{prefix}{sign}{cents // 100}.{cents % 100:02d}"
+
+
+def percent_of(cents, percent):
+    """
+    `percent`% de um valor em centavos, arredondado ao centavo.
+    """
+    return int((Decimal(cents) * Decimal(str(percent)) / 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def like_prefix(term):
+    """
+    Padrão LIKE (com ESCAPE '\\') que casa os textos iniciados por `term`.
+    """
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def refine_product_search(previous_term, term, rows):
+    """
+    Reaproveita o resultado de search_products(previous_term) para `term`, que apenas
+    estende o termo anterior: filtra as linhas localmente, mantendo a ordem.
+
+    Retorna None (exigindo nova consulta) quando o resultado anterior pode estar
+    incompleto (atingiu o limite), quando o termo é numérico (a busca por ID exato
+    pode trazer um produto novo) ou quando o termo passa de prefixo para trecho
+    (menos de 3 para 3 ou mais caracteres).
+    """
+    if len(rows) >= PRODUCT_SEARCH_LIMIT or term.isdigit():
+        return None
+    if len(term) >= 3:
+        if len(previous_term) < 3:
+            return None
+        return [row for row in rows if term in row[1].lower()]
+    return [row for row in rows if row[1].lower().startswith(term)]
+
+
+def find_product_by_code(db, code):
+    """
+    Resolve um código lido no caixa para (id, name, price_cents, stock).
+
+    Procura primeiro em product_barcodes; se o código não estiver cadastrado e for
+    numérico, tenta como ID do produto (digitação manual). Retorna None se nada for
+    encontrado.
+    """
+    product = db.fetchone("""
+        SELECT p.id, p.name, p.price_cents, p.stock FROM product_barcodes b
+        JOIN products p ON p.id = b.product_id
+        WHERE b.code = ?
+    """, (code,))
+    if product is None and code.isdigit():
+        product = db.fetchone("SELECT id, name, price_cents, stock FROM products WHERE id = ?", (int(code),))
+    return product
+
+
+def parse_barcodes(text):
+    """
+    Separa os códigos de barras digitados (por vírgula, ponto e vírgula ou espaço),
+    descartando vazios e repetidos e preservando a ordem.
+    """
+    codes = text.replace(",", " ").replace(";", " ").split()
+    return list(dict.fromkeys(codes))
+
+
+class InsufficientStockError(Exception):
+    """
+    Uma linha da venda pede mais unidades do que há em estoque no momento do
+    registro (ex.: outro caixa vendeu o mesmo produto). A venda não é gravada.
+    """
+
+    def __init__(self, product_id, product_name, requested, available):
+        self.product_id = product_id
+        self.product_name = product_name
+        self.requested = requested
+        self.available = available # None se o produto não existe mais
+        if available is None:
+            message = f"O produto '{product_name}' (ID {product_id}) não existe mais no estoque."
+        else:
+            message = f"Estoque insuficiente para '{product_name}'. Solicitado: {requested}, disponível: {available}."
+        super().__init__(message)
+
+
+class ReturnQuantityError(Exception):
+    """
+    Uma linha da devolução pede mais unidades do que ainda restam para devolver
+    naquela venda (ex.: outra devolução foi gravada antes). Nada é gravado.
+    """
+
+    def __init__(self, product_id, product_name, requested, available):
+        self.product_id = product_id
+        self.product_name = product_name
+        self.requested = requested
+        self.available = available # None se o produto não faz parte da venda
+        if available is None:
+            message = f"O produto ID {product_id} não faz parte desta venda."
+        else:
+            message = (f"A quantidade total devolvida para '{product_name}' não pode exceder a quantidade vendida. "
+                       f"Solicitado: {requested}, disponível para devolução: {available}.")
+        super().__init__(message)
+
+
+def process_returns(db, sale_id, lines, reason, user_id):
+    """
+    Registra a devolução de várias linhas de uma venda numa única transação BEGIN
+    IMMEDIATE.
+
+    Cada devolução é um INSERT ... SELECT que só grava se a quantidade vendida menos
+    a já devolvida comportar o pedido; se alguma linha não for gravada, a transação
+    inteira é desfeita. O estoque é reposto com um único executemany.
+
+    Args:
+        lines: Sequência de (product_id, quantity).
+
+    Returns:
+        list: Tuplas (product_id, product_name, quantity) devolvidas.
+
+    Raises:
+        ValueError: Se alguma quantidade não for positiva (nada é gravado).
+        ReturnQuantityError: Se alguma linha não puder ser devolvida.
+    """
+    lines = list(lines)
+    for product_id, quantity in lines:
+        if quantity <= 0:
+            raise ValueError(f"Quantidade de devolução inválida para o produto {product_id}: {quantity}")
+    returned_at = local_epoch()[0]
+    returned = []
+    with db.transaction(immediate=True) as cursor:
+        for product_id, quantity in lines:
+            cursor.execute("""
+                INSERT INTO returns (sale_id, product_id, product_name, quantity, returned_at, reason, processed_by_user_id)
+                SELECT si.sale_id, si.product_id, si.product_name, ?, ?, ?, ?
+                FROM sale_items si
+                WHERE si.sale_id = ? AND si.product_id = ? AND ? > 0
+                  AND si.quantity - (SELECT COALESCE(SUM(r.quantity), 0) FROM returns r
+                                     WHERE r.sale_id = si.sale_id AND r.product_id = si.product_id) >= ?
+            """, (quantity, returned_at, reason, user_id, sale_id, product_id, quantity, quantity))
+            inserted = cursor.rowcount
+            status = sale_return_status(cursor, sale_id, product_id)
+            if inserted != 1:
+                raise ReturnQuantityError(product_id, status[0][1] if status else None, quantity, status[0][4] if status else None)
+            returned.append((product_id, status[0][1], quantity))
+
+        cursor.executemany("UPDATE products SET stock = stock + ? WHERE id = ?",
+                           [(quantity, product_id) for product_id, _, quantity in returned])
+    return returned
+
+
+def checkout(db, sale, items):
+    """
+    Registra uma venda e baixa o estoque numa única transação BEGIN IMMEDIATE.
+
+    A baixa de cada linha é um UPDATE condicional (`WHERE stock >= ?`): se não
+    alterar nenhuma linha, o estoque não comporta a quantidade e a transação inteira
+    é desfeita. Como a escrita fica reservada desde o BEGIN, dois caixas não podem
+    vender as mesmas unidades. As linhas da venda são gravadas com executemany, e os
+    resumos diários dos relatórios são atualizados na mesma transação.
+
+    Args:
+        sale: Dicionário coluna -> valor da tabela sales.
+        items: Sequência de (product_id, product_name, quantity, price_cents).
+
+    Returns:
+        int: O ID da venda registrada.
+
+    Raises:
+        InsufficientStockError: Se alguma linha não puder ser atendida.
+    """
+    columns = ", ".join(sale)
+    placeholders = ", ".join("?" * len(sale))
+    with db.transaction(immediate=True) as cursor:
+        for product_id, product_name, quantity, price_cents in items:
+            cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?", (quantity, product_id, quantity))
+            if cursor.rowcount != 1:
+                row = cursor.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()
+                raise InsufficientStockError(product_id, product_name, quantity, row[0] if row else None)
+
+        cursor.execute(f"INSERT INTO sales ({columns}) VALUES ({placeholders})", tuple(sale.values()))
+        sale_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO sale_items (sale_id, product_id, product_name, quantity, price_cents) VALUES (?, ?, ?, ?, ?)",
+            [(sale_id, product_id, product_name, quantity, price_cents) for product_id, product_name, quantity, price_cents in items]
+        )
+        record_sale_aggregates(cursor, sale_id)
+    return sale_id
+
+
+def search_products(db, search_term, columns=("id", "name", "price_cents", "stock"), limit=PRODUCT_SEARCH_LIMIT):
+    """
+    Busca produtos pelo nome (qualquer trecho) ou pelo ID exato.
+
+    O resultado é ordenado por relevância: primeiro o produto cujo ID é o termo
+    digitado, depois os nomes que começam com o termo (faixa no índice NOCASE) e,
+    por fim, os nomes que apenas contêm o termo (índice trigram products_fts, para
+    termos com 3 ou mais caracteres). Cada bloco vem em ordem alfabética (o último é
+    ordenado no SQL, antes do LIMIT, para trazer os primeiros nomes e não um
+    subconjunto qualquer das ocorrências). As duas primeiras etapas param ao atingir
+    `limit`; a última ordena apenas as ocorrências do termo, não o catálogo.
+
+    Returns:
+        list: Tuplas com as colunas pedidas, no máximo `limit` linhas.
+    """
+    search_term = search_term.strip()
+    select_columns = ", ".join(f"p.{column}" for column in columns)
+    rows = []
+    seen_ids = set()
+
+    def add_rows(candidates):
+        for row in candidates:
+            if row[0] not in seen_ids and len(rows) < limit:
+                seen_ids.add(row[0])
+                rows.append(row[1:])
+
+    if search_term.isdigit():
+        add_rows(db.fetchall(f"SELECT p.id, {select_columns} FROM products p WHERE p.id = ?", (int(search_term),)))
+
+    add_rows(db.fetchall(f"SELECT p.id, {select_columns} FROM products p WHERE p.name LIKE ? ESCAPE '\\' ORDER BY p.name COLLATE NOCASE LIMIT ?",
+                         (like_prefix(search_term), limit)))
+
+    if len(search_term) >= 3 and len(rows) < limit:
+        fts_query = '"' + search_term.replace('"', '""') + '"'
+        add_rows(db.fetchall(f"""
+            SELECT p.id, {select_columns} FROM products_fts
+            JOIN products p ON p.id = products_fts.rowid
+            WHERE products_fts MATCH ?
+            ORDER BY p.name COLLATE NOCASE
+            LIMIT ?
+        """, (fts_query, limit + len(rows))))
+    return rows
+
+
+def search_customers(db, search_term, columns=("id", "name", "phone"), limit=CUSTOMER_SEARCH_LIMIT):
+    """
+    Busca clientes por ID, e-mail, telefone ou nome, sem varrer a tabela.
+
+    O resultado é ordenado por relevância: o ID exato (termo numérico), o e-mail
+    exato (idx_customers_email_lower), os telefones que começam com os dígitos
+    digitados, ignorando a formatação (idx_customers_phone_digits), os nomes que
+    começam com o termo (idx_customers_name_nocase) e, por fim, os clientes cujo
+    nome ou e-mail tem palavras iniciadas por cada palavra do termo, sem diferenciar
+    acentos (customers_fts, ordenados por bm25). Cada etapa para ao atingir `limit`.
+
+    Returns:
+        list: Tuplas com as colunas pedidas, no máximo `limit` linhas.
+    """
+    search_term = search_term.strip()
+    select_columns = ", ".join(f"c.{column}" for column in columns)
+    rows = []
+    seen_ids = set()
+
+    def add_rows(candidates):
+        for row in candidates:
+            if row[0] not in seen_ids and len(rows) < limit:
+                seen_ids.add(row[0])
+                rows.append(row[1:])
+
+    if search_term.isdigit():
+        add_rows(db.fetchall(f"SELECT c.id, {select_columns} FROM customers c WHERE c.id = ?", (int(search_term),)))
+
+    if "@" in search_term:
+        add_rows(db.fetchall(f"SELECT c.id, {select_columns} FROM customers c WHERE c.email_lower = ? LIMIT ?",
+                             (search_term.lower(), limit)))
+
+    phone_digits = re.sub(r"\D", "", search_term)
+    if len(phone_digits) >= 2 and re.fullmatch(r"[\d\s()+./-]+", search_term):
+        # Faixa [dígitos, dígitos + ':'): ':' é o caractere seguinte a '9'
+        add_rows(db.fetchall(f"""
+            SELECT c.id, {select_columns} FROM customers c
+            WHERE c.phone_digits >= ? AND c.phone_digits < ?
+            ORDER BY c.phone_digits LIMIT ?
+        """, (phone_digits, phone_digits + ":", limit)))
+
+    add_rows(db.fetchall(f"SELECT c.id, {select_columns} FROM customers c WHERE c.name LIKE ? ESCAPE '\\' ORDER BY c.name COLLATE NOCASE LIMIT ?",
+                         (like_prefix(search_term), limit)))
+
+    words = re.findall(r"\w+", search_term)
+    if words and len(rows) < limit:
+        fts_query = " ".join(f'"{word}"*' for word in words)
+        # Ordena e limita no índice FTS antes de ler os clientes (nome pesa mais que e-mail)
+        add_rows(db.fetchall(f"""
+            SELECT c.id, {select_columns} FROM (
+                SELECT rowid, bm25(customers_fts, 10.0, 1.0) AS score FROM customers_fts
+                WHERE customers_fts MATCH ?
+                ORDER BY score LIMIT ?
+            ) f
+            JOIN customers c ON c.id = f.rowid
+            ORDER BY f.score
+        """, (fts_query, limit + len(rows))))
+    return rows
+
+
+ASCII_LOWER_TABLE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_lower(text):
+    """
+    Minúsculas apenas de A-Z, como fazem LIKE e COLLATE NOCASE no SQLite ("É" não
+    vira "é"), para que filtros em memória sigam a mesma regra das consultas.
+    """
+    return text.translate(ASCII_LOWER_TABLE)
+
+
+def search_sales_for_returns(db, search_term, limit=RETURN_SALES_SEARCH_LIMIT):
+    """
+    Busca vendas para a tela de devoluções pelo ID exato ou pelo início do nome do
+    cliente, sem varrer a tabela de vendas.
+
+    Sem termo, traz as vendas mais recentes (idx_sales_sold_at). Com termo, junta a
+    venda de ID igual ao termo numérico, as vendas dos clientes cadastrados cujo nome
+    começa com o termo (idx_customers_name_nocase e idx_sales_customer_id) e as dos
+    clientes avulsos cujo nome começa com o termo (idx_sales_customer_name_nocase).
+    Maiúsculas e minúsculas só se equivalem em A-Z (regra do LIKE do SQLite; ver
+    refine_sales_for_returns).
+
+    Returns:
+        list: Tuplas (id, sold_at, total_cents, nome do cliente, payment_method), das
+            mais recentes para as mais antigas, no máximo `limit` linhas.
+    """
+    search_term = search_term.strip()
+    select = """
+        SELECT s.id, s.sold_at, s.total_cents, COALESCE(c.name, s.customer_name), s.payment_method
+        FROM sales s
+        LEFT JOIN customers c ON c.id = s.customer_id
+    """
+    if not search_term:
+        return db.fetchall(select + " ORDER BY s.sold_at DESC LIMIT ?", (limit,))
+
+    pattern = like_prefix(search_term)
+    sale_id = int(search_term) if search_term.isdigit() else -1
+    return db.fetchall(f"""
+        SELECT * FROM (
+            {select} WHERE s.id = ?
+            UNION
+            {select} WHERE s.customer_id IN (SELECT id FROM customers WHERE name LIKE ? ESCAPE '\\')
+            UNION
+            {select} WHERE s.customer_name LIKE ? ESCAPE '\\' AND c.id IS NULL
+        )
+        ORDER BY 2 DESC LIMIT ?
+    """, (sale_id, pattern, pattern, limit))
+
+
+def refine_sales_for_returns(previous_term, term, rows):
+    """
+    Reaproveita o resultado de search_sales_for_returns(previous_term) para `term`,
+    que apenas estende o termo anterior, mantendo somente os nomes iniciados por
+    `term` com a mesma comparação do SQLite (ascii_lower).
+
+    Retorna None (exigindo nova consulta) quando o resultado anterior pode estar
+    incompleto (atingiu o limite) ou quando o termo é numérico (a busca por ID exato
+    pode trazer outra venda).
+    """
+    if len(rows) >= RETURN_SALES_SEARCH_LIMIT or term.isdigit():
+        return None
+    term = ascii_lower(term)
+    return [row for row in rows if row[3] and ascii_lower(row[3]).startswith(term)]
+
+
+class DebouncedSearch:
+    """
+    Busca incremental ligada a um campo de texto (evento <KeyRelease>).
+
+    As teclas digitadas em sequência são agrupadas com `after()`: a consulta só roda
+    quando o usuário para de digitar por `delay_ms`, e cada nova tecla cancela a
+    busca pendente. Um contador de geração descarta resultados de buscas que foram
+    superadas enquanto executavam. Quando o novo termo apenas estende o anterior,
+    a função `refine` pode filtrar o resultado anterior em memória em vez de
+    consultar o banco.
+    """
+
+    DELAY_MS = 250 # Pausa na digitação que dispara a busca
+
+    def __init__(self, master, get_term, query, render, refine=None, delay_ms=DELAY_MS):
+        """
+        Args:
+            master: Widget usado para agendar a busca (after/after_cancel).
+            get_term: Função que retorna o texto atual do campo de busca.
+            query: Função query(term) que consulta o banco e retorna as linhas.
+            render: Função render(rows) que exibe as linhas na tela.
+            refine: Função opcional refine(previous_term, term, rows) que retorna as
+                linhas de `term` a partir das de `previous_term`, ou None se não for possível.
+        """
+        self.master = master
+        self.get_term = get_term
+        self.query = query
+        self.render = render
+        self.refine = refine
+        self.delay_ms = delay_ms
+        self._job = None
+        self._generation = 0
+        self._last_term = None
+        self._last_rows = None
+
+    def schedule(self, event=None):
+        """
+        Agenda a busca para depois da pausa na digitação, substituindo a pendente.
+        """
+        self.cancel()
+        self._generation += 1
+        self._job = self.master.after(self.delay_ms, self._run, self._generation, False)
+
+    def run_now(self, event=None):
+        """
+        Executa a busca imediatamente (botão "Buscar", recarga após alterações).
+        Sempre consulta o banco, pois os dados podem ter mudado.
+        """
+        self.cancel()
+        self._generation += 1
+        self._run(self._generation, True)
+
+    def cancel(self):
+        """
+        Cancela a busca pendente, se houver.
+        """
+        if self._job is not None:
+            self.master.after_cancel(self._job)
+            self._job = None
+
+    def invalidate(self):
+        """
+        Descarta o resultado guardado para refinamento (os dados mudaram), de modo
+        que a próxima tecla consulte o banco.
+        """
+        self._last_term = None
+        self._last_rows = None
+
+    def _run(self, generation, force):
+        self._job = None
+        if generation != self._generation:
+            return # Superada por uma busca mais recente
+        term = self.get_term().strip().lower()
+        if not force and term == self._last_term:
+            return # Teclas que não alteram o texto (setas, Shift...)
+
+        rows = None
+        if (not force and self.refine and self._last_rows is not None
+                and self._last_term and term.startswith(self._last_term)):
+            rows = self.refine(self._last_term, term, self._last_rows)
+        if rows is None:
+            rows = self.query(term)
+        if generation != self._generation:
+            return
+
+        self._last_term = term
+        self._last_rows = rows
+        self.render(rows)
+
+
+class DbWorker:
+    """
+    Thread de fundo que executa consultas demoradas (relatórios, históricos) fora
+    da thread do Tk, para que a interface não congele em bancos grandes.
+
+    Cada tarefa é identificada por uma chave (ex.: "history"); enviar uma nova
+    tarefa com a mesma chave, ou chamar cancel(chave), descarta a anterior. Se ela
+    já estiver executando, a consulta é interrompida (sqlite3 interrupt). Os
+    resultados voltam por uma fila lida com `master.after` e os callbacks rodam
+    sempre na thread do Tk.
+    """
+
+    POLL_INTERVAL_MS = 30 # Intervalo de leitura da fila de resultados
+
+    def __init__(self, master, db):
+        self.master = master
+        self.db = db
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._tickets = itertools.count(1)
+        self._latest = {} # chave -> ticket da tarefa mais recente (apenas ela é entregue)
+        self._running = None # (chave, ticket) da tarefa em execução
+        self._running_lock = threading.Lock()
+        self._connection = None
+        self._poll_job = None
+        self._thread = threading.Thread(target=self._work, name="pdv-db-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, job, on_done, on_error=None):
+        """
+        Agenda job(db) na thread de fundo; on_done(resultado) ou on_error(exceção)
+        são chamados na thread do Tk. Substitui a tarefa pendente com a mesma chave.
+        """
+        self.cancel(key)
+        ticket = next(self._tickets)
+        self._latest[key] = ticket
+        self._jobs.put((key, ticket, job, on_done, on_error))
+        if self._poll_job is None:
+            self._poll_job = self.master.after(self.POLL_INTERVAL_MS, self._poll)
+        return ticket
+
+    def cancel(self, key):
+        """
+        Descarta a tarefa com a chave informada, interrompendo-a se já estiver executando.
+        """
+        ticket = self._latest.pop(key, None)
+        if ticket is None:
+            return
+        with self._running_lock:
+            if self._running == (key, ticket) and self._connection is not None:
+                self._connection.interrupt()
+
+    def is_pending(self, key):
+        return key in self._latest
+
+    def shutdown(self, wait=False):
+        """
+        Cancela as tarefas e encerra a thread (chamado ao fechar a janela do PDV).
+        Com wait=True, aguarda a thread terminar, para que nenhuma consulta esteja
+        em andamento quando as conexões forem fechadas (restauração de backup).
+        """
+        for key in list(self._latest):
+            self.cancel(key)
+        if self._poll_job is not None:
+            self.master.after_cancel(self._poll_job)
+            self._poll_job = None
+        self._jobs.put(None)
+        if wait:
+            self._thread.join()
+
+    def _work(self):
+        try:
+            while True:
+                task = self._jobs.get()
+                if task is None:
+                    break
+                key, ticket, job, on_done, on_error = task
+                with self._running_lock:
+                    if self._latest.get(key) != ticket:
+                        continue # Cancelada ou substituída antes de começar
+                    self._running = (key, ticket)
+                    # Conexão própria desta thread (reaberta se o banco foi restaurado)
+                    self._connection = self.db.connection
+                try:
+                    result, error = job(self.db), None
+                except Exception as e:
+                    result, error = None, e
+                with self._running_lock:
+                    self._running = None
+                self._results.put((key, ticket, result, error, on_done, on_error))
+        finally:
+            with self._running_lock:
+                self._connection = None
+            self.db.close_thread_connection() # Cada PdvApp cria um worker; a conexão não pode sobrar
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                key, ticket, result, error, on_done, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if self._latest.get(key) != ticket:
+                continue # Resultado de uma tarefa cancelada ou substituída
+            del self._latest[key]
+            if error is None:
+                on_done(result)
+            elif on_error:
+                on_error(error)
+            else:
+                print(f"Erro detalhado na consulta em segundo plano ({key}): {error}")
+        if self._latest:
+            self._poll_job = self.master.after(self.POLL_INTERVAL_MS, self._poll)
+
+
+class TreeviewBinding:
+    """
+    Mantém um ttk.Treeview sincronizado com uma lista de linhas sem apagar e
+    reinserir tudo: cada linha usa a chave primária como iid e refresh() aplica
+    apenas as inserções, atualizações, exclusões e movimentações necessárias.
+    Como os itens que continuam na lista não são recriados, a seleção e o foco
+    se mantêm; a posição de rolagem é restaurada pela primeira linha visível.
+    """
+
+    def __init__(self, tree, key=lambda values: values[0]):
+        """
+        Args:
+            tree: O ttk.Treeview controlado.
+            key: Função que extrai a chave primária dos valores de uma linha.
+        """
+        self.tree = tree
+        self.key = key
+        self._values = {} # iid -> valores exibidos (evita ler o widget para comparar)
+
+    def refresh(self, rows):
+        """
+        Exibe `rows` (tuplas com os valores das colunas, na ordem desejada).
+        """
+        tree = self.tree
+        desired = []
+        desired_positions = {}
+        for values in rows:
+            iid = str(self.key(values))
+            if iid in desired_positions:
+                continue # Chave repetida: mantém a primeira ocorrência
+            desired_positions[iid] = len(desired)
+            desired.append((iid, tuple(values)))
+
+        current = tree.get_children("")
+        scroll_anchor = self._first_visible(current)
+
+        removed = [iid for iid in current if iid not in desired_positions]
+        if removed:
+            tree.delete(*removed)
+            for iid in removed:
+                self._values.pop(iid, None)
+        existing = [iid for iid in current if iid in desired_positions]
+        existing_set = set(existing)
+        stable = self._stable_items(existing, desired_positions)
+
+        # Os itens fora de ordem vão para o fim, deixando no início apenas os estáveis,
+        # já na ordem relativa certa. Cada linha desejada vai então para o seu próprio
+        # índice em `desired`, sem consultar tree.index(), que percorre os irmãos.
+        for iid in existing:
+            if iid not in stable:
+                tree.move(iid, "", "end")
+        for index, (iid, values) in enumerate(desired):
+            if iid not in existing_set:
+                tree.insert("", index, iid=iid, values=values)
+            else:
+                if self._values.get(iid) != values:
+                    tree.item(iid, values=values)
+                if iid not in stable:
+                    tree.move(iid, "", index) # Vem de depois de `index`: a remoção não desloca o destino
+            self._values[iid] = values
+
+        if scroll_anchor is not None and scroll_anchor in desired_positions:
+            tree.yview_moveto(desired_positions[scroll_anchor] / len(desired))
+
+    def clear(self):
+        self.refresh(())
+
+    def set_row(self, values):
+        """
+        Atualiza (ou acrescenta ao final) uma única linha, sem percorrer as demais.
+        """
+        values = tuple(values)
+        iid = str(self.key(values))
+        if self.tree.exists(iid):
+            if self._values.get(iid) != values:
+                self.tree.item(iid, values=values)
+        else:
+            self.tree.insert("", "end", iid=iid, values=values)
+        self._values[iid] = values
+
+    def remove_row(self, key):
+        iid = str(key)
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+        self._values.pop(iid, None)
+
+    def update_rows(self, rows):
+        """
+        Atualiza os valores das linhas já exibidas cujas chaves aparecem em `rows`;
+        linhas que não estão na lista são ignoradas.
+        """
+        for values in rows:
+            values = tuple(values)
+            iid = str(self.key(values))
+            if iid in self._values and self._values[iid] != values:
+                self.tree.item(iid, values=values)
+                self._values[iid] = values
+
+    def _first_visible(self, children):
+        """
+        Linha no topo da área visível, ou None se a lista não estiver rolada.
+        """
+        top = self.tree.yview()[0]
+        if not children or top <= 0:
+            return None
+        return children[min(len(children) - 1, int(round(top * len(children))))]
+
+    @staticmethod
+    def _stable_items(existing, desired_positions):
+        """
+        Itens que já estão na ordem relativa correta (maior subsequência crescente das
+        posições desejadas); apenas os demais precisam ser movidos.
+        """
+        positions = [desired_positions[iid] for iid in existing]
+        tails = [] # tails[k] = índice em positions do menor final de subsequência de tamanho k+1
+        parents = [-1] * len(positions)
+        for i, position in enumerate(positions):
+            low, high = 0, len(tails)
+            while low < high:
+                middle = (low + high) // 2
+                if positions[tails[middle]] < position:
+                    low = middle + 1
+                else:
+                    high = middle
+            parents[i] = tails[low - 1] if low > 0 else -1
+            if low == len(tails):
+                tails.append(i)
+            else:
+                tails[low] = i
+        stable = set()
+        i = tails[-1] if tails else -1
+        while i != -1:
+            stable.add(existing[i])
+            i = parents[i]
+        return stable
+
+
+class EventBus:
+    """
+    Notificação de alterações nos dados entre as telas.
+
+    Quem altera o banco publica um tópico ("products", "sales", "customers") com
+    os detalhes da mudança; cada tela assinante decide se atualiza apenas as
+    linhas afetadas (se estiver visível) ou se marca a lista como desatualizada
+    para recarregá-la quando for exibida.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, **details):
+        for handler in list(self._handlers.get(topic, ())):
+            handler(**details)
+
+
+class Cart:
+    """
+    Carrinho da venda em andamento. Valores monetários em centavos (int).
+
+    O subtotal é mantido a cada alteração de linha (somando apenas a diferença), de
+    modo que adicionar um item, mudar uma quantidade ou aplicar um desconto custa o
+    mesmo qualquer que seja o tamanho do carrinho. O total final e o troco são
+    calculados a partir deste modelo, e não do texto exibido na tela.
+    """
+
+    def __init__(self):
+        self.items = {} # product_id -> {'name', 'price_cents', 'quantity'}
+        self.subtotal = 0
+        self.discount_value = 0.0 # Como digitado: porcentagem ou reais, conforme discount_type
+        self.discount_type = "Porcentagem"
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, product_id):
+        return product_id in self.items
+
+    def quantity(self, product_id):
+        item = self.items.get(product_id)
+        return item['quantity'] if item else 0
+
+    def add(self, product_id, name, price_cents, quantity):
+        item = self.items.get(product_id)
+        if item is None:
+            item = self.items[product_id] = {'name': name, 'price_cents': price_cents, 'quantity': 0}
+        item['quantity'] += quantity
+        self.subtotal += quantity * item['price_cents']
+
+    def set_quantity(self, product_id, quantity):
+        item = self.items[product_id]
+        self.subtotal += (quantity - item['quantity']) * item['price_cents']
+        item['quantity'] = quantity
+
+    def remove(self, product_id):
+        item = self.items.pop(product_id)
+        self.subtotal -= item['quantity'] * item['price_cents']
+
+    def clear(self):
+        self.items = {}
+        self.subtotal = 0
+        self.discount_value = 0.0
+        self.discount_type = "Porcentagem"
+
+    def set_discount(self, value, discount_type):
+        """
+        Raises:
+            ValueError: Se o valor não for um número finito e não negativo; o
+                desconto anterior é mantido.
+        """
+        amount = to_decimal(value)
+        if amount < 0:
+            raise ValueError("O valor do desconto não pode ser negativo.")
+        self.discount_value = float(amount)
+        self.discount_type = discount_type
+
+    @property
+    def discount(self):
+        """
+        Desconto em centavos, limitado ao subtotal.
+        """
+        if self.discount_type == "Porcentagem":
+            discount = percent_of(self.subtotal, self.discount_value)
+        elif self.discount_type == "Valor Fixo":
+            discount = to_cents(self.discount_value)
+        else:
+            discount = 0
+        return min(discount, self.subtotal)
+
+    @property
+    def total(self):
+        """
+        Total em centavos com o desconto aplicado (nunca negativo).
+        """
+        return self.subtotal - self.discount
+
+    def line_values(self, product_id):
+        """
+        Valores da linha do produto no Treeview do carrinho.
+        """
+        item = self.items[product_id]
+        return (product_id, item['name'], format_money(item['price_cents']), item['quantity'], format_money(item['quantity'] * item['price_cents']))
+
+    def rows(self):
+        return [self.line_values(product_id) for product_id in self.items]
+
+
+class KeysetPager:
+    """
+    Consulta paginada por chave (keyset): cada página continua a partir da chave de
+    ordenação da última linha exibida (WHERE (k1, k2) > (?, ?)) em vez de usar
+    OFFSET, então buscar uma página custa o mesmo no início ou no fim da tabela.
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self, db, base_query, params, order_by, key_indexes, descending=False, page_size=PAGE_SIZE):
+        """
+        Args:
+            base_query: SELECT com cláusula WHERE e sem ORDER BY; as condições de
+                paginação são acrescentadas com AND.
+            params: Parâmetros de base_query.
+            order_by: Expressões SQL da chave de ordenação (a última deve ser única, ex.: o id).
+            key_indexes: Posições dessas expressões nas linhas retornadas.
+            descending: Ordem decrescente (ex.: vendas mais recentes primeiro).
+        """
+        self.db = db
+        self.base_query = base_query
+        self.params = tuple(params)
+        self.order_by = tuple(order_by)
+        self.key_indexes = tuple(key_indexes)
+        self.descending = descending
+        self.page_size = page_size
+
+    def count(self):
+        return self.db.fetchvalue(f"SELECT COUNT(*) FROM ({self.base_query})", self.params, 0)
+
+    def first_page(self):
+        return self._fetch(None, forward=True)
+
+    def page_after(self, row):
+        return self._fetch(row, forward=True)
+
+    def page_before(self, row):
+        return self._fetch(row, forward=False)
+
+    def _fetch(self, row, forward):
+        ascending = forward != self.descending
+        query = self.base_query
+        params = list(self.params)
+        if row is not None:
+            columns = ", ".join(self.order_by)
+            placeholders = ", ".join("?" for _ in self.order_by)
+            query += f" AND ({columns}) {'>' if ascending else '<'} ({placeholders})"
+            params.extend(row[i] for i in self.key_indexes)
+        direction = "ASC" if ascending else "DESC"
+        query += " ORDER BY " + ", ".join(f"{column} {direction}" for column in self.order_by) + " LIMIT ?"
+        params.append(self.page_size)
+        rows = self.db.fetchall(query, tuple(params))
+        return rows if forward else rows[::-1]
+
+
+class PagedTreeview:
+    """
+    Lista virtual sobre um ttk.Treeview: o widget guarda apenas uma janela de
+    linhas (a área visível mais uma margem). Ao rolar perto de uma das bordas, a
+    próxima página é buscada no KeysetPager e as linhas do lado oposto são
+    descartadas. O total de linhas é exibido via COUNT(*), sem carregá-las.
+    """
+
+    MAX_WINDOW_ROWS = 300 # Linhas mantidas no widget (múltiplo de PAGE_SIZE)
+
+    def __init__(self, tree, format_row, count_label=None, noun="registro(s)", more_button=None):
+        """
+        Args:
+            tree: O ttk.Treeview exibido.
+            format_row: Converte uma linha do banco nos valores das colunas (o
+                primeiro valor é a chave primária, usada como iid).
+            count_label: CTkLabel opcional que mostra a posição e o total.
+            noun: Nome dos registros usado no texto do total.
+            more_button: CTkButton opcional ("Carregar mais") ligado a load_more;
+                fica desabilitado quando não há mais páginas.
+        """
+        self.tree = tree
+        self.format_row = format_row
+        self.count_label = count_label
+        self.noun = noun
+        self.more_button = more_button
+        self.binding = TreeviewBinding(tree)
+        self._pager = None
+        self._rows = []
+        self._offset = 0 # Posição da primeira linha da janela no resultado completo
+        self._at_end = True
+        self._total = 0
+        self._check_job = None
+        tree.configure(yscrollcommand=self._on_yview)
+
+    def show_pager(self, pager, first_rows=None, total=None):
+        """
+        Exibe o início de uma consulta paginada. `first_rows` e `total` podem ser
+        passados quando já foram buscados em segundo plano (DbWorker).
+        """
+        self._pager = pager
+        self._rows = list(pager.first_page() if first_rows is None else first_rows)
+        self._total = pager.count() if total is None else total
+        self._offset = 0
+        self._at_end = len(self._rows) < pager.page_size
+        self._render(top_index=0)
+
+    def show_rows(self, rows):
+        """
+        Exibe uma lista já completa e pequena (ex.: resultado limitado de uma busca).
+        """
+        self._pager = None
+        self._rows = list(rows)
+        self._total = len(self._rows)
+        self._offset = 0
+        self._at_end = True
+        self._render(top_index=0)
+
+    def patch_rows(self, rows):
+        """
+        Substitui, na janela atual, as linhas com as mesmas chaves de `rows` (ex.:
+        estoque alterado por uma venda), sem consultar de novo a página inteira.
+        """
+        rows_by_key = {self.format_row(row)[0]: row for row in rows}
+        changed = []
+        for index, row in enumerate(self._rows):
+            new_row = rows_by_key.get(self.format_row(row)[0])
+            if new_row is not None:
+                self._rows[index] = new_row
+                changed.append(self.format_row(new_row))
+        self.binding.update_rows(changed)
+
+    def load_more(self):
+        """
+        Acrescenta a próxima página ao fim da lista e rola até ela (botão "Carregar mais").
+        """
+        if self._pager is None or self._at_end or not self._rows:
+            return
+        self._append_page(top_index=len(self._rows))
+
+    def _append_page(self, top_index):
+        page = self._pager.page_after(self._rows[-1])
+        self._at_end = len(page) < self._pager.page_size
+        self._rows.extend(page)
+        trimmed = max(0, len(self._rows) - self.MAX_WINDOW_ROWS)
+        del self._rows[:trimmed]
+        self._offset += trimmed
+        self._render(top_index=top_index - trimmed)
+
+    def _render(self, top_index=None):
+        self.binding.refresh(self.format_row(row) for row in self._rows)
+        if top_index is not None and self._rows:
+            self.tree.yview_moveto(top_index / len(self._rows))
+        if self.count_label is not None:
+            if self._rows:
+                text = f"Exibindo {self._offset + 1}–{self._offset + len(self._rows)} de {self._total} {self.noun}"
+            else:
+                text = f"Nenhum(a) {self.noun}"
+            self.count_label.configure(text=text)
+        if self.more_button is not None:
+            self.more_button.configure(state="disabled" if self._pager is None or self._at_end else "normal")
+
+    def _on_yview(self, first, last):
+        # Chamado pelo Tk a cada mudança de rolagem; a busca fica para o próximo ciclo ocioso
+        if self._pager is not None and self._check_job is None:
+            self._check_job = self.tree.after_idle(self._load_more, float(first), float(last))
+
+    def _load_more(self, first, last):
+        self._check_job = None
+        count = len(self._rows)
+        if self._pager is None or not count:
+            return
+        margin = self._pager.page_size // 2
+        first_visible = int(round(first * count))
+        last_visible = int(round(last * count))
+
+        if not self._at_end and count - last_visible < margin:
+            self._append_page(top_index=first_visible)
+        elif self._offset > 0 and first_visible < margin:
+            page = self._pager.page_before(self._rows[0])
+            self._rows[:0] = page
+            self._offset = max(0, self._offset - len(page)) if len(page) == self._pager.page_size else 0
+            trimmed = max(0, len(self._rows) - self.MAX_WINDOW_ROWS)
+            if trimmed:
+                del self._rows[-trimmed:]
+                self._at_end = False
+            self._render(top_index=first_visible + len(page))
+
+
+THUMBNAIL_SIZE = (120, 120) # Tamanho da prévia da imagem do produto
+THUMBNAIL_SUFFIX = "_thumb.png" # Miniatura gravada ao lado do original
+
+
+def thumbnail_path(image_path):
+    """
+    Caminho da miniatura pré-gerada de `image_path` (no mesmo diretório).
+    """
+    return os.path.splitext(image_path)[0] + THUMBNAIL_SUFFIX
+
+
+def make_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """
+    Gera (ou regenera) a miniatura de `image_path` e a grava ao lado do original.
+
+    Em JPEG, draft() faz o decodificador entregar a imagem já reduzida (escala DCT
+    de 1/2 a 1/8), e o resize com reducing_gap reduz por fatores inteiros (reduce)
+    antes do LANCZOS, então fotos de vários megapixels não são decodificadas nem
+    filtradas em tamanho cheio.
+
+    Returns:
+        str: O caminho da miniatura.
+    """
+    destination = thumbnail_path(image_path)
+    with Image.open(image_path) as image:
+        image.draft("RGB", size)
+        thumbnail = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if thumbnail.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        thumbnail = thumbnail.convert("RGBA")
+    temporary = destination + ".tmp"
+    thumbnail.save(temporary, format="PNG")
+    os.replace(temporary, destination) # Leitores nunca veem uma miniatura pela metade
+    return destination
+
+
+ORPHAN_IMAGE_GRACE_SECONDS = 24 * 60 * 60 # Idade mínima de um arquivo sem referência para ser removido
+IMAGE_GC_INTERVAL_MS = 60 * 60 * 1000 # Intervalo do coletor de imagens órfãs com o PDV aberto
+
+
+def import_product_image(source_path, images_dir=PRODUCT_IMAGES_DIR):
+    """
+    Copia uma imagem para o armazenamento endereçado por conteúdo: o nome do
+    arquivo é o SHA-256 do conteúdo, então a mesma foto usada por vários produtos
+    (ou selecionada de novo) é gravada uma única vez. A miniatura é gerada junto.
+
+    Returns:
+        str: O caminho da imagem no armazenamento, a ser gravado em products.image_path.
+    """
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    destination = os.path.join(images_dir, digest.hexdigest() + os.path.splitext(source_path)[1].lower())
+
+    thumbnail = thumbnail_path(destination)
+    if os.path.exists(destination):
+        # Renova a carência do coletor (a seleção ainda pode não ser salva em um produto)
+        os.utime(destination)
+        if os.path.exists(thumbnail):
+            os.utime(thumbnail)
+    else:
+        temporary = destination + ".tmp"
+        shutil.copyfile(source_path, temporary)
+        os.replace(temporary, destination)
+    if not os.path.exists(thumbnail):
+        make_thumbnail(destination)
+    return destination
+
+
+def image_reference_count(db, image_path):
+    """
+    Número de produtos que usam `image_path` (idx_products_image_path).
+    """
+    return db.fetchvalue("SELECT COUNT(*) FROM products WHERE image_path = ?", (image_path,), 0)
+
+
+def collect_orphan_images(db, images_dir=PRODUCT_IMAGES_DIR, grace_seconds=ORPHAN_IMAGE_GRACE_SECONDS):
+    """
+    Remove do armazenamento as imagens sem nenhuma referência em products.image_path
+    (produto excluído, imagem trocada, seleção cancelada), com suas miniaturas e
+    arquivos temporários. Arquivos modificados há menos de `grace_seconds` são
+    mantidos: podem pertencer a um cadastro ainda não salvo.
+
+    Returns:
+        tuple: (arquivos removidos, bytes liberados).
+    """
+    referenced = set()
+    for (image_path,) in db.fetchall("SELECT DISTINCT image_path FROM products WHERE image_path IS NOT NULL"):
+        referenced.add(os.path.normcase(os.path.abspath(image_path)))
+        referenced.add(os.path.normcase(os.path.abspath(thumbnail_path(image_path))))
+
+    cutoff = time.time() - grace_seconds
+    removed = freed = 0
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or os.path.normcase(os.path.abspath(entry.path)) in referenced:
+                continue
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                print(f"Aviso: Não foi possível excluir o arquivo de imagem {entry.path}: {e}")
+                continue
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
+
+
+class ThumbnailCache:
+    """
+    Cache LRU, em memória, das miniaturas (PhotoImage) exibidas na prévia de produtos.
+
+    A chave é (caminho, mtime) do original, então trocar o arquivo invalida a entrada.
+    Numa falta, lê a miniatura pré-gerada (make_thumbnail), recriando-a se estiver
+    ausente ou for mais antiga que o original. As entradas menos usadas são
+    descartadas quando a memória estimada (largura × altura × 4 bytes) passa de
+    `max_bytes`.
+    """
+
+    MAX_BYTES = 8 * 1024 * 1024 # ~145 miniaturas de 120×120
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict() # (caminho, mtime) -> (PhotoImage, bytes)
+
+    def get(self, image_path):
+        """
+        Retorna o PhotoImage da miniatura de `image_path` (deve ser chamado na thread do Tk).
+        """
+        mtime = os.stat(image_path).st_mtime_ns
+        key = (os.path.abspath(image_path), mtime)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        thumb = thumbnail_path(image_path)
+        if not os.path.exists(thumb) or os.stat(thumb).st_mtime_ns < mtime:
+            make_thumbnail(image_path)
+        with Image.open(thumb) as image:
+            photo = ImageTk.PhotoImage(image)
+        size = photo.width() * photo.height() * 4
+
+        self.discard(image_path) # Versões antigas do mesmo arquivo
+        self._entries[key] = (photo, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+        return photo
+
+    def discard(self, image_path):
+        """
+        Remove do cache as entradas de `image_path` (ex.: imagem excluída).
+        """
+        path = os.path.abspath(image_path)
+        for key in [key for key in self._entries if key[0] == path]:
+            self.total_bytes -= self._entries.pop(key)[1]
+
+
 class AuthApp:
     def __init__(self, master):
         """
@@ -35,8 +2186,9 @@ class AuthApp:
         master.geometry(f"{window_width}x{window_height}+{x_cordinate}+{y_cordinate}")
         master.resizable(False, False) # Mantém não redimensionável para tela de login
 
-        self.db_name = "pdv.db" # Usaremos o mesmo DB para usuários e PDV
-        self._init_auth_db()
+        self.db_name = DB_NAME
+        self.db = Database.shared(self.db_name)
+        self.db.migrate()
 
         self.login_frame = ctk.CTkFrame(master, corner_radius=15, fg_color=("gray90", "gray15")) # Fundo do frame de login
         self.login_frame.pack(pady=40, padx=40, fill="both", expand=True)
@@ -45,69 +2197,6 @@ class AuthApp:
 
         self.create_login_widgets()
 
-    def _init_auth_db(self):
-        """
-        Inicializa o banco de dados para autenticação, criando a tabela de usuários se não existir.
-        Lida com a migração para remover a restrição UNIQUE da coluna 'establishment_name'
-        se o banco de dados já existir com a estrutura antiga, e garante que a coluna 'role' exista.
-        """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        # Verifica se a tabela 'users' existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        table_exists = cursor.fetchone()
-
-        if table_exists:
-            # Obtém a definição atual da tabela 'users'
-            cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='users'")
-            create_table_sql = cursor.fetchone()[0]
-            
-            # Verifica se o fragmento antigo (com UNIQUE em establishment_name) está presente
-            old_fragment = "establishment_name TEXT NOT NULL UNIQUE"
-
-            if old_fragment in create_table_sql:
-                print("Migração necessária: a coluna 'establishment_name' possui restrição UNIQUE. Realizando migração.")
-                cursor.execute("ALTER TABLE users RENAME TO old_users")
-
-                cursor.execute("""
-                    CREATE TABLE users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        establishment_name TEXT NOT NULL,
-                        username TEXT NOT NULL UNIQUE,
-                        password_hash TEXT NOT NULL,
-                        role TEXT DEFAULT 'caixa' NOT NULL
-                    )
-                """)
-
-                cursor.execute("""
-                    INSERT INTO users (id, establishment_name, username, password_hash, role)
-                    SELECT id, establishment_name, username, password_hash, role FROM old_users
-                """)
-
-                cursor.execute("DROP TABLE old_users")
-                print("Migração concluída: restrição UNIQUE removida de 'establishment_name'.")
-            
-            # Garante que a coluna 'role' exista, para compatibilidade com DBs muito antigos
-            cursor.execute("PRAGMA table_info(users)")
-            current_columns = [col[1] for col in cursor.fetchall()]
-            if 'role' not in current_columns:
-                print("Adicionando coluna 'role'.")
-                cursor.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'caixa' NOT NULL")
-        else:
-            # A tabela 'users' não existe, então a cria com a estrutura correta (sem UNIQUE em establishment_name)
-            cursor.execute("""
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    establishment_name TEXT NOT NULL,
-                    username TEXT NOT NULL UNIQUE,
-                    password_hash TEXT NOT NULL,
-                    role TEXT DEFAULT 'caixa' NOT NULL
-                )
-            """)
-        conn.commit()
-        conn.close()
-
     def hash_password(self, password):
         """
         Gera o hash SHA256 de uma senha.
@@ -196,11 +2285,7 @@ class AuthApp:
             messagebox.showerror("Erro de Login", "Por favor, preencha todos os campos.")
             return
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, establishment_name, username, password_hash, role FROM users WHERE username=? AND password_hash=?", (username, password_hash))
-        user = cursor.fetchone()
-        conn.close()
+        user = self.db.fetchone("SELECT id, establishment_name, username, password_hash, role FROM users WHERE username=? AND password_hash=?", (username, password_hash))
 
         if user:
             messagebox.showinfo("Login Bem-sucedido", f"Bem-vindo, {user[2]} ({user[4]})!")
@@ -232,32 +2317,30 @@ class AuthApp:
 
         password_hash = self.hash_password(password)
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT COUNT(*) FROM users WHERE username = ?", (username,))
-            if cursor.fetchone()[0] > 0:
+            if self.db.fetchvalue("SELECT COUNT(*) FROM users WHERE username = ?", (username,)) > 0:
                 messagebox.showerror("Erro de Cadastro", "Este nome de usuário já está em uso. Por favor, escolha outro.")
                 return
 
-            cursor.execute("SELECT COUNT(*) FROM users WHERE establishment_name = ?", (establishment_name,))
-            if cursor.fetchone()[0] > 0:
+            if self.db.fetchvalue("SELECT COUNT(*) FROM users WHERE establishment_name = ?", (establishment_name,)) > 0:
                 messagebox.showerror("Erro de Cadastro", "Este nome de estabelecimento já está em uso. Por favor, escolha outro.")
                 return
 
-            cursor.execute("SELECT COUNT(*) FROM users")
-            user_count = cursor.fetchone()[0]
-            role_to_assign = 'admin' if user_count == 0 else 'caixa'
+            with self.db.transaction(immediate=True) as cursor:
+                cursor.execute("SELECT COUNT(*) FROM users")
+                user_count = cursor.fetchone()[0]
+                role_to_assign = 'admin' if user_count == 0 else 'caixa'
 
-            cursor.execute("INSERT INTO users (establishment_name, username, password_hash, role) VALUES (?, ?, ?, ?)",
-                           (establishment_name, username, password_hash, role_to_assign))
-            conn.commit()
+                cursor.execute("INSERT INTO users (establishment_name, username, password_hash, role) VALUES (?, ?, ?, ?)",
+                               (establishment_name, username, password_hash, role_to_assign))
             messagebox.showinfo("Cadastro Bem-sucedido", f"Estabelecimento e usuário '{username}' ({role_to_assign}) cadastrados com sucesso! Faça login para continuar.")
             self.create_login_widgets()
         except Exception as e:
             messagebox.showerror("Erro", f"Ocorreu um erro no cadastro: {e}")
-        finally:
-            conn.close()
+
+
+ADMIN_FRAMES = {"returns", "reports", "user_management", "customers"} # Telas restritas ao administrador
+FRAME_IDLE_BUILD_DELAY_MS = 50 # Pausa entre a construção de uma tela ociosa e a próxima
 
 
 class PdvApp:
@@ -277,166 +2360,92 @@ class PdvApp:
         self.master.grid_columnconfigure(1, weight=3)
         self.master.grid_rowconfigure(0, weight=1)
 
-        self.db_name = "pdv.db"
+        self.db_name = DB_NAME
+        self.db = Database.shared(self.db_name)
         self.MINIMUM_STOCK_THRESHOLD = 5
-        self._init_db()
+        self.db.migrate()
 
-        self.current_cart = {}
+        self.cart = Cart()
         self.selected_product_for_sale_id = None
         self.editing_product_id = None
         self.selected_cart_item_id = None
         self.selected_user_id = None
         self.selected_return_sale_id = None
-        self.selected_return_item_id = None
+        self.selected_return_item_ids = [] # Linhas (product_id) selecionadas para devolução
         self.selected_customer_id = None # Novo: ID do cliente selecionado
 
-        self.current_discount_value = 0.0
-        self.current_discount_type = "Porcentagem"
         self.current_product_image_path = None # Novo: Caminho da imagem do produto selecionado/em edição
 
         # Garante que o diretório de imagens de produtos existe
-        self.product_images_dir = "product_images"
+        self.product_images_dir = PRODUCT_IMAGES_DIR
         os.makedirs(self.product_images_dir, exist_ok=True)
+        self.thumbnail_cache = ThumbnailCache() # Prévias já decodificadas (ver display_product_image_on_load)
+
+        # Consultas demoradas (relatórios e históricos) rodam fora da thread do Tk
+        self.db_worker = DbWorker(self.master, self.db)
+
+        # Alterações nos dados são publicadas no EventBus: a tela visível atualiza só
+        # as linhas afetadas e as listas das telas ocultas ficam marcadas como
+        # desatualizadas, sendo recarregadas por show_frame quando exibidas.
+        self.events = EventBus()
+        self.events.subscribe("products", self._on_products_changed)
+        self.events.subscribe("sales", self._on_sales_changed)
+        self.events.subscribe("customers", self._on_customers_changed)
+        # Tela exibida ao abrir o sistema: o caixa entra direto em Vendas; o administrador,
+        # que cuida do cadastro, continua entrando em Produtos
+        self.current_frame = "products" if self.user_role == 'admin' else "sales"
+        self.stale_views = {"products", "sales_products", "history", "returns", "reports", "customers"}
+
+        # Buscas incrementais dos campos de busca (ver DebouncedSearch)
+        self.product_management_search = DebouncedSearch(
+            self.master, lambda: self.product_search_entry.get(),
+            self._query_products_management, self._render_products_management, refine=refine_product_search)
+        self.sales_product_search = DebouncedSearch(
+            self.master, lambda: self.sales_product_search_entry_list.get(),
+            self._query_products_for_sale, self._render_products_for_sale, refine=refine_product_search)
+        self.return_sale_search = DebouncedSearch(
+            self.master, lambda: self.return_sale_search_entry.get(),
+            lambda term: search_sales_for_returns(self.db, term), self._render_sales_for_returns, refine=refine_sales_for_returns)
+        self.customer_search = DebouncedSearch(
+            self.master, lambda: self.customer_search_entry.get(),
+            self._query_customers_management, self._render_customers_management)
+        self.customer_sales_search = DebouncedSearch(
+            self.master, lambda: self.customer_sales_entry.get(),
+            lambda term: search_customers(self.db, term), self._render_customer_choices)
+        self.customer_sales_choices = {} # Texto exibido no seletor -> (id, nome) do cliente
 
         self.create_widgets()
         self._apply_role_permissions()
+        self._schedule_idle_build() # Constrói as demais telas em segundo plano, Vendas primeiro
+        self._schedule_wal_checkpoint()
+        self.image_gc_job = self.master.after(0, self._run_image_gc) # Primeira coleta ao abrir o PDV
 
-    def _init_db(self):
+    def _schedule_wal_checkpoint(self):
         """
-        Inicializa o banco de dados SQLite, criando as tabelas e índices se não existirem.
-        Tabelas: products, sales, sale_items, returns, customers.
+        Agenda o checkpoint periódico do WAL para manter o arquivo -wal limitado
+        durante um dia inteiro de vendas.
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        # Tabela de produtos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                price REAL NOT NULL,
-                stock INTEGER NOT NULL,
-                image_path TEXT DEFAULT NULL
-            )
-        """)
-        # Adiciona a coluna 'image_path' se não existir
-        cursor.execute("PRAGMA table_info(products)")
-        product_columns = [col[1] for col in cursor.fetchall()]
-        if 'image_path' not in product_columns:
-            cursor.execute("ALTER TABLE products ADD COLUMN image_path TEXT DEFAULT NULL")
-
-        # Adiciona índice para pesquisa rápida por nome de produto
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products (name);")
-
-        # Tabela de clientes (NOVO)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT,
-                email TEXT
-            )
-        """)
-        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_name_phone_email ON customers (name, phone, email);") # Índice para unicidade
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_name ON customers (name);")
+        self.wal_checkpoint_job = self.master.after(Database.CHECKPOINT_INTERVAL_MS, self._run_wal_checkpoint)
 
-        # Tabela de vendas
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                total REAL NOT NULL,
-                customer_id INTEGER, -- Novo: ID do cliente vinculado
-                customer_name TEXT, -- Mantido para compatibilidade e casos sem customer_id
-                payment_method TEXT,
-                discount_value REAL DEFAULT 0.0,
-                discount_type TEXT DEFAULT 'Nenhum',
-                received_amount REAL DEFAULT 0.0,
-                change_amount REAL DEFAULT 0.0,
-                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL
-            )
-        """)
-        # Adiciona a coluna 'customer_id' e sua FK se não existir
-        cursor.execute("PRAGMA table_info(sales)")
-        sales_columns = [col[1] for col in cursor.fetchall()]
-        if 'customer_id' not in sales_columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN customer_id INTEGER")
-            # Adiciona a restrição de chave estrangeira (requer que a tabela não esteja em uso)
-            # Para adicionar a FK após a criação da coluna, é geralmente necessário recriar a tabela.
-            # No SQLite, ALTER TABLE ADD COLUMN não suporta FOREIGN KEY.
-            # Uma forma robusta seria:
-            # 1. Renomear a tabela sales para old_sales
-            # 2. Criar a nova tabela sales com a FK
-            # 3. Copiar dados de old_sales para sales
-            # 4. Excluir old_sales
-            # Para simplificar agora, se a coluna não existe, apenas a adicionamos,
-            # e a FK será efetivada em futuras criações de DB ou se a tabela for migrada.
-            # O ON DELETE SET NULL é importante para não apagar vendas ao apagar cliente.
-
-        if 'received_amount' not in sales_columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN received_amount REAL DEFAULT 0.0")
-        if 'change_amount' not in sales_columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN change_amount REAL DEFAULT 0.0")
-
-        # Adiciona índices para pesquisa rápida no histórico de vendas
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_timestamp ON sales (timestamp);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_name ON sales (customer_name);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_id ON sales (customer_id);") # Novo índice
-
-        # Tabela de itens de venda
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sale_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sale_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                product_name TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                price REAL NOT NULL,
-                FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        """)
-        # Adiciona índices para pesquisa rápida de itens de venda
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items (sale_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_product_id ON sale_items (product_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_product_name ON sale_items (product_name);")
-
-
-        # Tabela para registrar devoluções
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS returns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sale_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                product_name TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                return_timestamp TEXT NOT NULL,
-                reason TEXT,
-                processed_by_user_id INTEGER NOT NULL,
-                FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
-                FOREIGN KEY (product_id) REFERENCES products (id),
-                FOREIGN KEY (processed_by_user_id) REFERENCES users (id)
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_returns_sale_id ON returns (sale_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_returns_timestamp ON returns (return_timestamp);")
-
-
-        # Adiciona as colunas customer_name e payment_method se não existirem
-        cursor.execute("PRAGMA table_info(sales)")
-        columns = [col[1] for col in cursor.fetchall()]
+    def _run_wal_checkpoint(self):
+        try:
+            self.db.run_checkpoint_policy()
+        except sqlite3.Error as e:
+            print(f"Aviso: checkpoint do WAL não executado: {e}")
+        self._schedule_wal_checkpoint()
 
-        if 'customer_name' not in columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN customer_name TEXT")
-        if 'payment_method' not in columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN payment_method TEXT")
-        if 'discount_value' not in columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN discount_value REAL DEFAULT 0.0")
-        if 'discount_type' not in columns:
-            cursor.execute("ALTER TABLE sales ADD COLUMN discount_type TEXT DEFAULT 'Nenhum'")
+    def _run_image_gc(self):
+        """
+        Coleta as imagens de produtos órfãs na thread do DbWorker e agenda a próxima.
+        """
+        self.db_worker.submit("image_gc", lambda db: collect_orphan_images(db, self.product_images_dir),
+                              self._on_image_gc_done)
+        self.image_gc_job = self.master.after(IMAGE_GC_INTERVAL_MS, self._run_image_gc)
 
-        conn.commit()
-        conn.close()
+    def _on_image_gc_done(self, result):
+        removed, freed = result
+        if removed:
+            print(f"Imagens órfãs removidas: {removed} ({freed / 1024:.0f} KiB liberados).")
 
     def create_widgets(self):
         """
@@ -507,64 +2516,95 @@ class PdvApp:
         self.main_content_frame.grid_rowconfigure(0, weight=1)
         self.main_content_frame.grid_columnconfigure(0, weight=1)
 
-        self.products_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent")
-        self.sales_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent")
-        self.history_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent")
-        self.returns_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent")
-        self.reports_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent")
-        self.user_management_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent") 
-        self.customers_frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent") # NOVO FRAME DE CLIENTES
-
-        # Grid all frames initially to allow show_frame to work by grid_remove/grid
-        self.products_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        self.sales_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        self.history_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        self.returns_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        self.reports_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        self.user_management_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10) 
-        self.customers_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10) # NOVO
-
-        # Immediately hide all frames except the initial one (products_frame)
-        self.sales_frame.grid_remove()
-        self.history_frame.grid_remove()
-        self.returns_frame.grid_remove()
-        self.reports_frame.grid_remove()
-        self.user_management_frame.grid_remove()
-        self.customers_frame.grid_remove() # NOVO
-
-        self.products_frame.grid_columnconfigure(1, weight=1)
-        self.products_frame.grid_rowconfigure(9, weight=1)
+        # Estilos dos Treeviews, compartilhados pelas telas (cores: update_treeview_styles)
+        tree_style = ttk.Style()
+        tree_style.theme_use("clam")
+        for style_name in ("Treeview", "UserTreeview", "CustomerTreeview"):
+            tree_style.configure(f"{style_name}.Heading", font=("Roboto", 11, "bold"),
+                                 background=self.primary_green,
+                                 foreground=self.text_color_light, borderwidth=1,
+                                 bordercolor=self.primary_green)
+            tree_style.layout(style_name, [('Treeview.treearea', {'sticky': 'nswe'})])
+
+        # As telas são construídas sob demanda: na primeira exibição (show_frame) ou,
+        # depois que a janela abre, uma a uma quando a interface fica ociosa, na ordem
+        # abaixo (Vendas primeiro: é a tela de trabalho do caixa e a mais usada pelo
+        # administrador depois de Produtos, sua tela inicial).
+        self.frame_builders = {
+            "sales": self._build_sales_frame,
+            "products": self._build_products_frame,
+            "history": self._build_history_frame,
+            "returns": self._build_returns_frame,
+            "reports": self._build_reports_frame,
+            "customers": self._build_customers_frame,
+            "user_management": self._build_user_management_frame,
+        }
+        self.frames = {} # Nome da tela -> frame já construído
+        self.idle_build_job = None
+
+        # Exibe a tela inicial (as demais carregam seus dados ao serem exibidas)
+        self.update_treeview_styles()
+        self.show_frame(self.current_frame)
 
-        self.sales_frame.grid_columnconfigure(0, weight=1)
-        self.sales_frame.grid_columnconfigure(1, weight=1)
-        
-        self.history_frame.grid_columnconfigure(0, weight=1)
-        self.history_frame.grid_columnconfigure(1, weight=1)
-        self.history_frame.grid_rowconfigure(3, weight=1)
+    def _new_content_frame(self):
+        """
+        Cria o frame de uma tela na área de conteúdo, já posicionado e oculto
+        (show_frame alterna as telas com grid/grid_remove).
+        """
+        frame = ctk.CTkFrame(self.main_content_frame, fg_color="transparent")
+        frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
+        frame.grid_remove()
+        return frame
 
-        self.returns_frame.grid_columnconfigure(0, weight=1)
-        self.returns_frame.grid_columnconfigure(1, weight=1)
-        self.returns_frame.grid_rowconfigure(3, weight=1)
-        self.returns_frame.grid_rowconfigure(7, weight=1)
+    def _ensure_frame(self, frame_name):
+        """
+        Retorna o frame da tela `frame_name`, construindo-o (e aplicando as
+        permissões da tela) na primeira vez em que é necessário.
+        """
+        frame = self.frames.get(frame_name)
+        if frame is None:
+            frame = self.frame_builders[frame_name]()
+            self.frames[frame_name] = frame
+            self._apply_role_permissions(frame_name)
+        return frame
 
-        self.reports_frame.grid_columnconfigure(0, weight=1)
-        self.reports_frame.grid_rowconfigure(7, weight=1) 
+    def _schedule_idle_build(self):
+        """
+        Agenda a construção da próxima tela pendente. Cada tela é construída em um
+        ciclo ocioso próprio, devolvendo o controle ao Tk entre elas para que cliques
+        e leituras do scanner não esperem pela construção das demais.
+        """
+        self.idle_build_job = self.master.after(FRAME_IDLE_BUILD_DELAY_MS, self._queue_idle_build)
 
-        self.user_management_frame.grid_columnconfigure(0, weight=1) 
-        self.user_management_frame.grid_columnconfigure(1, weight=1)
-        self.user_management_frame.grid_rowconfigure(7, weight=1) 
+    def _queue_idle_build(self):
+        self.idle_build_job = self.master.after_idle(self._build_next_idle_frame)
 
-        self.customers_frame.grid_columnconfigure(1, weight=1) # NOVO
-        self.customers_frame.grid_rowconfigure(7, weight=1) # NOVO
+    def _build_next_idle_frame(self):
+        """
+        Constrói a próxima tela ainda não construída que o usuário pode acessar.
+        """
+        is_admin = (self.user_role == 'admin')
+        for frame_name in self.frame_builders:
+            if frame_name not in self.frames and (is_admin or frame_name not in ADMIN_FRAMES):
+                self._ensure_frame(frame_name)
+                self._schedule_idle_build()
+                return
+        self.idle_build_job = None
 
+    def _build_products_frame(self):
+        """
+        Constrói a tela de Gestão de Produtos.
+        """
+        self.products_frame = self._new_content_frame()
+        self.products_frame.grid_columnconfigure(1, weight=1)
+        self.products_frame.grid_rowconfigure(9, weight=1)
 
-        # --- Frame de Gerenciamento de Produtos ---
         ctk.CTkLabel(self.products_frame, text="Gerenciar Produtos", font=ctk.CTkFont(size=22, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, columnspan=3, pady=15)
 
         ctk.CTkLabel(self.products_frame, text="Buscar Produto (ID/Nome):").grid(row=1, column=0, sticky="w", padx=10, pady=5)
         self.product_search_entry = ctk.CTkEntry(self.products_frame, width=300, corner_radius=10, placeholder_text="Buscar por ID ou Nome")
         self.product_search_entry.grid(row=1, column=1, sticky="ew", padx=10, pady=5)
-        self.product_search_entry.bind("<KeyRelease>", self.filter_products_management)
+        self.product_search_entry.bind("<KeyRelease>", self.product_management_search.schedule)
 
         self.search_product_management_btn = ctk.CTkButton(self.products_frame, text="Buscar", command=self.filter_products_management,
                                                             fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10)
@@ -593,31 +2633,26 @@ class PdvApp:
                                              font=ctk.CTkFont(size=12))
         self.select_image_btn.grid(row=5, column=2, padx=10, pady=5, sticky="n")
 
+        ctk.CTkLabel(self.products_frame, text="Códigos de Barras:").grid(row=5, column=0, sticky="w", padx=10, pady=5)
+        self.product_barcodes_entry = ctk.CTkEntry(self.products_frame, width=300, corner_radius=10, placeholder_text="EAN/GTIN (separe vários por vírgula)")
+        self.product_barcodes_entry.grid(row=5, column=1, sticky="ew", padx=10, pady=5)
 
         self.add_product_btn = ctk.CTkButton(self.products_frame, text="Adicionar/Atualizar Produto", command=self.add_or_update_product,
                                             fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10,
                                             font=ctk.CTkFont(size=14, weight="bold"))
-        self.add_product_btn.grid(row=5, column=0, columnspan=2, pady=15) # Ajustei a linha para acomodar a imagem
+        self.add_product_btn.grid(row=6, column=0, columnspan=2, pady=15) # Ajustei a linha para acomodar a imagem
 
         self.delete_product_btn = ctk.CTkButton(self.products_frame, text="Excluir Produto Selecionado", command=self.delete_product,
                                                 fg_color="#F44336", hover_color="#D32F2F", corner_radius=10,
                                                 font=ctk.CTkFont(size=14, weight="bold"))
-        self.delete_product_btn.grid(row=6, column=0, columnspan=2, padx=10, pady=15) # Ajustei a linha
+        self.delete_product_btn.grid(row=7, column=0, columnspan=2, padx=10, pady=15) # Ajustei a linha
 
         self.low_stock_alert_label = ctk.CTkLabel(self.products_frame, text="", font=ctk.CTkFont(size=12, weight="bold"), text_color="#FF4500")
-        self.low_stock_alert_label.grid(row=7, column=0, columnspan=2, sticky="w", padx=10, pady=5) # Ajustei a linha
+        self.low_stock_alert_label.grid(row=8, column=0, columnspan=2, sticky="w", padx=10, pady=5) # Ajustei a linha
 
         self.show_low_stock_btn = ctk.CTkButton(self.products_frame, text="Ver Estoque Baixo", command=self.filter_low_stock_products,
                                                 fg_color="#FF4500", hover_color="#CD3700", corner_radius=10)
-        self.show_low_stock_btn.grid(row=7, column=2, padx=10, pady=5) # Ajustei a linha
-
-        product_style = ttk.Style()
-        product_style.theme_use("clam")
-        product_style.configure("Treeview.Heading", font=("Roboto", 11, "bold"), 
-                                background=self.primary_green,
-                                foreground=self.text_color_light, borderwidth=1, 
-                                bordercolor=self.primary_green)
-        product_style.layout("Treeview", [('Treeview.treearea', {'sticky': 'nswe'})])
+        self.show_low_stock_btn.grid(row=8, column=2, padx=10, pady=5) # Ajustei a linha
 
         self.product_tree = ttk.Treeview(self.products_frame, columns=("ID", "Nome", "Preço", "Estoque"), show="headings", style="Treeview")
         self.product_tree.heading("ID", text="ID")
@@ -629,10 +2664,20 @@ class PdvApp:
         self.product_tree.column("Preço", width=100, anchor="e")
         self.product_tree.column("Estoque", width=100, anchor="e")
         self.product_tree.grid(row=9, column=0, columnspan=3, sticky="nsew", padx=10, pady=10)
+        self.product_count_label = ctk.CTkLabel(self.products_frame, text="", text_color="gray")
+        self.product_count_label.grid(row=10, column=0, columnspan=3, sticky="w", padx=10)
+        self.product_tree_view = PagedTreeview(self.product_tree, self._format_product_row, self.product_count_label, "produto(s)")
         self.product_tree.bind("<<TreeviewSelect>>", self.on_product_select_for_management)
+        return self.products_frame
 
+    def _build_sales_frame(self):
+        """
+        Constrói a tela de Vendas.
+        """
+        self.sales_frame = self._new_content_frame()
+        self.sales_frame.grid_columnconfigure(0, weight=1)
+        self.sales_frame.grid_columnconfigure(1, weight=1)
 
-        # --- Frame de Vendas ---
         self.sales_product_list_frame = ctk.CTkFrame(self.sales_frame, fg_color="transparent")
         self.sales_product_list_frame.grid(row=0, column=0, rowspan=10, sticky="nsew", padx=5, pady=5)
         self.sales_product_list_frame.grid_columnconfigure(0, weight=1)
@@ -640,10 +2685,11 @@ class PdvApp:
 
         ctk.CTkLabel(self.sales_product_list_frame, text="Produtos Disponíveis", font=ctk.CTkFont(size=18, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, pady=(15, 10))
 
-        self.sales_product_search_entry_list = ctk.CTkEntry(self.sales_product_list_frame, placeholder_text="Buscar produto por nome ou ID (Enter para adicionar)", corner_radius=10)
+        self.sales_product_search_entry_list = ctk.CTkEntry(self.sales_product_list_frame, placeholder_text="Buscar por nome, ID ou código de barras (Enter para adicionar)", corner_radius=10)
         self.sales_product_search_entry_list.grid(row=1, column=0, sticky="ew", padx=10, pady=5)
-        # Modificado para lidar com Enter (barcode) e KeyRelease (filtragem)
-        self.sales_product_search_entry_list.bind("<Return>", self.handle_sales_product_search_entry)
+        # Enter (leitor de código de barras) adiciona ao carrinho; KeyRelease filtra a lista
+        self.sales_product_search_entry_list.bind("<Return>", self.handle_sales_scan)
+        self.sales_product_search_entry_list.bind("<KP_Enter>", self.handle_sales_scan)
         self.sales_product_search_entry_list.bind("<KeyRelease>", self.handle_sales_product_search_entry)
 
         self.product_selection_tree = ttk.Treeview(self.sales_product_list_frame, columns=("ID", "Nome", "Preço", "Estoque"), show="headings", style="Treeview")
@@ -656,6 +2702,7 @@ class PdvApp:
         self.product_selection_tree.column("Preço", width=70, anchor="e")
         self.product_selection_tree.column("Estoque", width=60, anchor="e")
         self.product_selection_tree.grid(row=2, column=0, sticky="nsew", padx=10, pady=10)
+        self.product_selection_tree_binding = TreeviewBinding(self.product_selection_tree)
         self.product_selection_tree.bind("<<TreeviewSelect>>", self.on_product_select_for_sale)
 
         ctk.CTkLabel(self.sales_product_list_frame, text="Produto Selecionado:").grid(row=3, column=0, sticky="w", padx=10, pady=5)
@@ -690,6 +2737,7 @@ class PdvApp:
         self.cart_tree.column("Qtde", width=60, anchor="e")
         self.cart_tree.column("Subtotal", width=90, anchor="e")
         self.cart_tree.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
+        self.cart_tree_binding = TreeviewBinding(self.cart_tree)
         self.cart_tree.bind("<<TreeviewSelect>>", self.on_cart_item_select)
 
         self.cart_actions_frame = ctk.CTkFrame(self.sales_cart_details_frame, fg_color="transparent")
@@ -739,12 +2787,23 @@ class PdvApp:
         self.change_label.grid(row=1, column=1, sticky="w", padx=5, pady=2)
         
         # NOVO: Seleção de Cliente na tela de Vendas
-        ctk.CTkLabel(self.sales_cart_details_frame, text="Cliente:").grid(row=6, column=0, sticky="w", padx=10, pady=5)
-        self.customer_sales_combobox = ctk.CTkComboBox(self.sales_cart_details_frame, values=["-- Selecione um Cliente (Opcional) --"],
-                                                       state="readonly", width=250, corner_radius=10,
-                                                       command=self.on_customer_select_in_sales)
-        self.customer_sales_combobox.set("-- Selecione um Cliente (Opcional) --")
-        self.customer_sales_combobox.grid(row=7, column=0, sticky="ew", padx=10, pady=5)
+        # Busca incremental: digite o início do nome, do telefone ou o ID e escolha na lista
+        # de sugestões que aparece sob o campo (um Listbox, e não o menu do CTkComboBox,
+        # que ao abrir captura o teclado e interromperia a digitação)
+        ctk.CTkLabel(self.sales_cart_details_frame, text="Cliente (nome, telefone ou ID):").grid(row=6, column=0, sticky="w", padx=10, pady=5)
+        self.customer_sales_entry = ctk.CTkEntry(self.sales_cart_details_frame, width=250, corner_radius=10, placeholder_text=NO_CUSTOMER_OPTION)
+        self.customer_sales_entry.grid(row=7, column=0, sticky="ew", padx=10, pady=5)
+        self.customer_sales_entry.bind("<KeyRelease>", self.on_customer_search_key_in_sales)
+        self.customer_sales_entry.bind("<Down>", self.on_customer_search_down_in_sales)
+        self.customer_sales_entry.bind("<Return>", self.on_customer_search_return_in_sales)
+        self.customer_sales_entry.bind("<Escape>", self.hide_customer_suggestions_in_sales)
+        self.customer_sales_entry.bind("<FocusOut>", self.on_customer_search_focus_out_in_sales)
+        self.customer_sales_suggestions = Listbox(self.sales_cart_details_frame, height=CUSTOMER_SUGGESTION_ROWS,
+                                                  activestyle="none", exportselection=False)
+        self.customer_sales_suggestions.bind("<ButtonRelease-1>", self.on_customer_select_in_sales)
+        self.customer_sales_suggestions.bind("<Return>", self.on_customer_select_in_sales)
+        self.customer_sales_suggestions.bind("<Escape>", self.hide_customer_suggestions_in_sales)
+        self.customer_sales_suggestions.bind("<FocusOut>", self.on_customer_search_focus_out_in_sales)
         
         # Mantive o entry antigo, agora para nomes avulsos sem vínculo a cadastro
         ctk.CTkLabel(self.sales_cart_details_frame, text="Nome Avulso (opcional):").grid(row=8, column=0, sticky="w", padx=10, pady=5)
@@ -771,8 +2830,18 @@ class PdvApp:
                                             font=ctk.CTkFont(size=14))
         self.cancel_sale_btn.grid(row=13, column=0, pady=5)
 
+        self.update_payment_fields() # Garante que os campos de pagamento em dinheiro estejam corretos
+        return self.sales_frame
+
+    def _build_history_frame(self):
+        """
+        Constrói a tela de Histórico de Vendas.
+        """
+        self.history_frame = self._new_content_frame()
+        self.history_frame.grid_columnconfigure(0, weight=1)
+        self.history_frame.grid_columnconfigure(1, weight=1)
+        self.history_frame.grid_rowconfigure(3, weight=1)
 
-        # --- Frame de Histórico de Vendas ---
         ctk.CTkLabel(self.history_frame, text="Histórico de Vendas", font=ctk.CTkFont(size=22, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, columnspan=2, pady=15)
 
         filter_frame = ctk.CTkFrame(self.history_frame, fg_color="transparent")
@@ -788,8 +2857,8 @@ class PdvApp:
         self.history_product_search_entry.grid(row=0, column=3, sticky="ew", padx=5)
 
         ctk.CTkLabel(filter_frame, text="Período:").grid(row=1, column=0, sticky="w", padx=5, pady=(5,0))
-        self.history_period_combobox = ctk.CTkComboBox(filter_frame, values=["Todos os Tempos", "Hoje", "Últimos 7 dias", "Mês Atual"],
-                                                       state="readonly", width=180, corner_radius=10)
+        self.history_period_combobox = ctk.CTkComboBox(filter_frame, values=["Todos os Tempos", "Hoje", "Últimos 7 dias", "Mês Atual", "Personalizado"],
+                                                       state="readonly", width=180, corner_radius=10, command=self.on_history_period_change)
         self.history_period_combobox.set("Todos os Tempos")
         self.history_period_combobox.grid(row=1, column=1, sticky="ew", padx=5, pady=(5,0))
 
@@ -797,6 +2866,19 @@ class PdvApp:
                                                        fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10)
         self.apply_history_filters_btn.grid(row=1, column=3, pady=(5,0))
 
+        # Período personalizado (datas inclusivas, habilitadas com "Personalizado")
+        ctk.CTkLabel(filter_frame, text="De:").grid(row=2, column=0, sticky="w", padx=5, pady=(5,0))
+        self.history_start_date_entry = ctk.CTkEntry(filter_frame, placeholder_text="AAAA-MM-DD", corner_radius=10)
+        self.history_start_date_entry.grid(row=2, column=1, sticky="ew", padx=5, pady=(5,0))
+        ctk.CTkLabel(filter_frame, text="Até:").grid(row=2, column=2, sticky="w", padx=5, pady=(5,0))
+        self.history_end_date_entry = ctk.CTkEntry(filter_frame, placeholder_text="AAAA-MM-DD", corner_radius=10)
+        self.history_end_date_entry.grid(row=2, column=3, sticky="ew", padx=5, pady=(5,0))
+        self.history_start_date_entry.configure(state="disabled")
+        self.history_end_date_entry.configure(state="disabled")
+
+        self.history_loading_label = ctk.CTkLabel(self.history_frame, text="", text_color="gray")
+        self.history_loading_label.grid(row=2, column=0, columnspan=2, sticky="w", padx=10)
+
 
         self.history_tree = ttk.Treeview(self.history_frame, columns=("ID Venda", "Data/Hora", "Total", "Desconto", "Cliente", "Pagamento", "Recebido", "Troco"), show="headings", style="Treeview") # Adicionadas colunas
         self.history_tree.heading("ID Venda", text="ID Venda")
@@ -816,9 +2898,26 @@ class PdvApp:
         self.history_tree.column("Recebido", width=80, anchor="e") # Coluna de recebido
         self.history_tree.column("Troco", width=80, anchor="e")    # Coluna de troco
         self.history_tree.grid(row=3, column=0, columnspan=2, sticky="nsew", padx=10, pady=10)
+        self.history_count_label = ctk.CTkLabel(self.history_frame, text="", text_color="gray")
+        self.history_count_label.grid(row=4, column=0, sticky="w", padx=10)
+        self.history_more_btn = ctk.CTkButton(self.history_frame, text="Carregar mais", width=140, state="disabled",
+                                              fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10)
+        self.history_more_btn.grid(row=4, column=1, sticky="e", padx=10)
+        self.history_tree_view = PagedTreeview(self.history_tree, self._format_history_row, self.history_count_label, "venda(s)",
+                                               more_button=self.history_more_btn)
+        self.history_more_btn.configure(command=self.history_tree_view.load_more)
+        return self.history_frame
 
+    def _build_returns_frame(self):
+        """
+        Constrói a tela de Devoluções/Trocas.
+        """
+        self.returns_frame = self._new_content_frame()
+        self.returns_frame.grid_columnconfigure(0, weight=1)
+        self.returns_frame.grid_columnconfigure(1, weight=1)
+        self.returns_frame.grid_rowconfigure(3, weight=1)
+        self.returns_frame.grid_rowconfigure(7, weight=1)
 
-        # --- Frame de Devoluções/Trocas ---
         ctk.CTkLabel(self.returns_frame, text="Módulo de Devoluções/Trocas", font=ctk.CTkFont(size=22, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, columnspan=2, pady=15)
 
         search_return_frame = ctk.CTkFrame(self.returns_frame, fg_color="transparent")
@@ -828,7 +2927,7 @@ class PdvApp:
         ctk.CTkLabel(search_return_frame, text="Buscar Venda (ID/Cliente):").grid(row=0, column=0, sticky="w", padx=5)
         self.return_sale_search_entry = ctk.CTkEntry(search_return_frame, placeholder_text="ID da Venda ou Nome do Cliente", corner_radius=10)
         self.return_sale_search_entry.grid(row=0, column=1, sticky="ew", padx=5)
-        self.return_sale_search_entry.bind("<KeyRelease>", self.load_sales_for_returns)
+        self.return_sale_search_entry.bind("<KeyRelease>", self.return_sale_search.schedule)
 
         ctk.CTkButton(search_return_frame, text="Buscar", command=self.load_sales_for_returns,
                       fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10).grid(row=0, column=2, padx=5)
@@ -845,6 +2944,7 @@ class PdvApp:
         self.return_sales_tree.column("Cliente", width=150)
         self.return_sales_tree.column("Pagamento", width=100) # Novo
         self.return_sales_tree.grid(row=2, column=0, columnspan=2, sticky="nsew", padx=10, pady=10)
+        self.return_sales_tree_binding = TreeviewBinding(self.return_sales_tree)
         self.return_sales_tree.bind("<<TreeviewSelect>>", self.on_return_sale_select)
 
 
@@ -879,11 +2979,24 @@ class PdvApp:
         self.process_return_btn = ctk.CTkButton(self.returns_frame, text="Processar Devolução", command=self.process_return,
                                                 fg_color="#F44336", hover_color="#D32F2F", corner_radius=10,
                                                 font=ctk.CTkFont(size=14, weight="bold"))
-        self.process_return_btn.grid(row=9, column=0, columnspan=2, pady=15)
+        self.process_return_btn.grid(row=9, column=0, pady=15)
         self.process_return_btn.configure(state="disabled")
 
+        self.return_whole_sale_btn = ctk.CTkButton(self.returns_frame, text="Devolver Venda Inteira", command=self.process_whole_sale_return,
+                                                   fg_color="#F44336", hover_color="#D32F2F", corner_radius=10,
+                                                   font=ctk.CTkFont(size=14, weight="bold"))
+        self.return_whole_sale_btn.grid(row=9, column=1, pady=15)
+        self.return_whole_sale_btn.configure(state="disabled")
+        return self.returns_frame
+
+    def _build_reports_frame(self):
+        """
+        Constrói a tela de Relatórios e Análises.
+        """
+        self.reports_frame = self._new_content_frame()
+        self.reports_frame.grid_columnconfigure(0, weight=1)
+        self.reports_frame.grid_rowconfigure(7, weight=1)
 
-        # --- Frame de Relatórios e Análises ---
         ctk.CTkLabel(self.reports_frame, text="Relatórios e Análises", font=ctk.CTkFont(size=22, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, columnspan=2, pady=15)
 
         ctk.CTkLabel(self.reports_frame, text="Filtrar por Período:").grid(row=1, column=0, sticky="w", padx=10, pady=5)
@@ -895,6 +3008,8 @@ class PdvApp:
         self.generate_reports_btn = ctk.CTkButton(self.reports_frame, text="Gerar Relatórios", command=self.load_reports,
                                                 fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10)
         self.generate_reports_btn.grid(row=2, column=0, columnspan=2, pady=10)
+        self.reports_loading_label = ctk.CTkLabel(self.reports_frame, text="", text_color="gray")
+        self.reports_loading_label.grid(row=2, column=1, sticky="e", padx=10)
 
         ctk.CTkLabel(self.reports_frame, text="Resumo de Fluxo de Caixa (Vendas)", font=ctk.CTkFont(size=18, weight="bold"), text_color=self.primary_green).grid(row=3, column=0, columnspan=2, pady=(20,10))
         self.cash_flow_total_label = ctk.CTkLabel(self.reports_frame, text="Total de Vendas no Período: R$ 0.00", font=ctk.CTkFont(size=16, weight="bold"))
@@ -929,9 +3044,17 @@ class PdvApp:
                                             fg_color="#F44336", hover_color="#D32F2F", corner_radius=10,
                                             font=ctk.CTkFont(size=14, weight="bold"))
         self.restore_db_btn.grid(row=7, column=1, padx=10, pady=20, sticky="ew") 
+        return self.reports_frame
 
+    def _build_user_management_frame(self):
+        """
+        Constrói a tela de Gerenciamento de Usuários.
+        """
+        self.user_management_frame = self._new_content_frame()
+        self.user_management_frame.grid_columnconfigure(0, weight=1)
+        self.user_management_frame.grid_columnconfigure(1, weight=1)
+        self.user_management_frame.grid_rowconfigure(7, weight=1)
 
-        # --- Frame de Gerenciamento de Usuários ---
         ctk.CTkLabel(self.user_management_frame, text="Gerenciar Usuários", font=ctk.CTkFont(size=22, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, columnspan=2, pady=15)
 
         ctk.CTkLabel(self.user_management_frame, text="Nome de Usuário:").grid(row=1, column=0, sticky="w", padx=10, pady=5)
@@ -971,14 +3094,6 @@ class PdvApp:
                                                     font=ctk.CTkFont(size=14, weight="bold"))
         self.change_my_password_btn.grid(row=6, column=1, pady=10)
 
-        user_style = ttk.Style()
-        user_style.theme_use("clam")
-        user_style.configure("UserTreeview.Heading", font=("Roboto", 11, "bold"), 
-                              background=self.primary_green,
-                              foreground=self.text_color_light, borderwidth=1, 
-                              bordercolor=self.primary_green)
-        user_style.layout("UserTreeview", [('Treeview.treearea', {'sticky': 'nswe'})])
-
         self.user_tree = ttk.Treeview(self.user_management_frame, columns=("ID", "Estabelecimento", "Usuário", "Função"), show="headings", style="UserTreeview")
         self.user_tree.heading("ID", text="ID")
         self.user_tree.heading("Estabelecimento", text="Estabelecimento")
@@ -989,16 +3104,24 @@ class PdvApp:
         self.user_tree.column("Usuário", width=150)
         self.user_tree.column("Função", width=100, anchor="center")
         self.user_tree.grid(row=7, column=0, columnspan=2, sticky="nsew", padx=10, pady=10)
+        self.user_tree_binding = TreeviewBinding(self.user_tree)
         self.user_tree.bind("<<TreeviewSelect>>", self.on_user_select)
-        
+        return self.user_management_frame
+
+    def _build_customers_frame(self):
+        """
+        Constrói a tela de Gerenciamento de Clientes.
+        """
+        self.customers_frame = self._new_content_frame()
+        self.customers_frame.grid_columnconfigure(1, weight=1)
+        self.customers_frame.grid_rowconfigure(7, weight=1)
 
-        # --- Frame de Gerenciamento de Clientes (NOVO) ---
         ctk.CTkLabel(self.customers_frame, text="Gerenciar Clientes", font=ctk.CTkFont(size=22, weight="bold"), text_color=self.primary_green).grid(row=0, column=0, columnspan=3, pady=15)
 
         ctk.CTkLabel(self.customers_frame, text="Buscar Cliente (ID/Nome/Telefone):").grid(row=1, column=0, sticky="w", padx=10, pady=5)
         self.customer_search_entry = ctk.CTkEntry(self.customers_frame, width=300, corner_radius=10, placeholder_text="Buscar por ID, Nome ou Telefone")
         self.customer_search_entry.grid(row=1, column=1, sticky="ew", padx=10, pady=5)
-        self.customer_search_entry.bind("<KeyRelease>", self.filter_customers_management)
+        self.customer_search_entry.bind("<KeyRelease>", self.customer_search.schedule)
 
         self.search_customer_btn = ctk.CTkButton(self.customers_frame, text="Buscar", command=self.filter_customers_management,
                                                 fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10)
@@ -1031,14 +3154,6 @@ class PdvApp:
                                                         font=ctk.CTkFont(size=14, weight="bold"))
         self.view_customer_history_btn.grid(row=5, column=2, padx=10, pady=15)
 
-        customer_style = ttk.Style()
-        customer_style.theme_use("clam")
-        customer_style.configure("CustomerTreeview.Heading", font=("Roboto", 11, "bold"), 
-                                background=self.primary_green,
-                                foreground=self.text_color_light, borderwidth=1, 
-                                bordercolor=self.primary_green)
-        customer_style.layout("CustomerTreeview", [('Treeview.treearea', {'sticky': 'nswe'})])
-
         self.customer_tree = ttk.Treeview(self.customers_frame, columns=("ID", "Nome", "Telefone", "Email"), show="headings", style="CustomerTreeview")
         self.customer_tree.heading("ID", text="ID")
         self.customer_tree.heading("Nome", text="Nome")
@@ -1049,15 +3164,11 @@ class PdvApp:
         self.customer_tree.column("Telefone", width=150)
         self.customer_tree.column("Email", width=200)
         self.customer_tree.grid(row=7, column=0, columnspan=3, sticky="nsew", padx=10, pady=10)
+        self.customer_count_label = ctk.CTkLabel(self.customers_frame, text="", text_color="gray")
+        self.customer_count_label.grid(row=8, column=0, columnspan=3, sticky="w", padx=10)
+        self.customer_tree_view = PagedTreeview(self.customer_tree, self._format_customer_row, self.customer_count_label, "cliente(s)")
         self.customer_tree.bind("<<TreeviewSelect>>", self.on_customer_select)
-
-
-        # Initial loading functions
-        self.load_products_to_treeview()
-        self.check_low_stock_status()
-        self.update_treeview_styles() 
-        self.update_payment_fields() # Garante que os campos de pagamento em dinheiro estejam corretos ao iniciar
-        self.update_customer_dropdown_in_sales() # Popula o combobox de clientes na tela de vendas
+        return self.customers_frame
 
     def change_theme(self):
         """
@@ -1078,7 +3189,8 @@ class PdvApp:
         # Update the background color of the product image label manually
         # This uses the theme manager to get the correct background color for CTkFrame.
         text_bg_color = ctk.ThemeManager.theme["CTkFrame"]["fg_color"][appearance_mode_index]
-        self.product_image_label.configure(fg_color=text_bg_color)
+        if "products" in self.frames:
+            self.product_image_label.configure(fg_color=text_bg_color)
 
 
     def update_treeview_styles(self):
@@ -1119,107 +3231,101 @@ class PdvApp:
                   foreground=[('selected', "white")])
         
 
-    def _apply_role_permissions(self):
+    def _apply_role_permissions(self, frame_name=None):
         """
-        Aplica as permissões baseadas na função do usuário logado.
+        Aplica as permissões baseadas na função do usuário logado: nos botões da
+        sidebar, ou nos widgets da tela `frame_name` assim que ela é construída.
         """
         is_admin = (self.user_role == 'admin')
 
-        # Gestão de Produtos
-        self.product_name_entry.configure(state="normal" if is_admin else "disabled")
-        self.product_price_entry.configure(state="normal" if is_admin else "disabled")
-        self.product_stock_entry.configure(state="normal" if is_admin else "disabled")
-        self.add_product_btn.configure(state="normal" if is_admin else "disabled")
-        self.delete_product_btn.configure(state="normal" if is_admin else "disabled")
-        self.show_low_stock_btn.configure(state="normal" if is_admin else "disabled")
-        self.select_image_btn.configure(state="normal" if is_admin else "disabled")
-
-        # Devoluções/Trocas e Relatórios - desabilita botões da sidebar para não-admins
-        self.returns_btn.configure(state="normal" if is_admin else "disabled")
-        self.reports_btn.configure(state="normal" if is_admin else "disabled")
-        self.user_management_btn.configure(state="normal" if is_admin else "disabled")
-        self.customer_management_btn.configure(state="normal" if is_admin else "disabled") # NOVO
-
-        # Gerenciamento de usuários
-        self.backup_db_btn.configure(state="normal" if is_admin else "disabled")
-        self.restore_db_btn.configure(state="normal" if is_admin else "disabled")
-
-        # Gerenciamento de Clientes (NOVO)
-        self.customer_name_entry_mgmt.configure(state="normal" if is_admin else "disabled")
-        self.customer_phone_entry_mgmt.configure(state="normal" if is_admin else "disabled")
-        self.customer_email_entry_mgmt.configure(state="normal" if is_admin else "disabled")
-        self.add_customer_btn.configure(state="normal" if is_admin else "disabled")
-        self.delete_customer_btn.configure(state="normal" if is_admin else "disabled")
-        self.view_customer_history_btn.configure(state="normal" if is_admin else "disabled")
+        if frame_name is None:
+            # Devoluções/Trocas e Relatórios - desabilita botões da sidebar para não-admins
+            self.returns_btn.configure(state="normal" if is_admin else "disabled")
+            self.reports_btn.configure(state="normal" if is_admin else "disabled")
+            self.user_management_btn.configure(state="normal" if is_admin else "disabled")
+            self.customer_management_btn.configure(state="normal" if is_admin else "disabled") # NOVO
+
+        elif frame_name == "products":
+            self.product_name_entry.configure(state="normal" if is_admin else "disabled")
+            self.product_price_entry.configure(state="normal" if is_admin else "disabled")
+            self.product_stock_entry.configure(state="normal" if is_admin else "disabled")
+            self.add_product_btn.configure(state="normal" if is_admin else "disabled")
+            self.delete_product_btn.configure(state="normal" if is_admin else "disabled")
+            self.show_low_stock_btn.configure(state="normal" if is_admin else "disabled")
+            self.select_image_btn.configure(state="normal" if is_admin else "disabled")
+
+        elif frame_name == "reports":
+            self.backup_db_btn.configure(state="normal" if is_admin else "disabled")
+            self.restore_db_btn.configure(state="normal" if is_admin else "disabled")
+
+        elif frame_name == "customers":
+            self.customer_name_entry_mgmt.configure(state="normal" if is_admin else "disabled")
+            self.customer_phone_entry_mgmt.configure(state="normal" if is_admin else "disabled")
+            self.customer_email_entry_mgmt.configure(state="normal" if is_admin else "disabled")
+            self.add_customer_btn.configure(state="normal" if is_admin else "disabled")
+            self.delete_customer_btn.configure(state="normal" if is_admin else "disabled")
+            self.view_customer_history_btn.configure(state="normal" if is_admin else "disabled")
 
 
     def show_frame(self, frame_name):
         """
         Esconde todos os frames de conteúdo e exibe apenas o frame selecionado.
         """
-        self.products_frame.grid_remove()
-        self.sales_frame.grid_remove()
-        self.history_frame.grid_remove()
-        self.returns_frame.grid_remove()
-        self.reports_frame.grid_remove()
-        self.user_management_frame.grid_remove() 
-        self.customers_frame.grid_remove() # NOVO
+        for frame in self.frames.values(): # Telas ainda não construídas não estão na grade
+            frame.grid_remove()
+        self.current_frame = frame_name
 
         if frame_name == "products":
-            self.products_frame.grid()
-            self.load_products_to_treeview()
+            self._ensure_frame("products").grid()
             self.product_name_entry.delete(0, ctk.END)
             self.product_price_entry.delete(0, ctk.END)
             self.product_stock_entry.delete(0, ctk.END)
+            self.product_barcodes_entry.delete(0, ctk.END)
             self.editing_product_id = None
-            self.product_search_entry.delete(0, ctk.END)
-            self.check_low_stock_status()
+            if self._clear_search_entry(self.product_search_entry) or self._take_stale("products"):
+                self.load_products_to_treeview() # Também atualiza o alerta de estoque baixo
             self.display_product_image_on_load(None) # Clear image display
         elif frame_name == "sales":
-            self.sales_frame.grid()
-            self.load_products_for_sale()
-            self.update_cart_display()
+            self._ensure_frame("sales").grid()
+            if self._clear_search_entry(self.sales_product_search_entry_list) or self._take_stale("sales_products"):
+                self.load_products_for_sale()
             self.selected_product_for_sale = None 
             self.selected_product_display.configure(text="")
             self.sales_quantity_entry.delete(0, ctk.END)
             self.sales_quantity_entry.insert(0, "1") # Preenche com 1 para agilizar o barcode
-            self.customer_sales_combobox.set("-- Selecione um Cliente (Opcional) --") # NOVO
+            self.reset_customer_picker_in_sales()
             self.customer_name_entry.delete(0, ctk.END) # Este é o nome avulso agora
             self.payment_method_combobox.set("Dinheiro")
-            self.sales_product_search_entry_list.delete(0, ctk.END)
             self.cart_quantity_entry.delete(0, ctk.END)
             self.selected_cart_item_id = None
             self.discount_entry.delete(0, ctk.END)
             self.discount_type_combobox.set("Porcentagem")
-            self.current_discount_value = 0.0
-            self.current_discount_type = "Porcentagem"
+            self.cart.set_discount(0.0, "Porcentagem")
+            self.update_cart_display()
             self.received_amount_entry.delete(0, ctk.END)
             self.change_label.configure(text="R$ 0.00")
             self.update_payment_fields() # Ensure cash payment fields are visible if 'Dinheiro' is selected
-            self.update_customer_dropdown_in_sales() # NOVO: Recarrega clientes
             self.selected_customer_id = None # Reseta o cliente selecionado para venda
         elif frame_name == "history":
-            self.history_frame.grid()
-            self.load_sales_history() # Chama sem filtros inicialmente
+            self._ensure_frame("history").grid()
+            if self._take_stale("history"):
+                self.load_sales_history()
         elif frame_name == "returns":
             if self.user_role == 'admin':
-                self.returns_frame.grid()
-                self.load_sales_for_returns()
+                self._ensure_frame("returns").grid()
+                if self._take_stale("returns"):
+                    self.load_sales_for_returns()
                 self.return_sale_details_label.configure(text="Nenhuma venda selecionada.")
-                for item in self.return_items_tree.get_children():
-                    self.return_items_tree.delete(item)
-                self.return_quantity_entry.delete(0, ctk.END)
-                self.return_reason_entry.delete(0, ctk.END)
-                self.process_return_btn.configure(state="disabled")
                 self.selected_return_sale_id = None
-                self.selected_return_item_id = None
+                self._reset_return_form()
             else:
                 messagebox.showwarning("Acesso Negado", "Você não tem permissão para acessar o módulo de Devoluções/Trocas.")
                 self.show_frame("sales")
         elif frame_name == "reports":
             if self.user_role == 'admin':
-                self.reports_frame.grid()
-                self.load_reports()
+                self._ensure_frame("reports").grid()
+                if self._take_stale("reports"):
+                    self.load_reports()
                 self.backup_db_btn.configure(state="normal" if self.user_role == 'admin' else "disabled")
                 self.restore_db_btn.configure(state="normal" if self.user_role == 'admin' else "disabled")
             else:
@@ -1227,7 +3333,7 @@ class PdvApp:
                 self.show_frame("sales")
         elif frame_name == "user_management":
             if self.user_role == 'admin':
-                self.user_management_frame.grid()
+                self._ensure_frame("user_management").grid()
                 self.load_users_to_treeview()
                 self.user_username_entry.delete(0, ctk.END)
                 self.user_password_entry.delete(0, ctk.END)
@@ -1241,23 +3347,90 @@ class PdvApp:
                 self.show_frame("sales")
         elif frame_name == "customers": # NOVO: exibir frame de clientes
             if self.user_role == 'admin':
-                self.customers_frame.grid()
-                self.load_customers_to_treeview()
+                self._ensure_frame("customers").grid()
                 self.customer_name_entry_mgmt.delete(0, ctk.END)
                 self.customer_phone_entry_mgmt.delete(0, ctk.END)
                 self.customer_email_entry_mgmt.delete(0, ctk.END)
                 self.selected_customer_id = None # Reseta o ID do cliente selecionado para gestão
-                self.customer_search_entry.delete(0, ctk.END)
+                if self._clear_search_entry(self.customer_search_entry) or self._take_stale("customers"):
+                    self.load_customers_to_treeview()
                 self.view_customer_history_btn.configure(state="disabled")
             else:
                 messagebox.showwarning("Acesso Negado", "Você não tem permissão para acessar o gerenciamento de clientes.")
                 self.show_frame("sales")
 
+    def _clear_search_entry(self, entry):
+        """
+        Limpa o campo de busca. Retorna True se havia um termo, caso em que a lista
+        exibida estava filtrada e precisa ser recarregada.
+        """
+        if not entry.get():
+            return False
+        entry.delete(0, ctk.END)
+        return True
+
+    def _take_stale(self, view):
+        """
+        Retorna True (e limpa a marca) se a lista `view` ficou desatualizada
+        enquanto sua tela estava oculta.
+        """
+        if view in self.stale_views:
+            self.stale_views.discard(view)
+            return True
+        return False
+
+    def _refresh_view(self, frame_name, view, refresh):
+        """
+        Executa `refresh` se a tela `frame_name` estiver visível; caso contrário,
+        marca a lista `view` para ser recarregada quando a tela for exibida.
+        """
+        if self.current_frame == frame_name:
+            refresh()
+        else:
+            self.stale_views.add(view)
+
+    def _on_products_changed(self, product_ids=None):
+        """
+        Tópico "products". `product_ids` lista os produtos que mudaram apenas de
+        valores (ex.: estoque após venda ou devolução), cujas linhas são atualizadas
+        no lugar; None indica mudança no catálogo (inclusão, edição ou exclusão),
+        que exige recarregar as listas.
+        """
+        self.product_management_search.invalidate()
+        self.sales_product_search.invalidate()
+        if product_ids is None:
+            self._refresh_view("products", "products", self.load_products_to_treeview)
+            self._refresh_view("sales", "sales_products", self.load_products_for_sale)
+        else:
+            self._refresh_view("products", "products", lambda: self._patch_products_management(product_ids))
+            self._refresh_view("sales", "sales_products", lambda: self._patch_products_for_sale(product_ids))
+
+    def _on_sales_changed(self, sale_id=None):
+        """
+        Tópico "sales": nova venda ou devolução registrada.
+        """
+        self._refresh_view("history", "history", self.load_sales_history)
+        self._refresh_view("returns", "returns", self.load_sales_for_returns)
+        self._refresh_view("reports", "reports", self.load_reports)
+
+    def _on_customers_changed(self):
+        """
+        Tópico "customers": cliente incluído, alterado ou excluído.
+        """
+        self._refresh_view("customers", "customers", self.load_customers_to_treeview)
+        self.customer_sales_search.invalidate()
+
+    def _fetch_products(self, product_ids, columns):
+        product_ids = list(product_ids)
+        placeholders = ", ".join("?" * len(product_ids))
+        return self.db.fetchall(f"SELECT {', '.join(columns)} FROM products WHERE id IN ({placeholders})", product_ids)
+
 
     def select_product_image(self):
         """
         Permite ao usuário selecionar um arquivo de imagem e exibe uma prévia.
-        A imagem é copiada para o diretório de imagens do produto.
+        A imagem é copiada para o armazenamento de imagens (import_product_image);
+        arquivos que acabarem sem produto são removidos pelo coletor de órfãs.
         """
         file_path = filedialog.askopenfilename(
             title="Selecionar Imagem do Produto",
@@ -1265,18 +3438,11 @@ class PdvApp:
         )
         if file_path:
             try:
-                # Gerar um nome de arquivo único para evitar colisões
-                file_extension = os.path.splitext(file_path)[1]
-                new_file_name = f"product_{datetime.now().strftime('%Y%m%d%H%M%S%f')}{file_extension}"
-                destination_path = os.path.join(self.product_images_dir, new_file_name)
-
-                shutil.copyfile(file_path, destination_path)
+                # Imagens idênticas são compartilhadas; a miniatura é gerada uma única vez
+                destination_path = import_product_image(file_path, self.product_images_dir)
                 self.current_product_image_path = destination_path # Armazena o caminho relativo
 
-                # Exibir prévia da imagem
-                original_image = Image.open(file_path)
-                resized_image = original_image.resize((120, 120), Image.Resampling.LANCZOS)
-                self.product_photo_image = ImageTk.PhotoImage(resized_image)
+                self.product_photo_image = self.thumbnail_cache.get(destination_path)
                 self.product_image_label.configure(image=self.product_photo_image, text="")
                 messagebox.showinfo("Sucesso", "Imagem selecionada e copiada com sucesso!")
 
@@ -1291,13 +3457,12 @@ class PdvApp:
 
     def display_product_image_on_load(self, image_path):
         """
-        Carrega e exibe a imagem do produto no label de prévia.
+        Exibe a miniatura da imagem do produto no label de prévia (via ThumbnailCache,
+        sem decodificar o original a cada seleção).
         """
         if image_path and os.path.exists(image_path):
             try:
-                original_image = Image.open(image_path)
-                resized_image = original_image.resize((120, 120), Image.Resampling.LANCZOS)
-                self.product_photo_image = ImageTk.PhotoImage(resized_image)
+                self.product_photo_image = self.thumbnail_cache.get(image_path)
                 self.product_image_label.configure(image=self.product_photo_image, text="")
             except Exception as e:
                 self.product_image_label.configure(image=None, text="Erro ao carregar imagem")
@@ -1319,40 +3484,51 @@ class PdvApp:
         price_str = self.product_price_entry.get().strip()
         stock_str = self.product_stock_entry.get().strip()
         image_path_to_save = self.current_product_image_path # Pega o caminho da imagem
+        barcodes = parse_barcodes(self.product_barcodes_entry.get())
 
         if not name or not price_str or not stock_str:
             messagebox.showerror("Erro", "Todos os campos devem ser preenchidos.")
             return
 
         try:
-            price = float(price_str.replace(',', '.'))
+            price_cents = parse_money(price_str)
             stock = int(stock_str)
-            if price <= 0 or stock < 0:
+            if price_cents <= 0 or stock < 0:
                 raise ValueError("Preço deve ser positivo e estoque não negativo.")
         except ValueError:
             messagebox.showerror("Erro", "Preço e Estoque devem ser números válidos.")
             return
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        if barcodes:
+            placeholders = ", ".join("?" for _ in barcodes)
+            conflict = self.db.fetchone(f"SELECT b.code, p.name FROM product_barcodes b JOIN products p ON p.id = b.product_id WHERE b.code IN ({placeholders}) AND b.product_id != ?",
+                                        (*barcodes, self.editing_product_id or 0))
+            if conflict:
+                messagebox.showerror("Erro", f"O código de barras '{conflict[0]}' já está cadastrado para o produto '{conflict[1]}'.")
+                return
 
         try:
-            if self.editing_product_id:
-                product_id = self.editing_product_id
-                cursor.execute("UPDATE products SET name=?, price=?, stock=?, image_path=? WHERE id=?", (name, price, stock, image_path_to_save, product_id))
-                messagebox.showinfo("Sucesso", f"Produto '{name}' atualizado com sucesso!")
-                self.editing_product_id = None
-            else:
-                cursor.execute("INSERT INTO products (name, price, stock, image_path) VALUES (?, ?, ?, ?)", (name, price, stock, image_path_to_save))
-                messagebox.showinfo("Sucesso", f"Produto '{name}' adicionado com sucesso!")
-            
-            conn.commit()
-            self.load_products_to_treeview()
-            self.check_low_stock_status()
+            with self.db.transaction() as cursor:
+                if self.editing_product_id:
+                    product_id = self.editing_product_id
+                    cursor.execute("UPDATE products SET name=?, price_cents=?, stock=?, image_path=? WHERE id=?", (name, price_cents, stock, image_path_to_save, product_id))
+                    cursor.execute("DELETE FROM product_barcodes WHERE product_id=?", (product_id,))
+                    success_message = f"Produto '{name}' atualizado com sucesso!"
+                else:
+                    cursor.execute("INSERT INTO products (name, price_cents, stock, image_path) VALUES (?, ?, ?, ?)", (name, price_cents, stock, image_path_to_save))
+                    product_id = cursor.lastrowid
+                    success_message = f"Produto '{name}' adicionado com sucesso!"
+                cursor.executemany("INSERT INTO product_barcodes (code, product_id) VALUES (?, ?)",
+                                   [(code, product_id) for code in barcodes])
+
+            messagebox.showinfo("Sucesso", success_message)
+            self.editing_product_id = None
+            self.events.publish("products")
             # Limpa os campos de entrada e a imagem
             self.product_name_entry.delete(0, ctk.END)
             self.product_price_entry.delete(0, ctk.END)
             self.product_stock_entry.delete(0, ctk.END)
+            self.product_barcodes_entry.delete(0, ctk.END)
             self.product_tree.selection_remove(self.product_tree.focus())
             self.display_product_image_on_load(None) # Limpa a prévia da imagem
             self.current_product_image_path = None
@@ -1362,8 +3538,6 @@ class PdvApp:
         except Exception as e:
             messagebox.showerror("Erro", f"Ocorreu um erro: {e}")
             print(f"Erro detalhado ao adicionar/atualizar produto: {e}")
-        finally:
-            conn.close()
 
     def delete_product(self):
         """
@@ -1382,43 +3556,32 @@ class PdvApp:
         product_name = self.product_tree.item(selected_item, 'values')[1]
         
         # Pega o caminho da imagem para excluí-la se o produto for removido
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT image_path FROM products WHERE id=?", (product_id,))
-        image_path_to_delete = cursor.fetchone()[0]
-        conn.close()
+        image_path_to_delete = self.db.fetchvalue("SELECT image_path FROM products WHERE id=?", (product_id,))
 
         if messagebox.askyesno("Confirmar Exclusão", f"Tem certeza que deseja excluir o produto '{product_name}' (ID: {product_id})? Esta ação é irreversível."):
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.executescript("PRAGMA foreign_keys = ON;") # Garante que FKs estejam ativas para ON DELETE CASCADE
             try:
-                cursor.execute("SELECT COUNT(*) FROM sale_items WHERE product_id=?", (product_id,))
-                sales_count = cursor.fetchone()[0]
-                cursor.execute("SELECT COUNT(*) FROM returns WHERE product_id=?", (product_id,))
-                returns_count = cursor.fetchone()[0]
+                sales_count = self.db.fetchvalue("SELECT COUNT(*) FROM sale_items WHERE product_id=?", (product_id,))
+                returns_count = self.db.fetchvalue("SELECT COUNT(*) FROM returns WHERE product_id=?", (product_id,))
 
                 if sales_count > 0 or returns_count > 0:
                     messagebox.showerror("Erro", "Não é possível excluir este produto. Ele está associado a vendas ou devoluções existentes.")
                     return
 
-                cursor.execute("DELETE FROM products WHERE id=?", (product_id,))
-                conn.commit()
+                with self.db.transaction() as cursor:
+                    cursor.execute("DELETE FROM products WHERE id=?", (product_id,))
                 
-                # Tenta excluir o arquivo de imagem associado
-                if image_path_to_delete and os.path.exists(image_path_to_delete):
-                    try:
-                        os.remove(image_path_to_delete)
-                        print(f"Imagem {image_path_to_delete} excluída.")
-                    except Exception as img_e:
-                        print(f"Aviso: Não foi possível excluir o arquivo de imagem {image_path_to_delete}: {img_e}")
+                # A imagem pode ser compartilhada com outros produtos; se ficou sem
+                # referências, o coletor de órfãs a remove (collect_orphan_images)
+                if image_path_to_delete and image_reference_count(self.db, image_path_to_delete) == 0:
+                    self.thumbnail_cache.discard(image_path_to_delete)
 
 
                 messagebox.showinfo("Sucesso", f"Produto '{product_name}' excluído com sucesso!")
-                self.load_products_to_treeview()
-                self.check_low_stock_status()
+                self.events.publish("products")
                 self.product_name_entry.delete(0, ctk.END)
                 self.product_price_entry.delete(0, ctk.END)
                 self.product_stock_entry.delete(0, ctk.END)
+                self.product_barcodes_entry.delete(0, ctk.END)
                 self.editing_product_id = None
                 self.display_product_image_on_load(None) # Limpa a prévia da imagem
                 self.current_product_image_path = None
@@ -1426,8 +3589,6 @@ class PdvApp:
             except Exception as e:
                 messagebox.showerror("Erro", f"Ocorreu um erro ao excluir o produto: {e}")
                 print(f"Erro detalhado ao excluir produto: {e}")
-            finally:
-                conn.close()
 
     def on_product_select_for_management(self, event):
         """
@@ -1440,17 +3601,16 @@ class PdvApp:
             self.editing_product_id = int(values[0])
             self.product_name_entry.delete(0, ctk.END)
             self.product_name_entry.insert(0, values[1])
+            price_cents, image_path = self.db.fetchone("SELECT price_cents, image_path FROM products WHERE id=?", (self.editing_product_id,))
             self.product_price_entry.delete(0, ctk.END)
-            self.product_price_entry.insert(0, values[2].replace('R$ ', '').replace('.', ','))
+            self.product_price_entry.insert(0, format_money(price_cents, prefix="").replace('.', ','))
             self.product_stock_entry.delete(0, ctk.END)
             self.product_stock_entry.insert(0, values[3])
+            self.product_barcodes_entry.delete(0, ctk.END)
+            barcodes = self.db.fetchall("SELECT code FROM product_barcodes WHERE product_id=? ORDER BY code", (self.editing_product_id,))
+            self.product_barcodes_entry.insert(0, ", ".join(row[0] for row in barcodes))
 
-            # Carrega o caminho da imagem e exibe
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            cursor.execute("SELECT image_path FROM products WHERE id=?", (self.editing_product_id,))
-            image_path = cursor.fetchone()[0]
-            conn.close()
+            # Exibe a imagem do produto
             self.display_product_image_on_load(image_path)
 
         else:
@@ -1458,6 +3618,7 @@ class PdvApp:
             self.product_name_entry.delete(0, ctk.END)
             self.product_price_entry.delete(0, ctk.END)
             self.product_stock_entry.delete(0, ctk.END)
+            self.product_barcodes_entry.delete(0, ctk.END)
             self.display_product_image_on_load(None) # Limpa a prévia da imagem
             self.current_product_image_path = None
 
@@ -1466,26 +3627,34 @@ class PdvApp:
         """
         Filtra os produtos na Treeview de gerenciamento com base no termo de busca.
         """
-        search_term = self.product_search_entry.get().strip().lower()
-        
-        for item in self.product_tree.get_children():
-            self.product_tree.delete(item)
+        self.product_management_search.run_now()
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def _query_products_management(self, search_term):
+        """
+        Retorna a lista (limitada) de resultados da busca ou, sem termo de busca, um
+        KeysetPager sobre todo o catálogo, exibido por páginas.
+        """
         # A query agora seleciona image_path também, mas não é exibido no Treeview diretamente
         if search_term:
-            cursor.execute("SELECT id, name, price, stock, image_path FROM products WHERE LOWER(name) LIKE ? OR CAST(id AS TEXT) LIKE ? ORDER BY name",
-                           (f"%{search_term}%", f"%{search_term}%"))
+            return search_products(self.db, search_term, columns=("id", "name", "price_cents", "stock", "image_path"))
+        return KeysetPager(self.db, "SELECT id, name, price_cents, stock, image_path FROM products WHERE 1=1", (),
+                           order_by=("name", "id"), key_indexes=(1, 0))
+
+    def _render_products_management(self, products):
+        if isinstance(products, KeysetPager):
+            self.product_tree_view.show_pager(products)
         else:
-            cursor.execute("SELECT id, name, price, stock, image_path FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
+            self.product_tree_view.show_rows(products)
 
-        for product in products:
-            # Não exibe a imagem no treeview, mas o image_path está disponível se precisar
-            self.product_tree.insert("", ctk.END, values=(product[0], product[1], f"R$ {product[2]:.2f}", product[3]))
-        
+        self.check_low_stock_status()
+
+    def _format_product_row(self, product):
+        # Não exibe a imagem no treeview, mas o image_path está disponível se precisar
+        return (product[0], product[1], format_money(product[2]), product[3])
+
+    def _patch_products_management(self, product_ids):
+        rows = self._fetch_products(product_ids, ("id", "name", "price_cents", "stock", "image_path"))
+        self.product_tree_view.patch_rows(rows)
         self.check_low_stock_status()
 
     def filter_low_stock_products(self):
@@ -1496,35 +3665,24 @@ class PdvApp:
             messagebox.showwarning("Permissão Negada", "Você não tem permissão para visualizar produtos com estoque baixo.")
             return
 
-        for item in self.product_tree.get_children():
-            self.product_tree.delete(item)
-
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, price, stock, image_path FROM products WHERE stock <= ? ORDER BY name", (self.MINIMUM_STOCK_THRESHOLD,))
-        low_stock_products = cursor.fetchall()
-        conn.close()
+        low_stock_products = self.db.fetchall("SELECT id, name, price_cents, stock, image_path FROM products WHERE stock <= ? ORDER BY name", (self.MINIMUM_STOCK_THRESHOLD,))
 
         if not low_stock_products:
             messagebox.showinfo("Estoque Baixo", "Nenhum produto com estoque abaixo do limite definido.")
             self.load_products_to_treeview()
             return
 
-        for product in low_stock_products:
-            self.product_tree.insert("", ctk.END, values=(product[0], product[1], f"R$ {product[2]:.2f}", product[3]))
-        
+        self.product_tree_view.show_rows(low_stock_products)
+
         self.low_stock_alert_label.configure(text=f"ATENÇÃO: {len(low_stock_products)} produto(s) com estoque baixo!", text_color="#FF4500")
+        self.stale_views.add("products") # Volta à lista completa ao reabrir a tela
 
 
     def check_low_stock_status(self):
         """
         Verifica o estoque e atualiza a label de alerta na aba de produtos.
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM products WHERE stock <= ?", (self.MINIMUM_STOCK_THRESHOLD,))
-        low_stock_count = cursor.fetchone()[0]
-        conn.close()
+        low_stock_count = self.db.fetchvalue("SELECT COUNT(*) FROM products WHERE stock <= ?", (self.MINIMUM_STOCK_THRESHOLD,))
 
         if low_stock_count > 0:
             self.low_stock_alert_label.configure(text=f"ATENÇÃO: {low_stock_count} produto(s) com estoque baixo!", text_color="#FF4500")
@@ -1549,47 +3707,58 @@ class PdvApp:
         """
         Filtra os produtos na Treeview de vendas com base no termo de busca.
         """
-        search_term = self.sales_product_search_entry_list.get().strip().lower()
-        
-        for item in self.product_selection_tree.get_children():
-            self.product_selection_tree.delete(item)
+        self.sales_product_search.run_now()
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def _query_products_for_sale(self, search_term):
         if search_term:
-            cursor.execute("SELECT id, name, price, stock FROM products WHERE LOWER(name) LIKE ? OR CAST(id AS TEXT) LIKE ? ORDER BY name",
-                           (f"%{search_term}%", f"%{search_term}%"))
-        else:
-            cursor.execute("SELECT id, name, price, stock FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
+            return search_products(self.db, search_term)
+        return self.db.fetchall("SELECT id, name, price_cents, stock FROM products ORDER BY name")
+
+    def _render_products_for_sale(self, products):
+        self.product_selection_tree_binding.refresh(self._format_product_row(product) for product in products)
 
-        for product in products:
-            self.product_selection_tree.insert("", ctk.END, values=(product[0], product[1], f"R$ {product[2]:.2f}", product[3]))
+    def _patch_products_for_sale(self, product_ids):
+        rows = self._fetch_products(product_ids, ("id", "name", "price_cents", "stock"))
+        self.product_selection_tree_binding.update_rows(self._format_product_row(product) for product in rows)
 
     def handle_sales_product_search_entry(self, event=None):
         """
-        Gerencia a entrada no campo de busca de vendas.
-        Se Enter for pressionado e o texto for um ID numérico, tenta adicionar o produto ao carrinho.
-        Caso contrário (ou KeyRelease), filtra a lista de produtos.
+        Filtra a lista de produtos da tela de vendas conforme o texto digitado.
+        O Enter que encerra uma leitura do código de barras é tratado por handle_sales_scan.
         """
-        entry_text = self.sales_product_search_entry_list.get().strip()
+        if event and event.keysym in ("Return", "KP_Enter"):
+            return
+        self.sales_product_search.schedule()
 
-        if event and event.keysym == "Return":
-            try:
-                product_id = int(entry_text)
-                quantity = int(self.sales_quantity_entry.get().strip() or "1") # Usa 1 se o campo de quantidade estiver vazio
-                self.add_product_to_cart(product_id=product_id, quantity_to_add=quantity)
-                self.sales_product_search_entry_list.delete(0, ctk.END) # Limpa o campo após adicionar
-                self.sales_quantity_entry.delete(0, ctk.END)
-                self.sales_quantity_entry.insert(0, "1") # Reseta para 1
-            except ValueError:
-                messagebox.showwarning("Formato Inválido", "Por favor, insira um ID de produto numérico válido para adicionar rapidamente, ou use o botão 'Adicionar ao Carrinho'.")
-            finally:
-                self.filter_products_for_sale() # Sempre filtra para manter a lista atualizada
-        else:
-            self.filter_products_for_sale()
+    def handle_sales_scan(self, event=None):
+        """
+        Adiciona ao carrinho o produto lido pelo leitor de código de barras (ou cujo ID
+        foi digitado) com uma única busca indexada, sem recarregar a lista de produtos.
+        """
+        self.sales_product_search.cancel() # A leitura não deve disparar a busca pelos dígitos do código
+        code = self.sales_product_search_entry_list.get().strip()
+        if not code:
+            return "break"
+
+        try:
+            quantity = int(self.sales_quantity_entry.get().strip() or "1") # Usa 1 se o campo de quantidade estiver vazio
+            if quantity <= 0:
+                raise ValueError("Quantidade deve ser um número positivo.")
+        except ValueError:
+            messagebox.showerror("Erro", "Por favor, insira uma quantidade válida.")
+            return "break"
 
+        product = find_product_by_code(self.db, code)
+        if not product:
+            messagebox.showwarning("Produto Não Encontrado", f"Nenhum produto com o código de barras ou ID '{code}'.")
+            return "break"
+
+        product_id, product_name, price_cents, available_stock = product
+        if self._put_in_cart(product_id, product_name, price_cents, available_stock, quantity):
+            self.sales_product_search_entry_list.delete(0, ctk.END) # Limpa o campo para a próxima leitura
+            self.sales_quantity_entry.delete(0, ctk.END)
+            self.sales_quantity_entry.insert(0, "1") # Reseta para 1
+        return "break"
 
     def on_product_select_for_sale(self, event):
         """
@@ -1601,14 +3770,12 @@ class PdvApp:
             values = self.product_selection_tree.item(selected_item, 'values')
             product_id = int(values[0])
             product_name = values[1]
-            product_price_str = values[2].replace('R$ ', '').replace(',', '.')
-            product_price = float(product_price_str)
             product_stock = int(values[3])
 
+            # O preço é lido do banco ao adicionar ao carrinho (add_product_to_cart)
             self.selected_product_for_sale = {
                 'id': product_id,
                 'name': product_name,
-                'price': product_price,
                 'stock': product_stock
             }
             self.selected_product_display.configure(text=f"{product_name} (Estoque: {product_stock})")
@@ -1670,11 +3837,7 @@ class PdvApp:
 
         product_id = self.selected_cart_item_id
         
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT stock, name FROM products WHERE id=?", (product_id,))
-        product_info = cursor.fetchone()
-        conn.close()
+        product_info = self.db.fetchone("SELECT stock, name FROM products WHERE id=?", (product_id,))
 
         if not product_info:
             messagebox.showerror("Erro", "Produto não encontrado no estoque.")
@@ -1683,20 +3846,19 @@ class PdvApp:
         available_stock = product_info[0]
         product_name = product_info[1]
 
-        current_quantity_in_cart = self.current_cart[product_id]['quantity']
+        current_quantity_in_cart = self.cart.quantity(product_id)
         effective_stock = available_stock + current_quantity_in_cart
 
         if new_quantity > effective_stock:
             messagebox.showwarning("Estoque Insuficiente", f"Não há estoque suficiente para a nova quantidade de '{product_name}' ({new_quantity}). Estoque disponível: {available_stock}. Você já tem {current_quantity_in_cart} no carrinho.") 
             return
 
-        self.current_cart[product_id]['quantity'] = new_quantity
-        self.update_cart_display()
+        self.cart.set_quantity(product_id, new_quantity)
+        self._refresh_cart_line(product_id)
         messagebox.showinfo("Sucesso", f"Quantidade de '{product_name}' atualizada para {new_quantity} no carrinho.")
         self.cart_quantity_entry.delete(0, ctk.END)
         self.cart_tree.selection_remove(self.cart_tree.focus())
         self.selected_cart_item_id = None
-        self.calculate_change() # Recalcula o troco se o carrinho mudar
 
     def remove_item_from_cart(self): # Adicionada esta função que estava faltando
         """
@@ -1707,16 +3869,15 @@ class PdvApp:
             return
 
         product_id = self.selected_cart_item_id
-        product_name = self.current_cart[product_id]['name']
+        product_name = self.cart.items[product_id]['name']
 
         if messagebox.askyesno("Remover Item", f"Tem certeza que deseja remover '{product_name}' do carrinho?"):
-            del self.current_cart[product_id]
-            self.update_cart_display()
+            self.cart.remove(product_id)
+            self._refresh_cart_line(product_id)
             messagebox.showinfo("Sucesso", f"'{product_name}' removido do carrinho.")
             self.cart_quantity_entry.delete(0, ctk.END)
             self.cart_tree.selection_remove(self.cart_tree.focus())
             self.selected_cart_item_id = None
-            self.calculate_change() # Recalcula o troco se o carrinho mudar
 
 
     def add_product_to_cart(self, product_id=None, quantity_to_add=None):
@@ -1738,35 +3899,16 @@ class PdvApp:
                 messagebox.showerror("Erro", "Por favor, insira uma quantidade válida.")
                 return
         
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, price, stock FROM products WHERE id=?", (product_id,))
-        product_info = cursor.fetchone()
-        conn.close()
+        product_info = self.db.fetchone("SELECT name, price_cents, stock FROM products WHERE id=?", (product_id,))
 
         if not product_info:
             messagebox.showerror("Erro", f"Produto com ID {product_id} não encontrado.")
             return
 
-        product_name, product_price, available_stock = product_info
+        product_name, price_cents, available_stock = product_info
+        if not self._put_in_cart(product_id, product_name, price_cents, available_stock, quantity_to_add):
+            return
 
-        if product_id in self.current_cart:
-            current_cart_quantity = self.current_cart[product_id]['quantity']
-            if (current_cart_quantity + quantity_to_add) > available_stock:
-                messagebox.showwarning("Estoque Insuficiente", f"Não há estoque suficiente para adicionar mais {quantity_to_add} unidades de '{product_name}'. Disponível em estoque: {available_stock}. Já no carrinho: {current_cart_quantity}")
-                return
-            self.current_cart[product_id]['quantity'] += quantity_to_add
-        else:
-            if quantity_to_add > available_stock:
-                messagebox.showwarning("Estoque Insuficiente", f"Não há estoque suficiente para adicionar {quantity_to_add} unidades de '{product_name}'. Disponível: {available_stock}")
-                return
-            self.current_cart[product_id] = {
-                'name': product_name,
-                'price': product_price,
-                'quantity': quantity_to_add
-            }
-        
-        self.update_cart_display()
         self.sales_quantity_entry.delete(0, ctk.END) 
         self.sales_quantity_entry.insert(0, "1") # Reseta para 1 após adicionar
 
@@ -1776,8 +3918,26 @@ class PdvApp:
         self.selected_product_for_sale = None
         self.selected_product_display.configure(text="")
         self.product_selection_tree.selection_remove(self.product_selection_tree.focus())
-        self.load_products_for_sale()
-        self.calculate_change() # Recalcula o troco se o carrinho mudar
+
+    def _put_in_cart(self, product_id, product_name, price_cents, available_stock, quantity_to_add):
+        """
+        Soma `quantity_to_add` unidades do produto ao carrinho, respeitando o estoque.
+
+        Returns:
+            bool: False (após avisar o usuário) se o estoque não for suficiente.
+        """
+        if product_id in self.cart:
+            current_cart_quantity = self.cart.quantity(product_id)
+            if (current_cart_quantity + quantity_to_add) > available_stock:
+                messagebox.showwarning("Estoque Insuficiente", f"Não há estoque suficiente para adicionar mais {quantity_to_add} unidades de '{product_name}'. Disponível em estoque: {available_stock}. Já no carrinho: {current_cart_quantity}")
+                return False
+        elif quantity_to_add > available_stock:
+            messagebox.showwarning("Estoque Insuficiente", f"Não há estoque suficiente para adicionar {quantity_to_add} unidades de '{product_name}'. Disponível: {available_stock}")
+            return False
+
+        self.cart.add(product_id, product_name, price_cents, quantity_to_add)
+        self._refresh_cart_line(product_id)
+        return True
 
     def flash_button(self, button_widget, original_fg, flash_fg, original_hover, flash_hover, duration_ms=200):
         """
@@ -1795,15 +3955,13 @@ class PdvApp:
         discount_type = self.discount_type_combobox.get()
 
         if not discount_str:
-            self.current_discount_value = 0.0
-            self.current_discount_type = "Nenhum"
-            self.update_cart_display()
-            self.calculate_change() # Recalcula o troco
+            self.cart.set_discount(0.0, "Nenhum")
+            self._update_cart_totals()
             messagebox.showinfo("Desconto Removido", "Desconto removido do total da venda.")
             return
 
         try:
-            discount_val = float(discount_str.replace(',', '.'))
+            discount_val = to_decimal(discount_str.replace(',', '.')) # Recusa também "nan" e "inf"
             if discount_val < 0:
                 raise ValueError("O valor do desconto não pode ser negativo.")
         except ValueError:
@@ -1812,12 +3970,10 @@ class PdvApp:
 
         if discount_type == "Porcentagem" and discount_val > 100:
             messagebox.showwarning("Aviso", "Desconto em porcentagem não pode ser maior que 100%. Será aplicado 100% no máximo.")
-            discount_val = 100.0
+            discount_val = Decimal(100)
         
-        self.current_discount_value = discount_val
-        self.current_discount_type = discount_type
-        self.update_cart_display()
-        self.calculate_change() # Recalcula o troco
+        self.cart.set_discount(discount_val, discount_type)
+        self._update_cart_totals()
         messagebox.showinfo("Desconto Aplicado", f"Desconto de {discount_str} {discount_type} aplicado ao total.")
 
     def calculate_change(self, event=None):
@@ -1825,22 +3981,18 @@ class PdvApp:
         Calcula e exibe o troco, se a forma de pagamento for "Dinheiro".
         """
         if self.payment_method_combobox.get() == "Dinheiro":
-            try:
-                total_str = self.total_label.cget("text").replace("Total: R$ ", "").replace(",", ".")
-                total = float(total_str)
-            except ValueError:
-                total = 0.0
+            total = self.cart.total
 
             try:
-                received_amount = float(self.received_amount_entry.get().replace(',', '.'))
+                received_cents = parse_money(self.received_amount_entry.get())
             except ValueError:
-                received_amount = 0.0
+                received_cents = 0
             
-            change = received_amount - total
+            change = received_cents - total
             if change < 0:
                 self.change_label.configure(text="R$ 0.00", text_color="#F44336") # Vermelho para troco insuficiente
             else:
-                self.change_label.configure(text=f"R$ {change:.2f}", text_color=self.primary_green)
+                self.change_label.configure(text=format_money(change), text_color=self.primary_green)
         else:
             self.received_amount_entry.delete(0, ctk.END)
             self.change_label.configure(text="R$ 0.00")
@@ -1883,182 +4035,223 @@ class PdvApp:
 
     def update_cart_display(self):
         """
-        Atualiza a exibição do Treeview do carrinho de compras e o total da venda, aplicando o desconto.
-        """
-        for item in self.cart_tree.get_children():
-            self.cart_tree.delete(item)
-
-        subtotal_before_discount = 0.0
-        for product_id, item_data in self.current_cart.items():
-            subtotal = item_data['quantity'] * item_data['price']
-            subtotal_before_discount += subtotal
-            self.cart_tree.insert("", ctk.END, values=(
-                product_id,
-                item_data['name'],
-                f"R$ {item_data['price']:.2f}",
-                item_data['quantity'],
-                f"R$ {subtotal:.2f}"
-            ))
-        
-        final_total = subtotal_before_discount
-        if self.current_discount_type == "Porcentagem":
-            final_total = subtotal_before_discount * (1 - (self.current_discount_value / 100))
-        elif self.current_discount_type == "Valor Fixo":
-            final_total = subtotal_before_discount - self.current_discount_value
-            if final_total < 0:
-                final_total = 0.0
-
-        self.total_label.configure(text=f"Total: R$ {final_total:.2f}")
+        Sincroniza todo o Treeview do carrinho com o modelo e atualiza o total
+        (usado ao abrir a tela e ao esvaziar o carrinho).
+        """
+        self.cart_tree_binding.refresh(self.cart.rows())
+        self._update_cart_totals()
+
+    def _refresh_cart_line(self, product_id):
+        """
+        Atualiza apenas a linha do produto alterado e os totais.
+        """
+        if product_id in self.cart:
+            self.cart_tree_binding.set_row(self.cart.line_values(product_id))
+        else:
+            self.cart_tree_binding.remove_row(product_id)
+        self._update_cart_totals()
+
+    def _update_cart_totals(self):
+        self.total_label.configure(text=f"Total: {format_money(self.cart.total)}")
         self.calculate_change() # Recalcula o troco com o novo total
 
-    def on_customer_select_in_sales(self, choice):
+    def on_customer_select_in_sales(self, event=None):
         """
-        Lida com a seleção de um cliente no combobox da tela de vendas.
-        Atualiza self.selected_customer_id e preenche customer_name_entry_temp.
+        Lida com a escolha de um cliente na lista de sugestões da tela de vendas.
+        O ID vem junto com a sugestão, então homônimos não se confundem.
         """
-        if choice == "-- Selecione um Cliente (Opcional) --":
+        selection = self.customer_sales_suggestions.curselection()
+        if not selection:
+            return
+        choice = self.customer_sales_suggestions.get(selection[0])
+        customer = self.customer_sales_choices.get(choice)
+        if customer is None:
+            return # Linha "Nenhum cliente encontrado"
+        self.customer_sales_entry.delete(0, ctk.END)
+        self.customer_sales_entry.insert(0, choice)
+        self.hide_customer_suggestions_in_sales()
+        self.customer_sales_entry.focus_set()
+        self.selected_customer_id = customer[0]
+        self.customer_name_entry.delete(0, ctk.END) # Limpa o nome avulso
+        self.customer_name_entry.insert(0, customer[1]) # Preenche com o nome do cliente selecionado (apenas para exibição)
+
+    def on_customer_search_key_in_sales(self, event=None):
+        """
+        Texto digitado no seletor de clientes: desfaz a escolha anterior e agenda a busca.
+        """
+        if self.customer_sales_entry.get() in self.customer_sales_choices:
+            return # Texto de uma sugestão escolhida (ou Enter/Esc sobre ela)
+        if self.selected_customer_id is not None:
             self.selected_customer_id = None
-            self.customer_name_entry.delete(0, ctk.END) # Limpa o nome avulso se um cliente foi desselecionado
-        else:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            # Precisamos encontrar o ID do cliente baseado no nome (e assumindo unicidade, ou ajustando se houver homônimos)
-            cursor.execute("SELECT id FROM customers WHERE name=?", (choice,))
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                self.selected_customer_id = result[0]
-                self.customer_name_entry.delete(0, ctk.END) # Limpa o nome avulso se um cliente selecionado
-                self.customer_name_entry.insert(0, choice) # Preenche com o nome do cliente selecionado (apenas para exibição)
-            else:
-                self.selected_customer_id = None
-                self.customer_name_entry.delete(0, ctk.END)
-                messagebox.showerror("Erro", "Cliente selecionado não encontrado. Por favor, recarregue a lista de clientes.")
-        
-    def update_customer_dropdown_in_sales(self):
+            self.customer_name_entry.delete(0, ctk.END)
+        self.customer_sales_search.schedule(event)
+
+    def on_customer_search_down_in_sales(self, event=None):
         """
-        Popula o combobox de seleção de clientes na tela de vendas.
+        Seta para baixo no seletor de clientes: passa o foco para a primeira sugestão.
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM customers ORDER BY name")
-        customer_names = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        if self.customer_sales_suggestions.winfo_ismapped() and self.customer_sales_choices:
+            self.customer_sales_suggestions.focus_set()
+            self.customer_sales_suggestions.selection_clear(0, ctk.END)
+            self.customer_sales_suggestions.selection_set(0)
+            self.customer_sales_suggestions.activate(0)
+        return "break"
+
+    def on_customer_search_return_in_sales(self, event=None):
+        """
+        Enter no seletor de clientes: escolhe a primeira sugestão, se houver.
+        """
+        if self.customer_sales_suggestions.winfo_ismapped() and self.customer_sales_choices:
+            self.customer_sales_suggestions.selection_clear(0, ctk.END)
+            self.customer_sales_suggestions.selection_set(0)
+            self.on_customer_select_in_sales()
+        return "break"
+
+    def on_customer_search_focus_out_in_sales(self, event=None):
+        # Espera o foco assentar: um clique na lista tira o foco do campo antes de escolher
+        self.master.after(100, self._hide_customer_suggestions_if_unfocused)
 
-        # Adiciona a opção padrão no início
-        dropdown_values = ["-- Selecione um Cliente (Opcional) --"] + customer_names
-        self.customer_sales_combobox.configure(values=dropdown_values)
-        self.customer_sales_combobox.set("-- Selecione um Cliente (Opcional) --") # Reseta a seleção
+    def _hide_customer_suggestions_if_unfocused(self):
+        try:
+            focus = self.master.focus_get()
+        except KeyError: # Foco em um widget interno do Tk (ex.: menu aberto)
+            focus = None
+        if focus is None or (focus is not self.customer_sales_suggestions and focus.master is not self.customer_sales_entry):
+            self.hide_customer_suggestions_in_sales()
+
+    def hide_customer_suggestions_in_sales(self, event=None):
+        self.customer_sales_suggestions.place_forget()
+
+    def _render_customer_choices(self, customers):
+        self.customer_sales_choices = {
+            f"{name} - {phone} (#{customer_id})" if phone else f"{name} (#{customer_id})": (customer_id, name)
+            for customer_id, name, phone in customers
+        }
+        suggestions = self.customer_sales_suggestions
+        suggestions.delete(0, ctk.END)
+        if self.customer_sales_choices:
+            suggestions.insert(ctk.END, *self.customer_sales_choices)
+        elif self.customer_sales_entry.get().strip():
+            suggestions.insert(ctk.END, NO_CUSTOMER_MATCHES)
+            suggestions.itemconfigure(0, foreground="gray")
+        else:
+            self.hide_customer_suggestions_in_sales()
+            return
+        suggestions.configure(height=min(suggestions.size(), CUSTOMER_SUGGESTION_ROWS))
+        # Sobreposta logo abaixo do campo, como o menu de um combobox
+        suggestions.place(in_=self.customer_sales_entry, x=0, rely=1, relwidth=1)
+        suggestions.lift()
+
+    def reset_customer_picker_in_sales(self):
+        """
+        Limpa o seletor de clientes da tela de vendas (sem consultar o banco).
+        """
+        self.customer_sales_search.cancel()
+        self.customer_sales_search.invalidate()
+        self.customer_sales_choices = {}
+        self.customer_sales_entry.delete(0, ctk.END)
+        self.hide_customer_suggestions_in_sales()
 
     def finalize_sale(self):
         """
         Finaliza a venda atual, registrando-a no banco de dados
         e atualizando o estoque dos produtos.
         """
-        if not self.current_cart:
+        if not self.cart:
             messagebox.showwarning("Venda Vazia", "O carrinho está vazio. Adicione produtos para finalizar a venda.")
             return
 
         customer_name_manual = self.customer_name_entry.get().strip() # Nome digitado avulso
         payment_method = self.payment_method_combobox.get()
-        final_total = float(self.total_label.cget("text").replace("Total: R$ ", "").replace(",", "."))
+        final_total = self.cart.total
         
-        received_amount = 0.0
-        change_amount = 0.0
+        received_cents = 0
+        change_cents = 0
 
         if payment_method == "Dinheiro":
             try:
-                received_amount = float(self.received_amount_entry.get().replace(',', '.'))
-                if received_amount < final_total:
+                received_cents = parse_money(self.received_amount_entry.get())
+                if received_cents < final_total:
                     messagebox.showerror("Erro de Pagamento", "O valor recebido é menor que o total da venda.")
                     return
-                change_amount = received_amount - final_total
+                change_cents = received_cents - final_total
             except ValueError:
                 messagebox.showerror("Erro de Pagamento", "Por favor, insira um valor numérico válido para 'Valor Recebido'.")
                 return
 
         # Determinar o nome do cliente a ser salvo
         customer_name_to_save = customer_name_manual
-        customer_id_to_save = self.selected_customer_id # Já vem do combobox se selecionado
-
+        customer_id_to_save = self.selected_customer_id # Já vem do seletor se um cliente foi escolhido
+        customer_search_text = self.customer_sales_entry.get().strip()
+        if customer_id_to_save is None and not customer_name_to_save and customer_search_text:
+            customer_name_to_save = customer_search_text # Texto sem cliente escolhido vale como nome avulso
+
+        customer_label = customer_name_to_save if customer_name_to_save else 'Não informado'
+        if customer_id_to_save is None and customer_name_to_save:
+            customer_label += " (avulso, sem cadastro)"
         if not messagebox.askyesno("Confirmar Finalização de Venda", 
-                                    f"Deseja realmente finalizar esta venda no valor total de R$ {final_total:.2f}?\n"
-                                    f"Cliente: {customer_name_to_save if customer_name_to_save else 'Não informado'}\n"
+                                    f"Deseja realmente finalizar esta venda no valor total de {format_money(final_total)}?\n"
+                                    f"Cliente: {customer_label}\n"
                                     f"Pagamento: {payment_method}" + 
-                                    (f"\nRecebido: R$ {received_amount:.2f}\nTroco: R$ {change_amount:.2f}" if payment_method == "Dinheiro" else "")
+                                    (f"\nRecebido: {format_money(received_cents)}\nTroco: {format_money(change_cents)}" if payment_method == "Dinheiro" else "")
                                     ):
             return
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
         try:
-            for product_id, item_data in self.current_cart.items():
-                cursor.execute("SELECT stock FROM products WHERE id=?", (product_id,))
-                result = cursor.fetchone()
-                if not result:
-                    raise Exception(f"Produto com ID {product_id} não encontrado no estoque.")
-                
-                current_stock = result[0]
-                if item_data['quantity'] > current_stock:
-                    messagebox.showerror("Erro de Estoque", f"Estoque insuficiente para '{item_data['name']}'. Disponível: {current_stock}")
-                    conn.rollback()
-                    return
+            sold_at, utc_offset = local_epoch()
+            timestamp = format_timestamp(sold_at) # Exibido no recibo
+            sale = {
+                'sold_at': sold_at,
+                'utc_offset': utc_offset,
+                'total_cents': final_total,
+                'customer_id': customer_id_to_save,
+                'customer_name': customer_name_to_save,
+                'payment_method': payment_method,
+                'discount_value': self.cart.discount_value,
+                'discount_type': self.cart.discount_type,
+                'received_cents': received_cents,
+                'change_cents': change_cents,
+            }
+            items = [(product_id, item_data['name'], item_data['quantity'], item_data['price_cents'])
+                     for product_id, item_data in self.cart.items.items()]
+            try:
+                sale_id = checkout(self.db, sale, items)
+            except InsufficientStockError as e:
+                messagebox.showerror("Erro de Estoque", str(e))
+                self.events.publish("products", product_ids=[e.product_id]) # Exibe o estoque atual
+                return
 
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Atualiza a inserção na tabela 'sales' com as novas colunas
-            cursor.execute("INSERT INTO sales (timestamp, total, customer_id, customer_name, payment_method, discount_value, discount_type, received_amount, change_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                           (timestamp, final_total, customer_id_to_save, customer_name_to_save, payment_method, self.current_discount_value, self.current_discount_type, received_amount, change_amount))
-            sale_id = cursor.lastrowid
-
-            for product_id, item_data in self.current_cart.items():
-                cursor.execute(
-                    "INSERT INTO sale_items (sale_id, product_id, product_name, quantity, price) VALUES (?, ?, ?, ?, ?)",
-                    (sale_id, product_id, item_data['name'], item_data['quantity'], item_data['price'])
-                )
-                cursor.execute("UPDATE products SET stock = stock - ? WHERE id=?", (item_data['quantity'], product_id))
-            
-            conn.commit()
-            
-            cart_items_for_receipt = list(self.current_cart.values())
+            cart_items_for_receipt = list(self.cart.items.values())
+            sold_product_ids = list(self.cart.items)
 
             # Passa as novas informações para o recibo
-            self.display_receipt(sale_id, timestamp, final_total, customer_name_to_save, payment_method, self.current_discount_value, self.current_discount_type, received_amount, change_amount, cart_items_for_receipt)
+            self.display_receipt(sale_id, timestamp, final_total, customer_name_to_save, payment_method, self.cart.discount_value, self.cart.discount_type, received_cents, change_cents, cart_items_for_receipt)
 
             messagebox.showinfo("Venda Finalizada", f"Venda {sale_id} finalizada com sucesso!")
             
             # Reseta a interface de vendas
-            self.current_cart = {}
+            self.cart.clear()
             self.update_cart_display()
-            self.load_products_to_treeview()
-            self.load_products_for_sale()
-            self.load_sales_history()
-            self.customer_sales_combobox.set("-- Selecione um Cliente (Opcional) --") # NOVO
+            self.events.publish("products", product_ids=sold_product_ids)
+            self.events.publish("sales", sale_id=sale_id)
+            self.reset_customer_picker_in_sales()
             self.customer_name_entry.delete(0, ctk.END)
             self.selected_customer_id = None # Reseta o ID do cliente selecionado
             self.payment_method_combobox.set("Dinheiro")
             self.discount_entry.delete(0, ctk.END)
             self.discount_type_combobox.set("Porcentagem")
-            self.current_discount_value = 0.0
-            self.current_discount_type = "Porcentagem"
             self.received_amount_entry.delete(0, ctk.END) # Limpa valor recebido
             self.change_label.configure(text="R$ 0.00") # Limpa troco
-            self.check_low_stock_status()
             self.update_payment_fields() # Garante que campos de pagamento estejam corretos após finalizar a venda
-            self.update_customer_dropdown_in_sales() # NOVO: Recarrega clientes
 
         except Exception as e:
-            conn.rollback()
             messagebox.showerror("Erro na Venda", f"Ocorreu um erro ao finalizar a venda: {e}")
             print(f"Erro detalhado ao finalizar venda: {e}")
-        finally:
-            conn.close()
 
-    def display_receipt(self, sale_id, timestamp, total, customer_name, payment_method, discount_value, discount_type, received_amount, change_amount, cart_items):
+    def display_receipt(self, sale_id, timestamp, total, customer_name, payment_method, discount_value, discount_type, received_cents, change_cents, cart_items):
         """
         Exibe um recibo visual em uma nova janela.
-        Adiciona botão para gerar PDF.
+        Adiciona botão para gerar PDF. Valores monetários em centavos.
         """
         receipt_window = ctk.CTkToplevel(self.master)
         receipt_window.title(f"Recibo da Venda {sale_id}")
@@ -2089,26 +4282,26 @@ Venda ID: {sale_id}
 Itens:
 """
         for item_data in cart_items: 
-            subtotal = item_data['quantity'] * item_data['price']
-            receipt_content += f"{item_data['name']} (x{item_data['quantity']}) - R$ {item_data['price']:.2f} = R$ {subtotal:.2f}\n"
+            subtotal = item_data['quantity'] * item_data['price_cents']
+            receipt_content += f"{item_data['name']} (x{item_data['quantity']}) - {format_money(item_data['price_cents'])} = {format_money(subtotal)}\n"
 
-        subtotal_before_discount = sum(item['quantity'] * item['price'] for item in cart_items)
+        subtotal_before_discount = sum(item['quantity'] * item['price_cents'] for item in cart_items)
         discount_display = f"{discount_value:.2f}%" if discount_type == 'Porcentagem' else f"R$ {discount_value:.2f}"
         if discount_type == "Nenhum" or discount_value == 0.0:
             discount_display = "Nenhum"
 
         receipt_content += f"""
 -------------------------------------
-Subtotal: R$ {subtotal_before_discount:.2f}
+Subtotal: {format_money(subtotal_before_discount)}
 Desconto ({discount_type}): {discount_display}
-Total Final: R$ {total:.2f}
+Total Final: {format_money(total)}
 -------------------------------------
 Cliente: {customer_name if customer_name else 'Não informado'}
 Pagamento: {payment_method}
 """
         if payment_method == "Dinheiro":
-            receipt_content += f"""Valor Recebido: R$ {received_amount:.2f}
-Troco: R$ {change_amount:.2f}
+            receipt_content += f"""Valor Recebido: {format_money(received_cents)}
+Troco: {format_money(change_cents)}
 """
         receipt_content += f"""=====================================
     Obrigado pela preferência!
@@ -2118,7 +4311,7 @@ Troco: R$ {change_amount:.2f}
         receipt_text.configure(state="disabled") 
 
         generate_pdf_btn = ctk.CTkButton(receipt_window, text="Gerar PDF para Impressão", command=lambda: self.generate_pdf_receipt(
-            sale_id, timestamp, total, customer_name, payment_method, discount_value, discount_type, received_amount, change_amount, cart_items), corner_radius=10,
+            sale_id, timestamp, total, customer_name, payment_method, discount_value, discount_type, received_cents, change_cents, cart_items), corner_radius=10,
             fg_color="#4CAF50", hover_color="#45a049", font=ctk.CTkFont(size=13, weight="bold")
         )
         generate_pdf_btn.pack(pady=(5, 5))
@@ -2127,9 +4320,9 @@ Troco: R$ {change_amount:.2f}
                                 fg_color=self.primary_green, hover_color=self.secondary_green, font=ctk.CTkFont(size=13, weight="bold"))
         close_btn.pack(pady=5)
 
-    def generate_pdf_receipt(self, sale_id, timestamp, total, customer_name, payment_method, discount_value, discount_type, received_amount, change_amount, cart_items):
+    def generate_pdf_receipt(self, sale_id, timestamp, total, customer_name, payment_method, discount_value, discount_type, received_cents, change_cents, cart_items):
         """
-        Gera um recibo em formato PDF.
+        Gera um recibo em formato PDF. Valores monetários em centavos.
         """
         file_name = f"recibo_venda_{sale_id}.pdf"
         
@@ -2145,8 +4338,9 @@ Troco: R$ {change_amount:.2f}
             return
 
         try:
-            c = canvas.Canvas(filepath, pagesize=letter)
-            width, height = letter 
+            c = canvas.Canvas(filepath, pagesize=pagesizes.letter)
+            width, height = pagesizes.letter
+            inch = units.inch
 
             left_margin = inch
             # right_margin = width - inch # Não utilizado diretamente, mas bom para referência
@@ -2174,26 +4368,26 @@ Troco: R$ {change_amount:.2f}
 
             c.setFont("Helvetica", 10)
             for item_data in cart_items:
-                subtotal = item_data['quantity'] * item_data['price']
-                item_line = f"{item_data['name']} (x{item_data['quantity']}) - R$ {item_data['price']:.2f} = R$ {subtotal:.2f}"
+                subtotal = item_data['quantity'] * item_data['price_cents']
+                item_line = f"{item_data['name']} (x{item_data['quantity']}) - {format_money(item_data['price_cents'])} = {format_money(subtotal)}"
                 c.drawString(left_margin, y_position, item_line)
                 y_position -= line_height
 
             y_position -= line_height
 
-            subtotal_before_discount = sum(item['quantity'] * item['price'] for item in cart_items)
+            subtotal_before_discount = sum(item['quantity'] * item['price_cents'] for item in cart_items)
             discount_display = f"{discount_value:.2f}%" if discount_type == 'Porcentagem' else f"R$ {discount_value:.2f}"
             if discount_type == "Nenhum" or discount_value == 0.0:
                 discount_display = "Nenhum"
 
             c.setFont("Helvetica-Bold", 10)
-            c.drawString(left_margin, y_position, f"Subtotal: R$ {subtotal_before_discount:.2f}")
+            c.drawString(left_margin, y_position, f"Subtotal: {format_money(subtotal_before_discount)}")
             y_position -= line_height
             c.drawString(left_margin, y_position, f"Desconto ({discount_type}): {discount_display}")
             y_position -= line_height * 2
 
             c.setFont("Helvetica-Bold", 14)
-            c.drawString(left_margin, y_position, f"Total Final: R$ {total:.2f}")
+            c.drawString(left_margin, y_position, f"Total Final: {format_money(total)}")
             y_position -= line_height * 2
 
             c.setFont("Helvetica", 10)
@@ -2203,9 +4397,9 @@ Troco: R$ {change_amount:.2f}
             y_position -= line_height
 
             if payment_method == "Dinheiro":
-                c.drawString(left_margin, y_position, f"Valor Recebido: R$ {received_amount:.2f}")
+                c.drawString(left_margin, y_position, f"Valor Recebido: {format_money(received_cents)}")
                 y_position -= line_height
-                c.drawString(left_margin, y_position, f"Troco: R$ {change_amount:.2f}")
+                c.drawString(left_margin, y_position, f"Troco: {format_money(change_cents)}")
                 y_position -= line_height
 
             y_position -= line_height * 2
@@ -2227,13 +4421,13 @@ Troco: R$ {change_amount:.2f}
         Pede confirmação ao usuário.
         """
         if messagebox.askyesno("Confirmar Cancelamento", "Tem certeza que deseja cancelar a venda atual? Todo o conteúdo do carrinho será esvaziado e a operação não poderá ser desfeita."):
-            self.current_cart = {}
+            self.cart.clear()
             self.update_cart_display()
             self.sales_quantity_entry.delete(0, ctk.END) 
             self.sales_quantity_entry.insert(0, "1") # Reseta para 1
             self.selected_product_for_sale = None 
             self.selected_product_display.configure(text="") 
-            self.customer_sales_combobox.set("-- Selecione um Cliente (Opcional) --") # NOVO
+            self.reset_customer_picker_in_sales()
             self.customer_name_entry.delete(0, ctk.END) 
             self.selected_customer_id = None # Reseta o ID do cliente selecionado
             self.payment_method_combobox.set("Dinheiro") 
@@ -2241,22 +4435,16 @@ Troco: R$ {change_amount:.2f}
             self.selected_cart_item_id = None 
             self.discount_entry.delete(0, ctk.END) 
             self.discount_type_combobox.set("Porcentagem") 
-            self.current_discount_value = 0.0 
-            self.current_discount_type = "Porcentagem" 
             self.received_amount_entry.delete(0, ctk.END) # Limpa valor recebido
             self.change_label.configure(text="R$ 0.00") # Limpa troco
             self.update_payment_fields() # Garante que campos de pagamento estejam corretos após cancelar a venda
-            self.update_customer_dropdown_in_sales() # NOVO: Recarrega clientes
             messagebox.showinfo("Venda Cancelada", "A venda atual foi cancelada com sucesso.")
 
     def load_sales_history(self):
         """
         Carrega o histórico de vendas do banco de dados e o exibe no Treeview de histórico,
-        aplicando filtros de busca e período.
+        aplicando filtros de busca e período. A consulta roda em segundo plano (DbWorker).
         """
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-
         customer_search_term = self.history_customer_search_entry.get().strip().lower()
         product_search_term = self.history_product_search_entry.get().strip().lower()
         period_selection = self.history_period_combobox.get()
@@ -2267,19 +4455,28 @@ Troco: R$ {change_amount:.2f}
         if period_selection == "Hoje":
             start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         elif period_selection == "Últimos 7 dias":
-            start_date = datetime.now() - timedelta(days=7)
+            # Hoje e os 6 dias anteriores inteiros: os mesmos 7 dias do calendário dos relatórios
+            start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=6)
         elif period_selection == "Mês Atual":
             start_date = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        elif period_selection == "Personalizado":
+            try:
+                start_date = datetime.strptime(self.history_start_date_entry.get().strip(), "%Y-%m-%d")
+                end_date = datetime.strptime(self.history_end_date_entry.get().strip(), "%Y-%m-%d") + timedelta(days=1, seconds=-1)
+            except ValueError:
+                messagebox.showerror("Erro", "Informe as datas inicial e final no formato AAAA-MM-DD.")
+                return
+            if start_date > end_date:
+                messagebox.showerror("Erro", "A data inicial deve ser anterior ou igual à data final.")
+                return
 
+        # Sem JOIN com sale_items: o filtro de produto é um EXISTS, aplicado só quando usado,
+        # então cada venda aparece uma única vez sem precisar de DISTINCT
         query = """
-            SELECT DISTINCT s.id, s.timestamp, s.total, 
-                            COALESCE(c.name, s.customer_name) AS customer_display_name, -- Preferir nome do cliente cadastrado
-                            s.payment_method, s.discount_value, s.discount_type, s.received_amount, s.change_amount
+            SELECT s.id, s.sold_at, s.total_cents, 
+                   COALESCE(c.name, s.customer_name) AS customer_display_name, -- Preferir nome do cliente cadastrado
+                   s.payment_method, s.discount_value, s.discount_type, s.received_cents, s.change_cents
             FROM sales s
-            LEFT JOIN sale_items si ON s.id = si.sale_id
             LEFT JOIN customers c ON s.customer_id = c.id -- NOVO JOIN com a tabela de clientes
             WHERE 1=1
         """
@@ -2290,74 +4487,79 @@ Troco: R$ {change_amount:.2f}
             params.append(f"%{customer_search_term}%")
         
         if product_search_term:
-            query += " AND LOWER(si.product_name) LIKE ?"
+            query += " AND EXISTS (SELECT 1 FROM sale_items si WHERE si.sale_id = s.id AND LOWER(si.product_name) LIKE ?)"
             params.append(f"%{product_search_term}%")
 
         if start_date:
-            query += " AND s.timestamp >= ? AND s.timestamp <= ?"
-            params.append(start_date.strftime("%Y-%m-%d %H:%M:%S"))
-            params.append(end_date.strftime("%Y-%m-%d %H:%M:%S"))
+            query += " AND s.sold_at BETWEEN ? AND ?"
+            params.append(local_epoch(start_date)[0])
+            params.append(local_epoch(end_date)[0])
         
-        query += " ORDER BY s.timestamp DESC"
+        # Vendas mais recentes primeiro, paginadas por (sold_at, id)
+        pager = KeysetPager(self.db, query, params, order_by=("s.sold_at", "s.id"), key_indexes=(1, 0), descending=True)
 
-        cursor.execute(query, tuple(params))
-        sales = cursor.fetchall()
-        conn.close()
+        self.history_loading_label.configure(text="Carregando vendas...")
+        self.db_worker.submit("history", lambda db: (pager, pager.first_page(), pager.count()),
+                              self._render_sales_history, on_error=self._on_history_load_error)
 
-        for sale in sales:
-            discount_display = f"{sale[5]:.2f}%" if sale[6] == "Porcentagem" else f"R$ {sale[5]:.2f}"
-            if sale[6] == "Nenhum" or sale[5] == 0.0:
-                discount_display = "Nenhum"
-            
-            # Formata os valores recebido e troco
-            received_display = f"R$ {sale[7]:.2f}" if sale[7] is not None else "N/A"
-            change_display = f"R$ {sale[8]:.2f}" if sale[8] is not None else "N/A"
+    def on_history_period_change(self, choice):
+        """
+        Habilita os campos de data apenas no período "Personalizado".
+        """
+        state = "normal" if choice == "Personalizado" else "disabled"
+        self.history_start_date_entry.configure(state=state)
+        self.history_end_date_entry.configure(state=state)
+
+    def _on_history_load_error(self, error):
+        self.history_loading_label.configure(text="")
+        messagebox.showerror("Erro", f"Ocorreu um erro ao carregar o histórico de vendas: {error}")
+        print(f"Erro detalhado ao carregar histórico de vendas: {error}")
+
+    def _render_sales_history(self, result):
+        pager, first_page, total = result
+        self.history_loading_label.configure(text="")
+        self.history_tree_view.show_pager(pager, first_page, total)
+
+    def _format_history_row(self, sale):
+        discount_display = f"{sale[5]:.2f}%" if sale[6] == "Porcentagem" else f"R$ {sale[5]:.2f}"
+        if sale[6] == "Nenhum" or sale[5] == 0.0:
+            discount_display = "Nenhum"
+
+        # Formata os valores recebido e troco
+        received_display = format_money(sale[7]) if sale[7] is not None else "N/A"
+        change_display = format_money(sale[8]) if sale[8] is not None else "N/A"
 
-            self.history_tree.insert("", ctk.END, values=(sale[0], sale[1], f"R$ {sale[2]:.2f}", discount_display, 
-                                                        sale[3] if sale[3] else "Não informado", sale[4] if sale[4] else "N/A",
-                                                        received_display, change_display))
+        return (sale[0], format_timestamp(sale[1]), format_money(sale[2]), discount_display,
+                sale[3] if sale[3] else "Não informado", sale[4] if sale[4] else "N/A",
+                received_display, change_display)
 
     def load_sales_for_returns(self, event=None):
         """
         Carrega as vendas para o módulo de devoluções, com opção de filtro.
         """
-        for item in self.return_sales_tree.get_children():
-            self.return_sales_tree.delete(item)
-        
-        search_term = self.return_sale_search_entry.get().strip().lower()
-
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        query = """
-            SELECT s.id, s.timestamp, s.total, COALESCE(c.name, s.customer_name) AS customer_display_name, s.payment_method
-            FROM sales s
-            LEFT JOIN customers c ON s.customer_id = c.id
-            WHERE 1=1
-        """
-        params = []
-
-        if search_term:
-            query += " AND (CAST(s.id AS TEXT) LIKE ? OR LOWER(COALESCE(c.name, s.customer_name)) LIKE ?)"
-            params.extend([f"%{search_term}%", f"%{search_term}%"])
-        
-        query += " ORDER BY s.timestamp DESC"
+        self.return_sale_search.run_now()
 
-        cursor.execute(query, tuple(params))
-        sales = cursor.fetchall()
-        conn.close()
+    def _render_sales_for_returns(self, sales):
+        self.return_sales_tree_binding.refresh((sale[0], format_timestamp(sale[1]), format_money(sale[2]), sale[3] if sale[3] else "Não informado", sale[4] if sale[4] else "N/A")
+                                               for sale in sales)
 
-        for sale in sales:
-            self.return_sales_tree.insert("", ctk.END, values=(sale[0], sale[1], f"R$ {sale[2]:.2f}", sale[3] if sale[3] else "Não informado", sale[4] if sale[4] else "N/A"))
-        
         self.return_sale_details_label.configure(text="Nenhuma venda selecionada.")
-        for item in self.return_items_tree.get_children():
-            self.return_items_tree.delete(item)
-        self.process_return_btn.configure(state="disabled")
         self.selected_return_sale_id = None
-        self.selected_return_item_id = None
+        self._reset_return_form()
+
+    def _reset_return_form(self, clear_items=True):
+        """
+        Limpa a seleção de itens, os campos e os botões do formulário de devolução.
+        """
+        if clear_items:
+            for item in self.return_items_tree.get_children():
+                self.return_items_tree.delete(item)
+        self.selected_return_item_ids = []
+        self.return_quantity_entry.configure(state="normal")
         self.return_quantity_entry.delete(0, ctk.END)
         self.return_reason_entry.delete(0, ctk.END)
+        self.process_return_btn.configure(state="disabled")
+        self.return_whole_sale_btn.configure(state="disabled")
 
     def on_return_sale_select(self, event):
         """
@@ -2374,140 +4576,131 @@ Troco: R$ {change_amount:.2f}
             
             self.return_sale_details_label.configure(text=f"Venda ID: {self.selected_return_sale_id} | Data: {sale_timestamp} | Total: {sale_total} | Cliente: {sale_customer} | Pagamento: {sale_payment}")
 
-            for item in self.return_items_tree.get_children():
-                self.return_items_tree.delete(item)
-
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            cursor.execute("SELECT product_id, product_name, quantity, price FROM sale_items WHERE sale_id=?", (self.selected_return_sale_id,))
-            items = cursor.fetchall()
-            conn.close()
+            self._reset_return_form()
 
-            for item_data in items:
-                # Verificar quantidade já devolvida para este item nesta venda
-                conn = sqlite3.connect(self.db_name)
-                cursor = conn.cursor()
-                cursor.execute("SELECT SUM(quantity) FROM returns WHERE sale_id=? AND product_id=?", (self.selected_return_sale_id, item_data[0]))
-                returned_qty = cursor.fetchone()[0] or 0
-                conn.close()
+            # Vendido, já devolvido e disponível de todas as linhas numa única consulta
+            lines = sale_return_status(self.db, self.selected_return_sale_id)
+            for product_id, product_name, sold_qty, returned_qty, remaining_qty_to_return, price_cents in lines:
+                self.return_items_tree.insert("", ctk.END, values=(product_id, product_name, sold_qty, returned_qty, remaining_qty_to_return, format_money(price_cents)))
 
-                remaining_qty_to_return = item_data[2] - returned_qty
-                
-                self.return_items_tree.insert("", ctk.END, values=(item_data[0], item_data[1], item_data[2], returned_qty, remaining_qty_to_return, f"R$ {item_data[3]:.2f}"))
-            
-            self.process_return_btn.configure(state="disabled")
-            self.selected_return_item_id = None
-            self.return_quantity_entry.delete(0, ctk.END)
-            self.return_reason_entry.delete(0, ctk.END)
+            if any(line[4] > 0 for line in lines):
+                self.return_whole_sale_btn.configure(state="normal")
         else:
             self.selected_return_sale_id = None
             self.return_sale_details_label.configure(text="Nenhuma venda selecionada.")
-            for item in self.return_items_tree.get_children():
-                self.return_items_tree.delete(item)
-            self.process_return_btn.configure(state="disabled")
-            self.selected_return_item_id = None
-            self.return_quantity_entry.delete(0, ctk.END)
-            self.return_reason_entry.delete(0, ctk.END)
+            self._reset_return_form()
 
     def on_return_item_select(self, event):
         """
-        Habilita o botão de processar devolução e popula a quantidade máxima para devolver.
+        Habilita o botão de processar devolução para as linhas selecionadas. Com uma
+        linha, popula a quantidade máxima para devolver; com várias, cada linha é
+        devolvida pela quantidade disponível.
         """
-        selected_item = self.return_items_tree.focus()
-        if selected_item and self.selected_return_sale_id is not None:
-            values = self.return_items_tree.item(selected_item, 'values')
-            self.selected_return_item_id = int(values[0]) # Product ID
-            quantity_available_to_return = int(values[4]) # Qtde Disponível para devolver
+        selected_items = self.return_items_tree.selection()
+        if selected_items and self.selected_return_sale_id is not None:
+            values = [self.return_items_tree.item(item, 'values') for item in selected_items]
+            self.selected_return_item_ids = [int(value[0]) for value in values] # Product IDs
 
+            self.return_quantity_entry.configure(state="normal")
             self.return_quantity_entry.delete(0, ctk.END)
-            self.return_quantity_entry.insert(0, str(quantity_available_to_return))
+            if len(values) == 1:
+                self.return_quantity_entry.insert(0, str(int(values[0][4]))) # Qtde Disponível para devolver
+            else:
+                self.return_quantity_entry.configure(state="disabled")
             self.process_return_btn.configure(state="normal")
         else:
             self.process_return_btn.configure(state="disabled")
-            self.selected_return_item_id = None
+            self.selected_return_item_ids = []
+            self.return_quantity_entry.configure(state="normal")
             self.return_quantity_entry.delete(0, ctk.END)
-            self.return_reason_entry.delete(0, ctk.END)
 
     def process_return(self):
         """
-        Processa a devolução de um item da venda selecionada.
-        Atualiza o estoque e registra a devolução.
+        Processa a devolução das linhas selecionadas da venda: a quantidade informada
+        quando há uma só linha, ou tudo o que resta devolver de cada linha quando há
+        várias.
         """
         if self.user_role != 'admin':
             messagebox.showwarning("Permissão Negada", "Você não tem permissão para processar devoluções.")
             return
 
-        if self.selected_return_sale_id is None or self.selected_return_item_id is None:
+        if self.selected_return_sale_id is None or not self.selected_return_item_ids:
             messagebox.showwarning("Aviso", "Por favor, selecione uma venda e um item para devolução.")
             return
-        
-        try:
-            return_quantity = int(self.return_quantity_entry.get().strip())
-            if return_quantity <= 0:
-                raise ValueError("A quantidade a devolver deve ser um número positivo.")
-        except ValueError:
-            messagebox.showerror("Erro", "Por favor, insira uma quantidade válida para devolução.")
-            return
-        
-        return_reason = self.return_reason_entry.get().strip()
-        if not return_reason:
-            messagebox.showwarning("Aviso", "Por favor, insira o motivo da devolução.")
+
+        if len(self.selected_return_item_ids) == 1:
+            try:
+                return_quantity = int(self.return_quantity_entry.get().strip())
+                if return_quantity <= 0:
+                    raise ValueError("A quantidade a devolver deve ser um número positivo.")
+            except ValueError:
+                messagebox.showerror("Erro", "Por favor, insira uma quantidade válida para devolução.")
+                return
+            lines = [(self.selected_return_item_ids[0], return_quantity)]
+        else:
+            remaining = {line[0]: line[4] for line in sale_return_status(self.db, self.selected_return_sale_id)}
+            lines = [(product_id, remaining[product_id]) for product_id in self.selected_return_item_ids if remaining.get(product_id, 0) > 0]
+            if not lines:
+                messagebox.showwarning("Aviso", "Os itens selecionados já foram totalmente devolvidos.")
+                return
+
+        self._submit_returns(lines)
+
+    def process_whole_sale_return(self):
+        """
+        Devolve tudo o que ainda resta devolver da venda selecionada.
+        """
+        if self.user_role != 'admin':
+            messagebox.showwarning("Permissão Negada", "Você não tem permissão para processar devoluções.")
             return
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Obter a quantidade original vendida para este item nesta venda
-        cursor.execute("SELECT quantity, product_name FROM sale_items WHERE sale_id=? AND product_id=?", (self.selected_return_sale_id, self.selected_return_item_id))
-        sale_item_info = cursor.fetchone()
-        
-        if not sale_item_info:
-            conn.close()
-            messagebox.showerror("Erro", "Item da venda não encontrado.")
+        if self.selected_return_sale_id is None:
+            messagebox.showwarning("Aviso", "Por favor, selecione uma venda para devolução.")
             return
 
-        original_sold_quantity = sale_item_info[0]
-        product_name = sale_item_info[1]
+        lines = [(line[0], line[4]) for line in sale_return_status(self.db, self.selected_return_sale_id) if line[4] > 0]
+        if not lines:
+            messagebox.showwarning("Aviso", "Todos os itens desta venda já foram devolvidos.")
+            return
 
-        # Verificar quantidade já devolvida para este item nesta venda
-        cursor.execute("SELECT SUM(quantity) FROM returns WHERE sale_id=? AND product_id=?", (self.selected_return_sale_id, self.selected_return_item_id))
-        returned_qty_so_far = cursor.fetchone()[0] or 0
-        conn.close()
+        self._submit_returns(lines)
 
-        if (returned_qty_so_far + return_quantity) > original_sold_quantity:
-            messagebox.showwarning("Quantidade Inválida", f"A quantidade total devolvida para '{product_name}' não pode exceder a quantidade vendida ({original_sold_quantity}). Já foram devolvidas {returned_qty_so_far} unidades.")
+    def _submit_returns(self, lines):
+        """
+        Confirma e grava a devolução de `lines` [(product_id, quantity)] da venda
+        selecionada numa única transação (ver process_returns).
+        """
+        return_reason = self.return_reason_entry.get().strip()
+        if not return_reason:
+            messagebox.showwarning("Aviso", "Por favor, insira o motivo da devolução.")
             return
-        
-        if not messagebox.askyesno("Confirmar Devolução", f"Confirmar devolução de {return_quantity} unidades de '{product_name}' da Venda ID {self.selected_return_sale_id}?"):
+
+        total_units = sum(quantity for _, quantity in lines)
+        if not messagebox.askyesno("Confirmar Devolução", f"Confirmar devolução de {total_units} unidades em {len(lines)} item(ns) da Venda ID {self.selected_return_sale_id}?"):
             return
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        sale_id = self.selected_return_sale_id
         try:
-            # 1. Atualizar estoque do produto
-            cursor.execute("UPDATE products SET stock = stock + ? WHERE id=?", (return_quantity, self.selected_return_item_id))
-            
-            # 2. Registrar a devolução
-            return_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("INSERT INTO returns (sale_id, product_id, product_name, quantity, return_timestamp, reason, processed_by_user_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                           (self.selected_return_sale_id, self.selected_return_item_id, product_name, return_quantity, return_timestamp, return_reason, self.user_id))
-            
-            conn.commit()
-            messagebox.showinfo("Sucesso", f"Devolução de {return_quantity} unidades de '{product_name}' processada com sucesso!")
-            
-            # Atualiza displays
-            self.load_products_to_treeview()
-            self.load_products_for_sale()
-            self.load_sales_for_returns() # Recarrega a lista de vendas para devolução
-            self.on_return_sale_select(None) # Limpa detalhes da venda selecionada
-            self.check_low_stock_status()
-
+            returned = process_returns(self.db, sale_id, lines, return_reason, self.user_id)
+        except ReturnQuantityError as e:
+            messagebox.showwarning("Quantidade Inválida", str(e))
+            self.on_return_sale_select(None) # Mostra as quantidades atuais
+            return
         except Exception as e:
-            conn.rollback()
             messagebox.showerror("Erro na Devolução", f"Ocorreu um erro ao processar a devolução: {e}")
             print(f"Erro detalhado ao processar devolução: {e}")
-        finally:
-            conn.close()
+            return
+
+        if len(returned) == 1:
+            _, product_name, quantity = returned[0]
+            messagebox.showinfo("Sucesso", f"Devolução de {quantity} unidades de '{product_name}' processada com sucesso!")
+        else:
+            messagebox.showinfo("Sucesso", f"Devolução de {total_units} unidades em {len(returned)} itens processada com sucesso!")
+
+        # Atualiza displays
+        self.events.publish("products", product_ids=[product_id for product_id, _, _ in returned])
+        self.events.publish("sales", sale_id=sale_id)
+        self.on_return_sale_select(None) # Recarrega os itens da venda selecionada
 
 
     def load_reports(self, event=None):
@@ -2525,72 +4718,78 @@ Troco: R$ {change_amount:.2f}
         if period_selection == "Hoje":
             start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         elif period_selection == "Últimos 7 dias":
-            start_date = datetime.now() - timedelta(days=7)
+            # Os resumos são por dia: hoje e os 6 dias anteriores (day_number(hoje) - 6 até
+            # day_number(hoje)), e não um intervalo móvel de 7 × 24 h, que abrangeria 8 dias
+            start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=6)
         elif period_selection == "Mês Atual":
             start_date = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        self.reports_loading_label.configure(text="Carregando relatórios...")
+        self.db_worker.submit("reports", lambda db: self._query_reports(db, start_date, end_date),
+                              self._render_reports, on_error=self._on_reports_load_error)
 
-        # --- Relatório de Vendas por Produto ---
-        for item in self.sales_by_product_tree.get_children():
-            self.sales_by_product_tree.delete(item)
-        
-        query_sales_by_product = """
-            SELECT si.product_name, SUM(si.quantity) as total_quantity, SUM(si.quantity * si.price) as total_revenue
-            FROM sale_items si
-            JOIN sales s ON si.sale_id = s.id
+    def _query_reports(self, db, start_date, end_date):
         """
-        params_by_product = []
-        if start_date:
-            query_sales_by_product += " WHERE s.timestamp >= ? AND s.timestamp <= ?"
-            params_by_product.append(start_date.strftime("%Y-%m-%d %H:%M:%S"))
-            params_by_product.append(end_date.strftime("%Y-%m-%d %H:%M:%S"))
-        query_sales_by_product += " GROUP BY si.product_name ORDER BY total_revenue DESC"
-        
-        cursor.execute(query_sales_by_product, tuple(params_by_product))
-        sales_by_product = cursor.fetchall()
-
-        for item in sales_by_product:
-            self.sales_by_product_tree.insert("", ctk.END, values=(item[0], item[1], f"R$ {item[2]:.2f}"))
-
-        # --- Relatório de Vendas por Forma de Pagamento ---
-        for item in self.sales_by_payment_tree.get_children():
-            self.sales_by_payment_tree.delete(item)
+        Executa as consultas dos relatórios (na thread do DbWorker; não acessa widgets).
+        Lê os resumos diários (daily_product_sales/daily_payment_sales), então o custo
+        depende do número de dias do período e não do número de vendas.
 
-        query_sales_by_payment = """
-            SELECT payment_method, SUM(total) as total_revenue
-            FROM sales
+        Returns:
+            tuple: (vendas por produto, vendas por forma de pagamento, total do período),
+                com valores em centavos (somas inteiras e exatas)
         """
-        params_by_payment = []
+        cursor = db.connection.cursor()
+
+        where_period = ""
+        params = ()
         if start_date:
-            query_sales_by_payment += " WHERE timestamp >= ? AND timestamp <= ?"
-            params_by_payment.append(start_date.strftime("%Y-%m-%d %H:%M:%S"))
-            params_by_payment.append(end_date.strftime("%Y-%m-%d %H:%M:%S"))
-        query_sales_by_payment += " GROUP BY payment_method ORDER BY total_revenue DESC"
+            where_period = " WHERE sale_day BETWEEN ? AND ?"
+            params = (day_number(start_date), day_number(end_date))
 
-        cursor.execute(query_sales_by_payment, tuple(params_by_payment))
-        sales_by_payment = cursor.fetchall()
+        # --- Relatório de Vendas por Produto ---
+        cursor.execute(f"""
+            SELECT product_name, SUM(quantity) as total_quantity, SUM(revenue_cents) as total_revenue
+            FROM daily_product_sales{where_period}
+            GROUP BY product_name ORDER BY total_revenue DESC
+        """, params)
+        sales_by_product = cursor.fetchall()
 
-        for item in sales_by_payment:
-            self.sales_by_payment_tree.insert("", ctk.END, values=(item[0], f"R$ {item[1]:.2f}"))
+        # --- Relatório de Vendas por Forma de Pagamento ---
+        cursor.execute(f"""
+            SELECT payment_method, SUM(revenue_cents) as total_revenue
+            FROM daily_payment_sales{where_period}
+            GROUP BY payment_method ORDER BY total_revenue DESC
+        """, params)
+        sales_by_payment = cursor.fetchall()
 
         # --- Fluxo de Caixa (Resumo de Vendas) ---
-        query_cash_flow = "SELECT SUM(total) FROM sales"
-        params_cash_flow = []
-        if start_date:
-            query_cash_flow += " WHERE timestamp >= ? AND timestamp <= ?"
-            params_cash_flow.append(start_date.strftime("%Y-%m-%d %H:%M:%S"))
-            params_cash_flow.append(end_date.strftime("%Y-%m-%d %H:%M:%S"))
-        
-        cursor.execute(query_cash_flow, tuple(params_cash_flow))
+        cursor.execute(f"SELECT SUM(revenue_cents) FROM daily_payment_sales{where_period}", params)
         total_sales_for_period = cursor.fetchone()[0]
         if total_sales_for_period is None:
-            total_sales_for_period = 0.0
+            total_sales_for_period = 0
+
+        return sales_by_product, sales_by_payment, total_sales_for_period
+
+    def _on_reports_load_error(self, error):
+        self.reports_loading_label.configure(text="")
+        messagebox.showerror("Erro", f"Ocorreu um erro ao gerar os relatórios: {error}")
+        print(f"Erro detalhado ao gerar relatórios: {error}")
+
+    def _render_reports(self, report):
+        sales_by_product, sales_by_payment, total_sales_for_period = report
+        self.reports_loading_label.configure(text="")
 
-        self.cash_flow_total_label.configure(text=f"Total de Vendas no Período: R$ {total_sales_for_period:.2f}")
+        for item in self.sales_by_product_tree.get_children():
+            self.sales_by_product_tree.delete(item)
+        for item in sales_by_product:
+            self.sales_by_product_tree.insert("", ctk.END, values=(item[0], item[1], format_money(item[2])))
+
+        for item in self.sales_by_payment_tree.get_children():
+            self.sales_by_payment_tree.delete(item)
+        for item in sales_by_payment:
+            self.sales_by_payment_tree.insert("", ctk.END, values=(item[0], format_money(item[1])))
 
-        conn.close()
+        self.cash_flow_total_label.configure(text=f"Total de Vendas no Período: {format_money(total_sales_for_period)}")
 
     def backup_database(self):
         """
@@ -2617,7 +4816,7 @@ Troco: R$ {change_amount:.2f}
                 messagebox.showerror("Erro de Backup", f"O arquivo do banco de dados '{self.db_name}' não foi encontrado.")
                 return
 
-            shutil.copyfile(self.db_name, filepath)
+            self.db.backup_to(filepath)
             messagebox.showinfo("Backup Concluído", f"Backup do banco de dados salvo com sucesso em:\n{filepath}")
         except Exception as e:
             messagebox.showerror("Erro de Backup", f"Ocorreu um erro ao fazer o backup: {e}\nVerifique se o aplicativo está acessando o banco de dados e tente novamente.")
@@ -2657,9 +4856,11 @@ Troco: R$ {change_amount:.2f}
             return
 
         try:
+            # O worker usa a mesma conexão que replace_with fecha: encerra-o antes
+            self._stop_background_work(wait=True)
             self.master.destroy() 
             
-            shutil.copyfile(filepath, self.db_name)
+            self.db.replace_with(filepath)
             messagebox.showinfo("Restauração Concluída", "Banco de dados restaurado com sucesso! O aplicativo será reiniciado para carregar os novos dados.")
         except Exception as e:
             messagebox.showerror("Erro de Restauração", f"Ocorreu um erro ao restaurar o banco de dados: {e}\nCertifique-se de que o arquivo de backup é válido e que o aplicativo tem permissão para gravar no diretório.")
@@ -2674,17 +4875,8 @@ Troco: R$ {change_amount:.2f}
         """
         Carrega todos os usuários do banco de dados e os exibe no Treeview de gerenciamento de usuários.
         """
-        for item in self.user_tree.get_children():
-            self.user_tree.delete(item)
-
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, establishment_name, username, role FROM users ORDER BY username")
-        users = cursor.fetchall()
-        conn.close()
-
-        for user in users:
-            self.user_tree.insert("", ctk.END, values=(user[0], user[1], user[2], user[3]))
+        users = self.db.fetchall("SELECT id, establishment_name, username, role FROM users ORDER BY username")
+        self.user_tree_binding.refresh(users)
 
     def on_user_select(self, event):
         """
@@ -2739,17 +4931,14 @@ Troco: R$ {change_amount:.2f}
         
         password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT COUNT(*) FROM users WHERE username = ?", (username,))
-            if cursor.fetchone()[0] > 0:
+            if self.db.fetchvalue("SELECT COUNT(*) FROM users WHERE username = ?", (username,)) > 0:
                 messagebox.showerror("Erro", "Este nome de usuário já está em uso por outro usuário. Por favor, escolha outro nome de usuário.")
                 return
 
-            cursor.execute("INSERT INTO users (establishment_name, username, password_hash, role) VALUES (?, ?, ?, ?)",
-                           (establishment_name, username, password_hash, role))
-            conn.commit()
+            with self.db.transaction() as cursor:
+                cursor.execute("INSERT INTO users (establishment_name, username, password_hash, role) VALUES (?, ?, ?, ?)",
+                               (establishment_name, username, password_hash, role))
             messagebox.showinfo("Sucesso", f"Usuário '{username}' ({role}) adicionado com sucesso!")
             self.load_users_to_treeview()
             self.user_username_entry.delete(0, ctk.END)
@@ -2759,8 +4948,6 @@ Troco: R$ {change_amount:.2f}
         except Exception as e:
             messagebox.showerror("Erro", f"Ocorreu um erro: {e}")
             print(f"Erro detalhado ao adicionar novo usuário: {e}") 
-        finally:
-            conn.close()
 
     def update_selected_user(self):
         """
@@ -2787,22 +4974,18 @@ Troco: R$ {change_amount:.2f}
             messagebox.showerror("Erro", "As novas senhas não coincidem.")
             return
         
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute("SELECT id FROM users WHERE username = ? AND id != ?", (username, self.selected_user_id))
-            if cursor.fetchone():
+            if self.db.fetchone("SELECT id FROM users WHERE username = ? AND id != ?", (username, self.selected_user_id)):
                 messagebox.showerror("Erro", "Este nome de usuário já está em uso por outro usuário.")
                 return
 
-            if password:
-                password_hash = hashlib.sha256(password.encode()).hexdigest()
-                cursor.execute("UPDATE users SET username=?, password_hash=?, role=? WHERE id=?", (username, password_hash, role, self.selected_user_id))
-            else:
-                cursor.execute("UPDATE users SET username=?, role=? WHERE id=?", (username, role, self.selected_user_id))
+            with self.db.transaction() as cursor:
+                if password:
+                    password_hash = hashlib.sha256(password.encode()).hexdigest()
+                    cursor.execute("UPDATE users SET username=?, password_hash=?, role=? WHERE id=?", (username, password_hash, role, self.selected_user_id))
+                else:
+                    cursor.execute("UPDATE users SET username=?, role=? WHERE id=?", (username, role, self.selected_user_id))
             
-            conn.commit()
             messagebox.showinfo("Sucesso", f"Usuário '{username}' atualizado com sucesso!")
             self.load_users_to_treeview()
             self.on_user_select(None)
@@ -2815,8 +4998,6 @@ Troco: R$ {change_amount:.2f}
         except Exception as e:
             messagebox.showerror("Erro", f"Ocorreu um erro ao atualizar o usuário: {e}")
             print(f"Erro detalhado ao atualizar usuário: {e}") 
-        finally:
-            conn.close()
 
     def delete_selected_user(self):
         """
@@ -2837,19 +5018,17 @@ Troco: R$ {change_amount:.2f}
         username_to_delete = self.user_tree.item(self.user_tree.focus(), 'values')[2]
 
         if messagebox.askyesno("Confirmar Exclusão", f"Tem certeza que deseja excluir o usuário '{username_to_delete}'? Esta ação é irreversível."):
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
             try:
-                cursor.execute("DELETE FROM users WHERE id=?", (self.selected_user_id,))
-                conn.commit()
+                with self.db.transaction() as cursor:
+                    cursor.execute("DELETE FROM users WHERE id=?", (self.selected_user_id,))
                 messagebox.showinfo("Sucesso", f"Usuário '{username_to_delete}' excluído com sucesso!")
                 self.load_users_to_treeview()
                 self.on_user_select(None)
+            except sqlite3.IntegrityError:
+                messagebox.showerror("Erro", f"Não é possível excluir o usuário '{username_to_delete}'. Ele está associado a devoluções registradas.")
             except Exception as e:
                 messagebox.showerror("Erro", f"Ocorreu um erro ao excluir o usuário: {e}")
                 print(f"Erro detalhado ao excluir usuário: {e}") 
-            finally:
-                conn.close()
 
     def open_change_password_window(self):
         """
@@ -2902,21 +5081,18 @@ Troco: R$ {change_amount:.2f}
                 messagebox.showwarning("Aviso", "A nova senha não pode ser igual à antiga.")
                 return
 
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
             hashed_old_pass = hashlib.sha256(old_pass.encode()).hexdigest()
             hashed_new_pass = hashlib.sha256(new_pass.encode()).hexdigest()
 
-            cursor.execute("SELECT id FROM users WHERE id=? AND password_hash=?", (self.user_id, hashed_old_pass))
-            if cursor.fetchone():
-                cursor.execute("UPDATE users SET password_hash=? WHERE id=?", (hashed_new_pass, self.user_id))
-                conn.commit()
+            with self.db.transaction() as cursor:
+                cursor.execute("UPDATE users SET password_hash=? WHERE id=? AND password_hash=?", (hashed_new_pass, self.user_id, hashed_old_pass))
+                password_changed = cursor.rowcount > 0
+            if password_changed:
                 messagebox.showinfo("Sucesso", "Senha alterada com sucesso! Você será desconectado.")
                 change_password_window.destroy()
                 self.logout()
             else:
                 messagebox.showerror("Erro", "Senha antiga incorreta.")
-            conn.close()
 
         change_btn = ctk.CTkButton(change_password_frame, text="Alterar Senha", command=perform_password_change,
                                     fg_color=self.primary_green, hover_color=self.secondary_green, corner_radius=10,
@@ -2934,27 +5110,30 @@ Troco: R$ {change_amount:.2f}
         """
         Filtra os clientes na Treeview de gerenciamento com base no termo de busca.
         """
-        search_term = self.customer_search_entry.get().strip().lower()
-        
-        for item in self.customer_tree.get_children():
-            self.customer_tree.delete(item)
+        self.customer_search.run_now()
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def _query_customers_management(self, search_term):
+        """
+        Retorna os resultados (limitados e por relevância) da busca ou, sem termo de
+        busca, um KeysetPager sobre todos os clientes, exibido por páginas.
+        """
         if search_term:
-            cursor.execute("SELECT id, name, phone, email FROM customers WHERE LOWER(name) LIKE ? OR LOWER(phone) LIKE ? OR LOWER(email) LIKE ? OR CAST(id AS TEXT) LIKE ? ORDER BY name",
-                           (f"%{search_term}%", f"%{search_term}%", f"%{search_term}%", f"%{search_term}%"))
+            return search_customers(self.db, search_term, columns=("id", "name", "phone", "email"), limit=CUSTOMER_MANAGEMENT_SEARCH_LIMIT)
+        return KeysetPager(self.db, "SELECT id, name, phone, email FROM customers WHERE 1=1", (),
+                           order_by=("name", "id"), key_indexes=(1, 0))
+
+    def _render_customers_management(self, customers):
+        if isinstance(customers, KeysetPager):
+            self.customer_tree_view.show_pager(customers)
         else:
-            cursor.execute("SELECT id, name, phone, email FROM customers ORDER BY name")
-        customers = cursor.fetchall()
-        conn.close()
+            self.customer_tree_view.show_rows(customers)
 
-        for customer in customers:
-            self.customer_tree.insert("", ctk.END, values=(customer[0], customer[1], customer[2] if customer[2] else "N/A", customer[3] if customer[3] else "N/A"))
-        
         # Reseta os campos e desabilita botões se nada estiver selecionado
         self.on_customer_select(None) 
 
+    def _format_customer_row(self, customer):
+        return (customer[0], customer[1], customer[2] if customer[2] else "N/A", customer[3] if customer[3] else "N/A")
+
     def on_customer_select(self, event):
         """
         Popula os campos de entrada com os detalhes do cliente selecionado no Treeview
@@ -3004,22 +5183,19 @@ Troco: R$ {change_amount:.2f}
             messagebox.showerror("Erro", "O nome do cliente é obrigatório.")
             return
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
         try:
-            if self.selected_customer_id:
-                # Atualizar cliente existente
-                cursor.execute("UPDATE customers SET name=?, phone=?, email=? WHERE id=?", (name, phone, email, self.selected_customer_id))
-                messagebox.showinfo("Sucesso", f"Cliente '{name}' atualizado com sucesso!")
-            else:
-                # Adicionar novo cliente
-                cursor.execute("INSERT INTO customers (name, phone, email) VALUES (?, ?, ?)", (name, phone, email))
-                messagebox.showinfo("Sucesso", f"Cliente '{name}' adicionado com sucesso!")
+            with self.db.transaction() as cursor:
+                if self.selected_customer_id:
+                    # Atualizar cliente existente
+                    cursor.execute("UPDATE customers SET name=?, phone=?, email=? WHERE id=?", (name, phone, email, self.selected_customer_id))
+                    success_message = f"Cliente '{name}' atualizado com sucesso!"
+                else:
+                    # Adicionar novo cliente
+                    cursor.execute("INSERT INTO customers (name, phone, email) VALUES (?, ?, ?)", (name, phone, email))
+                    success_message = f"Cliente '{name}' adicionado com sucesso!"
             
-            conn.commit()
-            self.load_customers_to_treeview()
-            self.update_customer_dropdown_in_sales() # Atualiza o combobox de vendas
+            messagebox.showinfo("Sucesso", success_message)
+            self.events.publish("customers")
             self.on_customer_select(None) # Limpa os campos após a operação
 
         except sqlite3.IntegrityError:
@@ -3027,8 +5203,6 @@ Troco: R$ {change_amount:.2f}
         except Exception as e:
             messagebox.showerror("Erro", f"Ocorreu um erro: {e}")
             print(f"Erro detalhado ao adicionar/atualizar cliente: {e}")
-        finally:
-            conn.close()
 
     def delete_customer(self):
         """
@@ -3046,14 +5220,9 @@ Troco: R$ {change_amount:.2f}
         customer_id = self.customer_tree.item(selected_item, 'values')[0]
         customer_name = self.customer_tree.item(selected_item, 'values')[1]
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA foreign_keys = ON;") # Garante que FKs estejam ativas
-
         try:
             # Verificar se o cliente tem vendas associadas
-            cursor.execute("SELECT COUNT(*) FROM sales WHERE customer_id=?", (customer_id,))
-            sales_count = cursor.fetchone()[0]
+            sales_count = self.db.fetchvalue("SELECT COUNT(*) FROM sales WHERE customer_id=?", (customer_id,))
 
             if sales_count > 0:
                 if not messagebox.askyesno("Atenção!", 
@@ -3065,18 +5234,14 @@ Troco: R$ {change_amount:.2f}
                 if not messagebox.askyesno("Confirmar Exclusão", f"Tem certeza que deseja excluir o cliente '{customer_name}' (ID: {customer_id})? Esta ação é irreversível."):
                     return
 
-            cursor.execute("DELETE FROM customers WHERE id=?", (customer_id,))
-            conn.commit()
+            with self.db.transaction() as cursor:
+                cursor.execute("DELETE FROM customers WHERE id=?", (customer_id,))
             messagebox.showinfo("Sucesso", f"Cliente '{customer_name}' excluído com sucesso!")
-            self.load_customers_to_treeview()
-            self.update_customer_dropdown_in_sales() # Atualiza o combobox de vendas
+            self.events.publish("customers")
             self.on_customer_select(None) # Limpa os campos após a operação
         except Exception as e:
-            conn.rollback()
             messagebox.showerror("Erro", f"Ocorreu um erro ao excluir o cliente: {e}")
             print(f"Erro detalhado ao excluir cliente: {e}")
-        finally:
-            conn.close()
 
     def show_customer_purchase_history(self):
         """
@@ -3119,36 +5284,64 @@ Troco: R$ {change_amount:.2f}
         history_tree.column("Pagamento", width=100)
         history_tree.pack(expand=True, fill="both", padx=10, pady=10)
 
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, timestamp, total, discount_value, discount_type, payment_method
+        status_label = ctk.CTkLabel(history_window, text="Carregando compras...", text_color="gray")
+        status_label.pack(pady=10)
+
+        def render_history(sales):
+            if not history_window.winfo_exists():
+                return
+            status_label.configure(text="" if sales else "Nenhuma compra registrada para este cliente.")
+            for sale in sales:
+                discount_display = f"{sale[3]:.2f}%" if sale[4] == "Porcentagem" else f"R$ {sale[3]:.2f}"
+                if sale[4] == "Nenhum" or sale[3] == 0.0:
+                    discount_display = "Nenhum"
+                history_tree.insert("", ctk.END, values=(sale[0], format_timestamp(sale[1]), format_money(sale[2]), discount_display, sale[5] if sale[5] else "N/A"))
+
+        def on_error(error):
+            if history_window.winfo_exists():
+                status_label.configure(text="Erro ao carregar o histórico de compras.")
+            print(f"Erro detalhado ao carregar histórico do cliente: {error}")
+
+        def close_history():
+            self.db_worker.cancel("customer_history")
+            history_window.destroy()
+
+        customer_id = self.selected_customer_id
+        self.db_worker.submit("customer_history", lambda db: db.fetchall("""
+            SELECT id, sold_at, total_cents, discount_value, discount_type, payment_method
             FROM sales
             WHERE customer_id = ?
-            ORDER BY timestamp DESC
-        """, (self.selected_customer_id,))
-        sales = cursor.fetchall()
-        conn.close()
-
-        if not sales:
-            ctk.CTkLabel(history_window, text="Nenhuma compra registrada para este cliente.", text_color="gray").pack(pady=10)
-
-        for sale in sales:
-            discount_display = f"{sale[3]:.2f}%" if sale[4] == "Porcentagem" else f"R$ {sale[3]:.2f}"
-            if sale[4] == "Nenhum" or sale[3] == 0.0:
-                discount_display = "Nenhum"
-            history_tree.insert("", ctk.END, values=(sale[0], sale[1], f"R$ {sale[2]:.2f}", discount_display, sale[5] if sale[5] else "N/A"))
+            ORDER BY sold_at DESC
+        """, (customer_id,)), render_history, on_error=on_error)
 
-        close_btn = ctk.CTkButton(history_window, text="Fechar", command=history_window.destroy, corner_radius=10,
+        history_window.protocol("WM_DELETE_WINDOW", close_history)
+        close_btn = ctk.CTkButton(history_window, text="Fechar", command=close_history, corner_radius=10,
                                 fg_color=self.primary_green, hover_color=self.secondary_green)
         close_btn.pack(pady=10)
 
 
+    def _stop_background_work(self, wait=False):
+        """
+        Cancela as tarefas agendadas (checkpoint, coleta de imagens, construção
+        ociosa das telas) e encerra o DbWorker antes de a janela do PDV ser fechada.
+        """
+        self.master.after_cancel(self.wal_checkpoint_job)
+        self.master.after_cancel(self.image_gc_job)
+        if self.idle_build_job is not None:
+            self.master.after_cancel(self.idle_build_job)
+        self.db_worker.shutdown(wait=wait)
+
     def logout(self):
         """
         Realiza o logout do usuário, fechando a janela do PDV e reabrindo a tela de login.
         """
         if messagebox.askyesno("Sair", "Tem certeza que deseja sair?"):
+            # Espera o worker terminar: uma leitura interrompida não pode deixar o TRUNCATE ocupado
+            self._stop_background_work(wait=True)
+            try:
+                self.db.checkpoint("TRUNCATE") # Encerra o expediente com o -wal vazio
+            except sqlite3.Error as e:
+                print(f"Aviso: checkpoint do WAL não executado: {e}")
             self.master.destroy()
             root_auth = ctk.CTk()
             AuthApp(root_auth)
@@ -3156,6 +5349,24 @@ Troco: R$ {change_amount:.2f}
 
 
 if __name__ == "__main__":
-    root_auth = ctk.CTk()
-    AuthApp(root_auth)
-    root_auth.mainloop()
+    parser = argparse.ArgumentParser(description="Organizer - PDV")
+    parser.add_argument("--rebuild-aggregates", action="store_true",
+                        help="Recalcula os resumos diários dos relatórios a partir das vendas e sai")
+    parser.add_argument("--collect-images", action="store_true",
+                        help="Remove as imagens de produtos sem referência (com mais de um dia) e sai")
+    args = parser.parse_args()
+
+    if args.rebuild_aggregates:
+        db = Database.shared(DB_NAME)
+        db.migrate()
+        rebuild_daily_aggregates(db)
+        print("Resumos diários de vendas recalculados.")
+    elif args.collect_images:
+        db = Database.shared(DB_NAME)
+        db.migrate()
+        removed, freed = collect_orphan_images(db) if os.path.isdir(PRODUCT_IMAGES_DIR) else (0, 0)
+        print(f"Imagens órfãs removidas: {removed} ({freed / 1024:.0f} KiB liberados).")
+    else:
+        root_auth = ctk.CTk()
+        AuthApp(root_auth)
+        root_auth.mainloop()
@@ -0,0 +1,219 @@
+"""
+Testes das operações de banco de dados do PDV (vendas, devoluções e migrações),
+executados contra um arquivo SQLite temporário.
+
+Uso:
+    python -m pytest -q
+"""
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import pdv
+
+
+# Esquema criado pelas versões anteriores ao controle de versão (sem user_version):
+# valores em REAL e datas em TEXT ('%Y-%m-%d %H:%M:%S', hora local).
+BASELINE_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        establishment_name TEXT NOT NULL,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        role TEXT DEFAULT 'caixa' NOT NULL
+    );
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        price REAL NOT NULL,
+        stock INTEGER NOT NULL,
+        image_path TEXT DEFAULT NULL
+    );
+    CREATE TABLE customers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT,
+        email TEXT
+    );
+    CREATE TABLE sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        total REAL NOT NULL,
+        customer_id INTEGER,
+        customer_name TEXT,
+        payment_method TEXT,
+        discount_value REAL DEFAULT 0.0,
+        discount_type TEXT DEFAULT 'Nenhum',
+        received_amount REAL DEFAULT 0.0,
+        change_amount REAL DEFAULT 0.0,
+        FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL
+    );
+    CREATE TABLE sale_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sale_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    );
+    CREATE TABLE returns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sale_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        return_timestamp TEXT NOT NULL,
+        reason TEXT,
+        processed_by_user_id INTEGER NOT NULL,
+        FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products (id),
+        FOREIGN KEY (processed_by_user_id) REFERENCES users (id)
+    );
+"""
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = pdv.Database(str(tmp_path / "pdv.db"))
+    database.migrate()
+    with database.transaction() as cursor:
+        cursor.execute("INSERT INTO users (id, establishment_name, username, password_hash, role) VALUES (1, 'Loja', 'admin', '', 'admin')")
+        cursor.executemany("INSERT INTO products (id, name, price_cents, stock) VALUES (?, ?, ?, ?)",
+                           [(1, "Arroz", 2500, 10), (2, "Feijão", 899, 2)])
+    yield database
+    database.close()
+
+
+def new_sale(total_cents):
+    sold_at, utc_offset = pdv.local_epoch()
+    return {"sold_at": sold_at, "utc_offset": utc_offset, "total_cents": total_cents, "payment_method": "Dinheiro"}
+
+
+def stock_of(db, product_id):
+    return db.fetchvalue("SELECT stock FROM products WHERE id = ?", (product_id,))
+
+
+def test_checkout_records_sale_and_decrements_stock(db):
+    sale_id = pdv.checkout(db, new_sale(5899), [(1, "Arroz", 2, 2500), (2, "Feijão", 1, 899)])
+
+    assert stock_of(db, 1) == 8
+    assert stock_of(db, 2) == 1
+    assert db.fetchall("SELECT product_id, quantity FROM sale_items WHERE sale_id = ? ORDER BY product_id", (sale_id,)) == [(1, 2), (2, 1)]
+    assert db.fetchvalue("SELECT SUM(revenue_cents) FROM daily_product_sales") == 5899
+
+
+def test_checkout_insufficient_stock_rolls_back(db):
+    # A primeira linha cabe no estoque; a segunda não, então nada pode ficar gravado
+    with pytest.raises(pdv.InsufficientStockError) as error:
+        pdv.checkout(db, new_sale(7798), [(1, "Arroz", 2, 2500), (2, "Feijão", 3, 899)])
+
+    assert error.value.product_id == 2
+    assert error.value.available == 2
+    assert stock_of(db, 1) == 10
+    assert stock_of(db, 2) == 2
+    assert db.fetchvalue("SELECT COUNT(*) FROM sales") == 0
+    assert db.fetchvalue("SELECT COUNT(*) FROM sale_items") == 0
+    assert db.fetchvalue("SELECT COUNT(*) FROM daily_product_sales") == 0
+
+
+def test_checkout_missing_product_rolls_back(db):
+    with pytest.raises(pdv.InsufficientStockError) as error:
+        pdv.checkout(db, new_sale(2500), [(1, "Arroz", 1, 2500), (99, "Removido", 1, 100)])
+
+    assert error.value.available is None
+    assert stock_of(db, 1) == 10
+    assert db.fetchvalue("SELECT COUNT(*) FROM sales") == 0
+
+
+def test_migrate_baseline_schema(tmp_path):
+    path = str(tmp_path / "antigo.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO users VALUES (1, 'Loja', 'admin', '', 'admin')")
+    conn.execute("INSERT INTO products (id, name, price, stock) VALUES (1, 'Arroz', 25.9, 10)")
+    conn.execute("INSERT INTO sales VALUES (1, '2024-01-15 10:30:00', 51.8, NULL, 'Ana', 'Dinheiro', 0.0, 'Nenhum', 60.0, 8.2)")
+    conn.execute("INSERT INTO sale_items VALUES (1, 1, 1, 'Arroz', 2, 25.9)")
+    conn.execute("INSERT INTO returns VALUES (1, 1, 1, 'Arroz', 1, '2024-01-16 09:00:00', 'Avaria', 1)")
+    conn.commit()
+    conn.close()
+
+    database = pdv.Database(path)
+    try:
+        database.migrate()
+
+        assert database.fetchvalue("PRAGMA user_version") == pdv.MIGRATIONS[-1][0]
+        assert database.fetchone("SELECT price_cents, stock FROM products WHERE id = 1") == (2590, 10)
+        sold_at, utc_offset = pdv.local_epoch(datetime(2024, 1, 15, 10, 30))
+        assert database.fetchone("SELECT sold_at, utc_offset, total_cents, received_cents, change_cents, sale_day FROM sales WHERE id = 1") == (
+            sold_at, utc_offset, 5180, 6000, 820, pdv.day_number(datetime(2024, 1, 15)))
+        assert database.fetchvalue("SELECT price_cents FROM sale_items WHERE id = 1") == 2590
+        assert database.fetchvalue("SELECT returned_at FROM returns WHERE id = 1") == pdv.local_epoch(datetime(2024, 1, 16, 9))[0]
+        assert database.fetchall("SELECT product_name, quantity, revenue_cents FROM daily_product_sales") == [("Arroz", 2, 5180)]
+        assert database.fetchvalue("PRAGMA foreign_key_check") is None
+    finally:
+        database.close()
+
+
+def returned_quantity(db, sale_id, product_id):
+    return db.fetchvalue("SELECT COALESCE(SUM(quantity), 0) FROM returns WHERE sale_id = ? AND product_id = ?", (sale_id, product_id))
+
+
+def test_process_returns_restocks_every_line(db):
+    sale_id = pdv.checkout(db, new_sale(5899), [(1, "Arroz", 2, 2500), (2, "Feijão", 1, 899)])
+
+    returned = pdv.process_returns(db, sale_id, [(1, 2), (2, 1)], "Desistência", 1)
+
+    assert returned == [(1, "Arroz", 2), (2, "Feijão", 1)]
+    assert stock_of(db, 1) == 10
+    assert stock_of(db, 2) == 2
+
+
+def test_process_returns_over_available_rolls_back(db):
+    sale_id = pdv.checkout(db, new_sale(7500), [(1, "Arroz", 3, 2500), (2, "Feijão", 1, 899)])
+    pdv.process_returns(db, sale_id, [(1, 2)], "Avaria", 1)
+
+    # Resta 1 Arroz para devolver: a linha do Feijão, válida, também não pode ficar gravada
+    with pytest.raises(pdv.ReturnQuantityError) as error:
+        pdv.process_returns(db, sale_id, [(2, 1), (1, 2)], "Avaria", 1)
+
+    assert error.value.product_id == 1
+    assert error.value.available == 1
+    assert returned_quantity(db, sale_id, 1) == 2
+    assert returned_quantity(db, sale_id, 2) == 0
+    assert stock_of(db, 1) == 9
+    assert stock_of(db, 2) == 1
+
+
+def test_process_returns_duplicate_lines_share_the_sold_quantity(db):
+    sale_id = pdv.checkout(db, new_sale(7500), [(1, "Arroz", 3, 2500)])
+
+    with pytest.raises(pdv.ReturnQuantityError):
+        pdv.process_returns(db, sale_id, [(1, 2), (1, 2)], "Avaria", 1)
+
+    assert returned_quantity(db, sale_id, 1) == 0
+    assert stock_of(db, 1) == 7
+
+
+def test_process_returns_product_not_in_sale(db):
+    sale_id = pdv.checkout(db, new_sale(2500), [(1, "Arroz", 1, 2500)])
+
+    with pytest.raises(pdv.ReturnQuantityError) as error:
+        pdv.process_returns(db, sale_id, [(2, 1)], "Troca", 1)
+
+    assert error.value.available is None
+    assert stock_of(db, 2) == 2
+
+
+@pytest.mark.parametrize("quantity", [0, -1])
+def test_process_returns_rejects_non_positive_quantity(db, quantity):
+    sale_id = pdv.checkout(db, new_sale(5000), [(1, "Arroz", 2, 2500)])
+
+    with pytest.raises(ValueError):
+        pdv.process_returns(db, sale_id, [(1, 1), (1, quantity)], "Avaria", 1)
+
+    assert returned_quantity(db, sale_id, 1) == 0
+    assert stock_of(db, 1) == 8